@@ -12,87 +12,189 @@
 # When Bob writes files to ./files/bob, it indicates storing local state.
 # When Bob writes files to ./files/alice, it indicates send ingthat file to Alice.
 
+# The bit width of the inputs is given as the first command line argument, e.g. `python alice.py 8`, and defaults to 2.
+# Bob must use the same bit width.
+
+# Network mode: `python alice.py 8 --listen 127.0.0.1:5000` asks for Alice's input and then runs the whole protocol
+# with each Bob that connects, see network.py. An optional last argument selects the OT, 'elgamal' (default) or 'extension'.
+# Entering comma-separated values compares a batch of pairs in one session, and Bob must enter as many values.
+# Circuits are garbled ahead of the sessions by a garbled_circuit_pool, see garbling_pool.py.
+# `python alice.py 8 --serve 127.0.0.1:5000` instead runs the asyncio service of async_network.py, which serves many
+# Bobs and sessions at once, e.g. the bob_client of async_network.py. Its OT defaults to 'extension'.
+
+# 'pool_ot1' answers Bob's 'pool_ot1' to fill the pool of random OTs offline, see ot_pool.py.
+# When Bob's 'bob_ot1' used the pool, 'alice_ot1' derandomizes the random OTs instead of encrypting y_keys.
+
+# The steps take the bit width and Alice's input as arguments, so that cli.py can run them without the prompt.
+# The modules of network mode are imported only when it is used.
+
 # Author: Nikhil Vanjani
 ############################################################
 
-from garbled_gate import *
-from oblivious_transfer import alice_ot1
-from alice_and_bob import garbled_circuit_2bits, get_alice_keys, bit_decomposition
+from oblivious_transfer import alice_ot1, ciphertexts_to_bytes
+from ot_pool import random_ot_sender_pool, alice_rot1, ROT_MESSAGE_LENGTH
+from alice_and_bob import garble_circuit, get_alice_keys, bit_decomposition, get_seeded_input_keys
+from circuit import comparator_circuit
+from circuit_file import write_garbled_circuit, write_keys_file
 
+import metrics
+import os
 import pickle
+import sys
+
+POOL_PATH = "./files/alice/rot_pool.bin"
+# Master seed of the wire keys of the garbled circuit, the only state Alice keeps from 'garble'.
+SEED_PATH = "./files/alice/seed.bin"
+# Garbling options used in network mode.
+NETWORK_OPTIONS = {"half_gates": True, "fixed_key": True}
+
+# Returns the sender pool of random OTs stored locally, or an empty pool if there is none.
+def load_pool():
+	if os.path.exists(POOL_PATH):
+		return random_ot_sender_pool.load(POOL_PATH)
+	return random_ot_sender_pool()
+
+# Reads Bob's public keys for random OTs, encrypts random message pairs, sends the ciphertexts to Bob
+# and adds the message pairs to the pool of random OTs.
+def generate_alice_pool_ot1():
+	os.makedirs("./files/bob", exist_ok=True)
 
-
-# Generates the garbled circuit and the keys corresponding to inputs x and y.
-# Sends garbled_circuit to Bob and stores x_keys and y_keys as local state.
-def generate_garbled_circuit():
+	with open("./files/alice/bob_pool_pk.pkl", "rb") as file:
+		(first_index, bob_pool_pk) = pickle.load(file)
+	pool = load_pool()
+	if first_index != pool.next_index():
+		raise ValueError('generate_alice_pool_ot1: Bob\'s pool ends at {}, Alice\'s pool ends at {}'.format(first_index, pool.next_index()))
+
+	entries = []
+	alice_pool_ct = {0: {}}
+	for j, (b_0, b_1) in enumerate(bob_pool_pk):
+		(m_0, m_1) = (os.urandom(ROT_MESSAGE_LENGTH), os.urandom(ROT_MESSAGE_LENGTH))
+		(ct_0, ct_1) = alice_ot1(b_0, b_1, m_0, m_1)
+		alice_pool_ct[0][j] = ciphertexts_to_bytes(ct_0, ct_1)
+		entries.append((m_0, m_1))
+	write_keys_file("./files/bob/alice_pool_ct.bin", alice_pool_ct)
+	pool.extend(entries)
+	pool.save(POOL_PATH)
+	os.remove("./files/alice/bob_pool_pk.pkl")
+	print("Random OT pool: {} random OTs".format(len(pool)))
+
+
+# Generates the garbled circuit, with all keys derived from a fresh seed.
+# Sends garbled_circuit to Bob and stores only the seed as local state, see load_input_keys.
+def generate_garbled_circuit(num_bits: int):
 	os.makedirs("./files/alice", exist_ok=True)
 	os.makedirs("./files/bob", exist_ok=True)
 
-	(garbled_circuit, x_keys, y_keys) = garbled_circuit_2bits()
-	with open("./files/bob/garbled_circuit.pkl", "wb") as file:
-		pickle.dump(garbled_circuit, file)
-	with open("./files/alice/x_keys.pkl", "wb") as file:
-		pickle.dump(x_keys, file)
-	with open("./files/alice/y_keys.pkl", "wb") as file:
-		pickle.dump(y_keys, file)
-
-# Reads x_keys from local state and sends keys correponding to alice's input to Bob.
-def generate_alice_keys():
+	circ = comparator_circuit(num_bits)
+	seed = os.urandom(16)
+	(garbled_circuit, _, _) = garble_circuit(circ, seed=seed)
+	write_garbled_circuit("./files/bob/garbled_circuit.gc", circ, garbled_circuit)
+	with open(SEED_PATH, "wb") as file:
+		file.write(seed)
+
+# Recomputes x_keys and y_keys from the seed stored by generate_garbled_circuit.
+def load_input_keys(num_bits: int):
+	with open(SEED_PATH, "rb") as file:
+		seed = file.read()
+	return get_seeded_input_keys(comparator_circuit(num_bits), seed)
+
+# Recomputes x_keys from local state and sends keys correponding to alice's input to Bob.
+def generate_alice_keys(num_bits: int, alice_input: int):
 	os.makedirs("./files/bob", exist_ok=True)
 
-	# alice_input = 1
-	alice_input = int(input("Enter Alice's input: "))
-	alice_bits = bit_decomposition(alice_input)
+	alice_bits = bit_decomposition(alice_input, num_bits)
 
-	with open("./files/alice/x_keys.pkl", "rb") as file:
-		x_keys = pickle.load(file)
+	(x_keys, _) = load_input_keys(num_bits)
 
-	alice_keys = get_alice_keys(x_keys, alice_bits[0], alice_bits[1])
-	with open("./files/bob/alice_keys.pkl", "wb") as file:
-		pickle.dump(alice_keys, file)
+	alice_keys = get_alice_keys(x_keys, *alice_bits)
+	write_keys_file("./files/bob/alice_keys.bin", alice_keys)
 
-# Reads y_keys from local state, bob_all_pk obtained from Bob's 1st message of OT protocol
+# Recomputes y_keys from local state, bob_all_pk obtained from Bob's 1st message of OT protocol
 # and computes encryptions of y_keys and sends all the ciphertexts to Bob.
-def generate_alice_ot1():
+def generate_alice_ot1(num_bits: int):
 	os.makedirs("./files/bob", exist_ok=True)
 
-	with open("./files/alice/y_keys.pkl", "rb") as file:
-		y_keys = pickle.load(file)
+	(_, y_keys) = load_input_keys(num_bits)
+
+	if os.path.exists("./files/alice/bob_rot_choices.pkl"):
+		# Online phase with the pool of random OTs.
+		with open("./files/alice/bob_rot_choices.pkl", "rb") as file:
+			(first_index, e) = pickle.load(file)
+		pairs = [(i, j) for i in range(len(y_keys)) for j in range(len(y_keys[i][0]))]
+		pool = load_pool()
+		masked = alice_rot1(pool, first_index, e, [(y_keys[i][0][j], y_keys[i][1][j]) for (i, j) in pairs])
+		pool.save(POOL_PATH)
+		alice_all_ct = {}
+		for ((i, j), ct) in zip(pairs, masked):
+			alice_all_ct.setdefault(i, {})[j] = ct
+		write_keys_file("./files/bob/alice_all_ct.bin", alice_all_ct)
+		os.remove("./files/alice/bob_rot_choices.pkl")
+		return
 
 	with open("./files/alice/bob_all_pk.pkl", "rb") as file:
 		bob_all_pk = pickle.load(file)
 		# print("bob_all_pk: {}".format(bob_all_pk))
 
-	# indicates that the first input feeds into 2 gates and second input feeds into one gate.
-	count_per_bit = [2, 1]
 	alice_all_ct = {}
-	for i in range(2):
+	for i in range(len(y_keys)):
 		yi_keys = y_keys[i]
 		alice_all_ct[i] = {}
-		for j in range(count_per_bit[i]):
+		# yi_keys[0] has one key for each gate that the input bit feeds into.
+		for j in range(len(yi_keys[0])):
 			(b_0, b_1) = bob_all_pk[i][j]
 			(ct_0, ct_1) = alice_ot1(b_0, b_1, yi_keys[0][j], yi_keys[1][j])
-			alice_all_ct[i][j] = (ct_0, ct_1)
+			alice_all_ct[i][j] = ciphertexts_to_bytes(ct_0, ct_1)
 
-	with open("./files/bob/alice_all_ct.pkl", "wb") as file:
-		pickle.dump(alice_all_ct, file)
+	write_keys_file("./files/bob/alice_all_ct.bin", alice_all_ct)
 
 def unknown_command():
-    print("Unknown command. Try 'garble' or 'alice_keys' or 'alice_ot1'.")
-
-# Command mapping
-commands = {
-    "garble": generate_garbled_circuit,
-    "alice_keys": generate_alice_keys,
-    "alice_ot1": generate_alice_ot1,
-}
-
-while True:
-    user_input = input("Enter a command ('exit' to quit): ").strip().lower()
-    
-    if user_input == "exit":
-        print("Exiting program.")
-        break
-
-    # Execute the corresponding function if the command exists
-    commands.get(user_input, unknown_command)()
\ No newline at end of file
+	print("Unknown command. Try 'pool_ot1' or 'garble' or 'alice_keys' or 'alice_ot1'.")
+
+if __name__ == '__main__':
+	NUM_BITS = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+	# Serves metrics on http://127.0.0.1:$GC_METRICS_PORT/metrics if that environment variable is set, see metrics.py.
+	metrics.configure_from_environment()
+
+	# Command mapping
+	commands = {
+		"pool_ot1": generate_alice_pool_ot1,
+		"garble": lambda: generate_garbled_circuit(NUM_BITS),
+		"alice_keys": lambda: generate_alice_keys(NUM_BITS, int(input("Enter Alice's input: "))),
+		"alice_ot1": lambda: generate_alice_ot1(NUM_BITS),
+	}
+
+	if len(sys.argv) > 3 and sys.argv[2] == "--listen":
+		from network import serve_alice, parse_address, parse_values
+		from garbling_pool import garbled_circuit_pool, comparator_shape
+
+		alice_input = parse_values(input("Enter Alice's input (comma-separated values for a batch): "))
+		(host, port) = parse_address(sys.argv[3])
+		ot_method = sys.argv[4] if len(sys.argv) > 4 else "elgamal"
+		# Garbles the circuit of the next session in the background while the current one runs.
+		num_pairs = len(alice_input) if isinstance(alice_input, list) else 1
+		garbling_pool = garbled_circuit_pool({comparator_shape(NUM_BITS, num_pairs, NETWORK_OPTIONS): 1})
+		garbling_pool.start()
+		print("Listening on {}:{}".format(host, port))
+		serve_alice(host, port, NUM_BITS, alice_input, NETWORK_OPTIONS, ot_method, garbling_pool=garbling_pool)
+
+	if len(sys.argv) > 3 and sys.argv[2] == "--serve":
+		from network import parse_address, parse_values
+		from async_network import alice_service
+		import asyncio
+
+		alice_input = parse_values(input("Enter Alice's input (comma-separated values for a batch): "))
+		(host, port) = parse_address(sys.argv[3])
+		ot_method = sys.argv[4] if len(sys.argv) > 4 else "extension"
+		service = alice_service(NUM_BITS, alice_input, NETWORK_OPTIONS, ot_method)
+		print("Serving on {}:{}".format(host, port))
+		asyncio.run(service.serve_forever(host, port))
+
+	while True:
+		user_input = input("Enter a command ('exit' to quit): ").strip().lower()
+
+		if user_input == "exit":
+			print("Exiting program.")
+			break
+
+		# Execute the corresponding function if the command exists
+		commands.get(user_input, unknown_command)()
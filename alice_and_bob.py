@@ -8,7 +8,13 @@
 ############################################################
 
 from garbled_gate import *
+from circuit import comparator_circuit, batch_comparator_circuit, COMPARATOR_CIRCUITS
 from oblivious_transfer import bob_ot1, alice_ot1, bob_ot2
+from oblivious_transfer import OT_EXTENSION_KAPPA, bob_ot_ext_setup1, alice_ot_ext_setup1, bob_ot_ext_setup, alice_ot_ext_setup2, bob_ot_ext1, alice_ot_ext1, bob_ot_ext2
+from ot_pool import random_ot_sender_pool, random_ot_receiver_pool, random_ot_refiller, generate_random_ots, bob_rot1, alice_rot1, bob_rot2
+import metrics
+import pickle
+import random
 import time
 
 # Helper function
@@ -18,189 +24,337 @@ def init_wire_keys():
 	wire_keys_dict[1] = {}
 	return wire_keys_dict
 
-# Generates Garbled circuit for x >= y, where x and y are both of length 2 bits.
+# Garbles the circuit circ gate by gate in topological order.
+# Keys are sampled for every input wire, and for every gate output wire that is not an output of circ.
+# Gates on the output wires of circ are garbled so that evaluating them gives the plain output bytes.
+# If free_xor = True, all keys share a global offset R and the gates in FREE_XOR_GATES are free,
+# i.e. they have no table and their output keys are derived from their input keys.
+# If point_and_permute = True, the keys of every wire have different select bits and the remaining gates are garbled
+# as point-and-permute tables, see garbled_gate_pp.
+# If half_gates = True, free_xor and point_and_permute are implied and the remaining gates, which must be AND-type,
+# are garbled with two ciphertexts each, see half_gate. The index of a gate in circ.gates is its gate_id.
+# If fixed_key = True, point_and_permute is implied and the tables are computed with a fixed_key_hash whose AES key is
+# sampled and scheduled once per circuit, instead of Salsa20 (point-and-permute tables) or SHA256 (half gates).
+# If seed is given, all keys (and R and the fixed-key AES key) are derived from it with a wire_key_prf instead of being
+# sampled, so the garbler only needs to store the seed, see get_seeded_input_keys. With half gates or fixed-key AES,
+# the garbled circuit is then deterministic too. Salsa20 tables still use random nonces.
+# Returns (garbled_circuit, x_keys, y_keys), where garbled_circuit is the tuple of garbled gates in the order of circ.gates,
+# and x_keys[i][b][j] (resp. y_keys[i][b][j]) is the key for bit b on the j-th fan-out wire of input bit i of x (resp. y).
+def garble_circuit(circ, free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False, seed=None):
+	with metrics.phase("garble"):
+		(gate_stream, x_keys, y_keys) = garble_circuit_stream(circ, free_xor, point_and_permute, half_gates, fixed_key, seed)
+		return (tuple(gate_stream), x_keys, y_keys)
+
+# Streaming version of garble_circuit with the same options.
+# Returns (gate_stream, x_keys, y_keys), where gate_stream is a generator that garbles the gates of circ one at a time
+# in topological order and yields the garbled gates.
+# The keys of a wire are dropped once the last gate reading it has been garbled, so apart from x_keys and y_keys
+# the memory used is bounded by the number of live wires of circ and not by its number of gates.
+def garble_circuit_stream(circ, free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False, seed=None):
+	(point_and_permute, R, H, prf) = get_garbling_parameters(free_xor, point_and_permute, half_gates, fixed_key, seed)
+	wire_keys = get_input_wire_keys(circ, R, point_and_permute, prf)
+	x_keys = get_input_keys(circ.x_wires, wire_keys)
+	y_keys = get_input_keys(circ.y_wires, wire_keys)
+	count_gates(circ, "garble")
+
+	def gate_stream():
+		output_wires = set(circ.output_wires)
+		last_uses = circ.get_last_uses()
+		for gate_id, (gate_name, left_wire, right_wire, out_wire) in enumerate(circ.gates):
+			(garbling, P_out) = garble_circuit_gate(gate_id, gate_name, wire_keys[left_wire], wire_keys[right_wire],
+				out_wire in output_wires, R, point_and_permute, half_gates, H, prf, out_wire)
+			wire_keys[out_wire] = P_out
+			release_wires(wire_keys, last_uses, gate_id, (left_wire, right_wire, out_wire))
+			yield garbling
+
+	return (gate_stream(), x_keys, y_keys)
+
+# Returns (point_and_permute, R, H, prf) for the garbling options of garble_circuit: point_and_permute as implied by
+# the options, the Free-XOR offset R or None, the fixed_key_hash H or None, and the wire_key_prf of seed or None.
+def get_garbling_parameters(free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False, seed=None):
+	if half_gates:
+		free_xor = True
+		point_and_permute = True
+	if fixed_key:
+		point_and_permute = True
+	prf = wire_key_prf(seed) if seed is not None else None
+	if free_xor:
+		R = prf.free_xor_offset() if prf is not None else generate_free_xor_offset()
+	else:
+		R = None
+	if fixed_key:
+		H = prf.fixed_key_hash() if prf is not None else fixed_key_hash()
+	else:
+		H = None
+	return (point_and_permute, R, H, prf)
+
+# Returns the dict mapping every input wire of circ to its pair of keys, sampled or derived with prf.
+def get_input_wire_keys(circ, R, point_and_permute, prf=None) -> dict:
+	wire_keys = {}
+	for input_wires in (circ.x_wires, circ.y_wires):
+		for wires in input_wires.values():
+			for wire in wires:
+				if prf is not None:
+					wire_keys[wire] = prf.wire_keys(wire, R, point_and_permute)
+				else:
+					wire_keys[wire] = sample_wire_keys(R, point_and_permute)
+	return wire_keys
+
+# Recomputes the x_keys and y_keys of garble_circuit(circ, ..., seed=seed) from the seed, without garbling.
+def get_seeded_input_keys(circ, seed, free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False):
+	(point_and_permute, R, _, prf) = get_garbling_parameters(free_xor, point_and_permute, half_gates, fixed_key, seed)
+	wire_keys = get_input_wire_keys(circ, R, point_and_permute, prf)
+	return (get_input_keys(circ.x_wires, wire_keys), get_input_keys(circ.y_wires, wire_keys))
+
+# Returns (seed, i, bit) for the first seed from start on for which a key of bit of Bob's input bit i in
+# garble_circuit(circ, ..., seed=seed) starts with a zero byte. If i or bit is None, any input bit or bit value will do.
+# Elgamal decryption drops leading zero bytes, so the tests of the Elgamal OT give Bob such a key.
+def leading_zero_seed(circ, start: int = 0, i: int = None, bit: int = None, **options) -> (bytes, int, int):
+	seed = start
+	while True:
+		(_, y_keys) = get_seeded_input_keys(circ, seed.to_bytes(16, byteorder='big'), **options)
+		for k in (y_keys if i is None else (i,)):
+			for b in ((0, 1) if bit is None else (bit,)):
+				if any(key[0] == 0 for key in y_keys[k][b].values()):
+					return (seed.to_bytes(16, byteorder='big'), k, b)
+		seed += 1
+
+# Garbles the gate gate_id of a circuit, gate_name(P_left, P_right), where P_left and P_right are the pairs of keys
+# of its input wires. plain = True if the gate is on an output wire of the circuit.
+# R is the Free-XOR offset or None, and H the fixed_key_hash or None, see garble_circuit_stream.
+# If prf is given, the keys of the output wire out_wire are derived with it instead of being sampled.
+# Returns (garbling, P_out), where P_out[b] is the key for bit b on the output wire, or None if plain = True.
+def garble_circuit_gate(gate_id, gate_name, P_left, P_right, plain, R, point_and_permute, half_gates, H, prf=None, out_wire=None):
+	if R is not None and gate_name in FREE_XOR_GATES:
+		return garble_free_xor(P_left[0], P_right[0], R, FREE_XOR_GATES[gate_name], plain)
+	if half_gates:
+		truth_table = GATE_TRUTH_TABLES[gate_name](True)
+		return garble_half_gate(P_left[0], P_right[0], R, truth_table, gate_id, plain, H or hash_tweak)
+	if plain:
+		P_out = {0: None, 1: None}
+		truth_table = GATE_TRUTH_TABLES[gate_name](True)
+	else:
+		P_out = prf.wire_keys(out_wire, R, point_and_permute) if prf is not None else sample_wire_keys(R, point_and_permute)
+		truth_table = GATE_TRUTH_TABLES[gate_name](False, P_out[0], P_out[1])
+	garbling = garble(P_left[0], P_left[1], P_right[0], P_right[1], P_out[0], P_out[1], truth_table, point_and_permute, H, gate_id)
+	return (garbling, P_out)
+
+# Batch version of garble_circuit_gate for independent gates, e.g. the gates of one layer of a circuit.
+# gates holds (gate_id, gate_name, plain, out_wire) tuples, and P_lefts[k] / P_rights[k] are the pairs of keys of the
+# input wires of gate k. Half gates are garbled with garble_half_gate_batch and fixed-key point-and-permute tables
+# with garble_batch, so that all their hashes take one AES call, see garbled_gate.py.
+# Returns the list of (garbling, P_out) of the gates, see garble_circuit_gate.
+def garble_circuit_gates(gates, P_lefts, P_rights, R, point_and_permute, half_gates, H, prf=None) -> list:
+	results = [None] * len(gates)
+	batch = []
+	for k, (gate_id, gate_name, plain, out_wire) in enumerate(gates):
+		if (R is not None and gate_name in FREE_XOR_GATES) or not (half_gates or (point_and_permute and H is not None)):
+			results[k] = garble_circuit_gate(gate_id, gate_name, P_lefts[k], P_rights[k], plain, R, point_and_permute, half_gates, H, prf, out_wire)
+		else:
+			batch.append(k)
+	if half_gates:
+		(garblings, P_outs) = garble_half_gate_batch([P_lefts[k][0] for k in batch], [P_rights[k][0] for k in batch], R,
+			[GATE_TRUTH_TABLES[gates[k][1]](True) for k in batch], [gates[k][0] for k in batch], [gates[k][2] for k in batch], H or hash_tweak)
+	else:
+		P_outs = []
+		truth_tables = []
+		for k in batch:
+			(_, gate_name, plain, out_wire) = gates[k]
+			if plain:
+				P_outs.append({0: None, 1: None})
+				truth_tables.append(GATE_TRUTH_TABLES[gate_name](True))
+			else:
+				P_out = prf.wire_keys(out_wire, R, point_and_permute) if prf is not None else sample_wire_keys(R, point_and_permute)
+				P_outs.append(P_out)
+				truth_tables.append(GATE_TRUTH_TABLES[gate_name](False, P_out[0], P_out[1]))
+		garblings = garble_batch([P_lefts[k] for k in batch], [P_rights[k] for k in batch], truth_tables, point_and_permute, H, [gates[k][0] for k in batch])
+	for (k, garbling, P_out) in zip(batch, garblings, P_outs):
+		results[k] = (garbling, P_out)
+	return results
+
+# Reports the number of gates of each type of circ to the metrics hooks, see metrics.py.
+def count_gates(circ, role: str):
+	if metrics.enabled:
+		for (gate_name, num_gates) in circ.gate_counts().items():
+			metrics.count("gates_total", num_gates, gate=gate_name, role=role)
+
+# Drops the values of the given wires whose last use is the gate gate_id.
+def release_wires(wire_vals, last_uses, gate_id, wires):
+	for wire in wires:
+		if last_uses.get(wire, gate_id) == gate_id:
+			wire_vals.pop(wire, None)
+
+# Collects the keys of the input wires into the x_keys / y_keys format described in garble_circuit.
+def get_input_keys(input_wires, wire_keys) -> dict:
+	input_keys = {}
+	for i, wires in input_wires.items():
+		input_keys[i] = init_wire_keys()
+		for j, wire in enumerate(wires):
+			input_keys[i][0][j] = wire_keys[wire][0]
+			input_keys[i][1][j] = wire_keys[wire][1]
+	return input_keys
+
+# Generates Garbled circuit for x >= y, where x and y are both of length num_bits bits.
 # x is alice's inputs.
 # y is bob's inputs.
+# See comparator_circuit in circuit.py for the structure of the circuit.
+# If free_xor = True, the EQ gates are garbled as free XNOR gates.
+# If point_and_permute = True, the garbled tables are point-and-permute tables.
+# If half_gates = True, the gates other than EQ are garbled with two ciphertexts each.
+# If fixed_key = True, the tables are computed with fixed-key AES. See garble_circuit.
+# If seed is given, the keys are derived from it, see garble_circuit.
+# shape selects the comparator of COMPARATOR_CIRCUITS in circuit.py. Both shapes take the same inputs, so the keys
+# are used in the same way, see get_count_per_bit.
+def garbled_circuit_nbits(num_bits, free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False, seed=None, shape="ripple"):
+	return garble_circuit(COMPARATOR_CIRCUITS[shape](num_bits), free_xor, point_and_permute, half_gates, fixed_key, seed)
+
+# Generates Garbled circuit for x >= y, where x and y are both of length 2 bits.
 # Suppose x = (x0, x1), y = (y0, y1).
 # x >= y is equivalent to: 
 # (x0 > y0) OR ((x0 = y0) AND (x1 >= y1))
 def garbled_circuit_2bits():
-	# We sample gate keys in reverse order as follows
-	# OR 
-	# 	x0 > y0
-	# 	AND 
-	# 		x0 = y0
-	# 		x1 >= y1
-
-	# OR gate
-	P_or_left = {}
-	P_or_left[0] = os.urandom(16)
-	P_or_left[1] = os.urandom(16)
-	P_or_right = {}
-	P_or_right[0] = os.urandom(16)
-	P_or_right[1] = os.urandom(16)
-	P_or_out = {}
-	P_or_out[0] = os.urandom(16)
-	P_or_out[1] = os.urandom(16)
-	truth_table_or = get_truth_table_or(plain=True)
-	garbled_or = garble(P_or_left[0], P_or_left[1], P_or_right[0], P_or_right[1], P_or_out[0], P_or_out[1], truth_table_or)
-
-	# x0 > y0
-	P_gt_left = {}
-	P_gt_left[0] = os.urandom(16)
-	P_gt_left[1] = os.urandom(16)
-	P_gt_right = {}
-	P_gt_right[0] = os.urandom(16)
-	P_gt_right[1] = os.urandom(16)
-	truth_table_gt = get_truth_table_gt(False, P_or_left[0], P_or_left[1])
-	# The output wire of this gate is the left input wire of OR gate.
-	garbled_gt = garble(P_gt_left[0], P_gt_left[1], P_gt_right[0], P_gt_right[1], P_or_left[0], P_or_left[1], truth_table_gt)
-
-	# AND gate
-	P_and_left = {}
-	P_and_left[0] = os.urandom(16)
-	P_and_left[1] = os.urandom(16)
-	P_and_right = {}
-	P_and_right[0] = os.urandom(16)
-	P_and_right[1] = os.urandom(16)
-	truth_table_and = get_truth_table_and(False, P_or_right[0], P_or_right[1])
-	# The output wire of this gate is the right input wire of OR gate.
-	garbled_and = garble(P_and_left[0], P_and_left[1], P_and_right[0], P_and_right[1], P_or_right[0], P_or_right[1], truth_table_and)
-
-	# x0 = y0
-	P_eq_left = {}
-	P_eq_left[0] = os.urandom(16)
-	P_eq_left[1] = os.urandom(16)
-	P_eq_right = {}
-	P_eq_right[0] = os.urandom(16)
-	P_eq_right[1] = os.urandom(16)
-	truth_table_eq = get_truth_table_eq(False, P_and_left[0], P_and_left[1])
-	# The output wire of this gate is the left input wire of AND gate.
-	garbled_eq = garble(P_eq_left[0], P_eq_left[1], P_eq_right[0], P_eq_right[1], P_and_left[0], P_and_left[1], truth_table_eq)
-
-	# x1 >= y1
-	P_geq_left = {}
-	P_geq_left[0] = os.urandom(16)
-	P_geq_left[1] = os.urandom(16)
-	P_geq_right = {}
-	P_geq_right[0] = os.urandom(16)
-	P_geq_right[1] = os.urandom(16)
-	truth_table_geq = get_truth_table_geq(False, P_and_right[0], P_and_right[1])
-	# The output wire of this gate is the right input wire of AND gate.
-	garbled_geq = garble(P_geq_left[0], P_geq_left[1], P_geq_right[0], P_geq_right[1], P_and_right[0], P_and_right[1], truth_table_geq)
-
-	garbled_circuit = (garbled_geq, garbled_eq, garbled_and, garbled_gt, garbled_or)
-
-	# keys for input x
-	x_keys = {}
-	# keys for bit x0
-	x_keys[0] = init_wire_keys()
-	# x0 feeds as input to two gates: gt, eq
-	# inputs for gate: gt
-	x_keys[0][0][0] = P_gt_left[0]
-	x_keys[0][1][0] = P_gt_left[1]
-	# inputs for gate: eq
-	x_keys[0][0][1] = P_eq_left[0]
-	x_keys[0][1][1] = P_eq_left[1]
-	# keys for bit x1
-	x_keys[1] = init_wire_keys()
-	# x1 feeds as input to one gates: geq
-	x_keys[1][0][0] = P_geq_left[0]
-	x_keys[1][1][0] = P_geq_left[1]
-
-	# keys for input y
-	y_keys = {}
-	# keys for bit y0
-	y_keys[0] = init_wire_keys()
-	# y0 feeds as input to two gates: gt, eq
-	# inputs for gate: gt
-	y_keys[0][0][0] = P_gt_right[0]
-	y_keys[0][1][0] = P_gt_right[1]
-	# inputs for gate: eq
-	y_keys[0][0][1] = P_eq_right[0]
-	y_keys[0][1][1] = P_eq_right[1]
-	# keys for bit y1
-	y_keys[1] = init_wire_keys()
-	# x1 feeds as input to one gates: geq
-	y_keys[1][0][0] = P_geq_right[0]
-	y_keys[1][1][0] = P_geq_right[1]
-
-	return (garbled_circuit, x_keys, y_keys)
-
-# Returns the keys corresponding to alice's input x
-def get_alice_keys(x_keys, bit_0, bit_1) -> dict:
-	alice_keys = {}
-	alice_keys[0] = x_keys[0][bit_0]
-	alice_keys[1] = x_keys[1][bit_1]
-	return alice_keys
-
-# Returns the keys corresponding to bob's input y. This is done via OT.
-def get_bob_keys(y_keys, bit_0, bit_1) -> dict:
-	bits_bool = [True, True]
-	if bit_0 == 0:
-		bits_bool[0] = False
-	if bit_1 == 0:
-		bits_bool[1] = False
-	bob_keys = {}
-	bob_keys[0] = {}
-	bob_keys[1] = {}
-	#  Get keys for all the input bits
-	for i in range(2):
-		yi_keys = y_keys[i]
-		#  For each input bit, get the keys for each time it feeds as input into a gate
-		for j in range(len(yi_keys[0])):
-			bob_ot1_st = time.time()
-			((b_0, b_1), bob_sk) = bob_ot1(bits_bool[i])
-			bob_ot1_et = time.time()
-			bob_ot1_time = bob_ot1_et - bob_ot1_st
-			print("bob_ot1_time: {}".format(bob_ot1_time))
-
-			alice_ot1_st = time.time()
-			(ct_0, ct_1) = alice_ot1(b_0, b_1, yi_keys[0][j], yi_keys[1][j])
-			alice_ot1_et = time.time()
-			alice_ot1_time = alice_ot1_et - alice_ot1_st
-			print("alice_ot1_time: {}".format(alice_ot1_time))
-
-			bob_ot2_st = time.time()
-			msg = bob_ot2(bits_bool[i], bob_sk, ct_0, ct_1)
-			bob_ot2_et = time.time()
-			bob_ot2_time = bob_ot2_et - bob_ot2_st
-			print("bob_ot2_time: {}".format(bob_ot2_time))
-
+	return garbled_circuit_nbits(2)
+
+# Generates one garbled circuit for num_pairs comparisons x_c >= y_c of num_bits bit values, see batch_comparator_circuit.
+# The keys of x_c (resp. y_c) are x_keys[c * num_bits + i] (resp. y_keys[c * num_bits + i]), see batch_bit_decomposition.
+def garbled_circuit_batch(num_bits, num_pairs, free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False, seed=None):
+	return garble_circuit(batch_comparator_circuit(num_bits, num_pairs), free_xor, point_and_permute, half_gates, fixed_key, seed)
+
+# Returns the number of gates each input bit of the num_bits comparator feeds into.
+# For example, for num_bits = 2 the first input bit feeds into 2 gates and the second input bit feeds into one gate.
+# With num_pairs > 1, the counts are repeated for each comparison of the batch comparator.
+def get_count_per_bit(num_bits, num_pairs=1) -> list:
+	circ = comparator_circuit(num_bits)
+	return [len(circ.y_wires[i]) for i in range(num_bits)] * num_pairs
+
+# Returns the keys corresponding to alice's input x, given as its bits (x0, x1, ...).
+# The bits of all the values of a batch can be passed at once, see batch_bit_decomposition.
+def get_alice_keys(x_keys, *bits) -> dict:
+	return {i: x_keys[i][bit] for (i, bit) in enumerate(bits)}
+
+# Returns the keys corresponding to bob's input y, given as its bits (y0, y1, ...). This is done via OT.
+def get_bob_keys(y_keys, *bits) -> dict:
+	with metrics.phase("ot"):
+		bits_bool = [bit != 0 for bit in bits]
+		bob_keys = {}
+		#  Get keys for all the input bits
+		for i in range(len(bits)):
+			bob_keys[i] = {}
+			yi_keys = y_keys[i]
+			#  For each input bit, get the keys for each time it feeds as input into a gate
+			for j in range(len(yi_keys[0])):
+				((b_0, b_1), bob_sk) = bob_ot1(bits_bool[i])
+				(ct_0, ct_1) = alice_ot1(b_0, b_1, yi_keys[0][j], yi_keys[1][j])
+				bob_keys[i][j] = bob_ot2(bits_bool[i], bob_sk, ct_0, ct_1)
+
+		return bob_keys
+
+# Runs the kappa base OTs of OT extension once, see oblivious_transfer.py.
+# Returns (sender, receiver), the states of Alice and Bob, which are reused by every call of get_bob_keys_ot_extension.
+def setup_ot_extension(kappa=OT_EXTENSION_KAPPA):
+	(bob_public_key, bob_setup_state) = bob_ot_ext_setup1()
+	(alice_all_B, setup_state) = alice_ot_ext_setup1(bob_public_key, kappa)
+	(bob_all_ct, receiver) = bob_ot_ext_setup(bob_setup_state, alice_all_B)
+	sender = alice_ot_ext_setup2(setup_state, bob_all_ct)
+	return (sender, receiver)
+
+# Same as get_bob_keys, but all the keys are obtained in a single batch of OT extension,
+# so no public key operation is done after setup_ot_extension.
+def get_bob_keys_ot_extension(sender, receiver, y_keys, *bits) -> dict:
+	with metrics.phase("ot"):
+		pairs = [(i, j) for i in range(len(bits)) for j in range(len(y_keys[i][0]))]
+		choices = [bits[i] != 0 for (i, _) in pairs]
+		msgs = [(y_keys[i][0][j], y_keys[i][1][j]) for (i, j) in pairs]
+
+		(u, batch_state) = bob_ot_ext1(receiver, choices)
+		alice_all_ct = alice_ot_ext1(sender, u, msgs)
+		received = bob_ot_ext2(batch_state, alice_all_ct)
+
+		bob_keys = {i: {} for i in range(len(bits))}
+		for ((i, j), msg) in zip(pairs, received):
 			bob_keys[i][j] = msg
-
-	return bob_keys
-
-# Evaluate the garbled circuit sequentially from input layer to output layer.
-def evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys) -> int:
-	(garbled_geq, garbled_eq, garbled_and, garbled_gt, garbled_or) = garbled_circuit
-
-	# evaluate x2 >= y2
-	val_geq = evaluate(garbled_geq, alice_keys[1][0], bob_keys[1][0])
-	# evaluate x1 = y1
-	val_eq = evaluate(garbled_eq, alice_keys[0][1], bob_keys[0][1])
-	# evaluate AND gate
-	val_and = evaluate(garbled_and, val_eq, val_geq)
-	# evaluate x1 > y1
-	val_gt = evaluate(garbled_gt, alice_keys[0][0], bob_keys[0][0])
-	# evaluate OR gate
-	val_or = evaluate(garbled_or, val_gt, val_and)
-	# Return the integer value corresponding to the bytes object val_or
-	return int.from_bytes(val_or, byteorder='big')
+		return bob_keys
+
+# Same as get_bob_keys, but the OTs are taken from precomputed pools of random OTs, see ot_pool.py.
+# Online, this costs one XOR per bit of each key. The refiller, if given, is notified so that it can top up the pools.
+def get_bob_keys_random_ot(sender_pool, receiver_pool, y_keys, *bits, refiller=None) -> dict:
+	with metrics.phase("ot"):
+		pairs = [(i, j) for i in range(len(bits)) for j in range(len(y_keys[i][0]))]
+		choices = [bits[i] != 0 for (i, _) in pairs]
+		msgs = [(y_keys[i][0][j], y_keys[i][1][j]) for (i, j) in pairs]
+
+		((first_index, e), state) = bob_rot1(receiver_pool, choices)
+		alice_all_ct = alice_rot1(sender_pool, first_index, e, msgs)
+		received = bob_rot2(state, choices, alice_all_ct)
+		if refiller is not None:
+			refiller.notify()
+
+		bob_keys = {i: {} for i in range(len(bits))}
+		for ((i, j), msg) in zip(pairs, received):
+			bob_keys[i][j] = msg
+		return bob_keys
+
+# Evaluates the garbled circuit gate by gate in topological order.
+# alice_keys[i][j] (resp. bob_keys[i][j]) is the key on the j-th fan-out wire of input bit i of x (resp. y).
+# garbled_circuit can be any iterable of garbled gates in the order of circ.gates, such as the gate_stream
+# of garble_circuit_stream. Gates are consumed one at a time and the value of a wire is dropped after its last use,
+# so the memory used is bounded by the number of live wires of circ.
+# Returns the list of bytes objects on the output wires of circ.
+def evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys) -> list:
+	count_gates(circ, "evaluate")
+	with metrics.phase("evaluate"):
+		wire_vals = {}
+		for (input_wires, input_keys) in ((circ.x_wires, alice_keys), (circ.y_wires, bob_keys)):
+			for i, wires in input_wires.items():
+				for j, wire in enumerate(wires):
+					wire_vals[wire] = input_keys[i][j]
+
+		last_uses = circ.get_last_uses()
+		for gate_id, (garbling, (_, left_wire, right_wire, out_wire)) in enumerate(zip(garbled_circuit, circ.gates)):
+			wire_vals[out_wire] = evaluate(garbling, wire_vals[left_wire], wire_vals[right_wire])
+			release_wires(wire_vals, last_uses, gate_id, (left_wire, right_wire, out_wire))
+		return [wire_vals[wire] for wire in circ.output_wires]
+
+# Evaluate the garbled comparator sequentially from input layer to output layer.
+# The bit width of the comparator is the number of alice's input bits, and shape the one it was garbled with.
+def evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys, shape="ripple") -> int:
+	circ = COMPARATOR_CIRCUITS[shape](len(alice_keys))
+	(val_out,) = evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys)
+	# Return the integer value corresponding to the bytes object val_out
+	return int.from_bytes(val_out, byteorder='big')
 
 # helper function for bit bit_decomposition
-def bit_decomposition(val):
-	bit_string = format(val, '02b')
+# Returns the num_bits bits of val, most significant bit first.
+def bit_decomposition(val, num_bits=2):
+	bit_string = format(val, '0{}b'.format(num_bits))
 	bit_list = [int(b) for b in bit_string]
 	return bit_list
 
+# Returns the concatenated bit decompositions of values, the inputs of batch_comparator_circuit(num_bits, len(values)).
+def batch_bit_decomposition(values, num_bits=2) -> list:
+	return [bit for val in values for bit in bit_decomposition(val, num_bits)]
+
+# Evaluates the garbled batch comparator. Returns the list of x_c >= y_c for each comparison c.
+def evaluate_garbled_circuit_batch(num_bits, garbled_circuit, alice_keys, bob_keys) -> list:
+	circ = batch_comparator_circuit(num_bits, len(alice_keys) // num_bits)
+	return [int.from_bytes(val_out, byteorder='big') != 0 for val_out in evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys)]
+
+# Compares alice_values[c] >= bob_values[c] for every c in one session: a single garbled circuit for all comparisons,
+# one OT extension setup with kappa base OTs, and one OT extension batch for all of Bob's keys.
+# Keyword arguments select the garbling options of garble_circuit. Returns the list of results.
+def compare_batch(alice_values, bob_values, num_bits, kappa=OT_EXTENSION_KAPPA, **options) -> list:
+	if len(alice_values) != len(bob_values):
+		raise ValueError('compare_batch: {} values of Alice, {} values of Bob'.format(len(alice_values), len(bob_values)))
+	(garbled_circuit, x_keys, y_keys) = garbled_circuit_batch(num_bits, len(alice_values), **options)
+	alice_keys = get_alice_keys(x_keys, *batch_bit_decomposition(alice_values, num_bits))
+	(sender, receiver) = setup_ot_extension(kappa)
+	bob_keys = get_bob_keys_ot_extension(sender, receiver, y_keys, *batch_bit_decomposition(bob_values, num_bits))
+	return evaluate_garbled_circuit_batch(num_bits, garbled_circuit, alice_keys, bob_keys)
+
+
 def test_garbled_circuits_full():
 	# Alice computes this and sends garbled_circuit to Bob
-	garble_st = time.time()
 	(garbled_circuit, x_keys, y_keys) = garbled_circuit_2bits()
-	garble_et = time.time()
-	garble_time = garble_et - garble_st
-	print("Garbling time: {}".format(garble_time))
 
 	alice_inputs = (0, 1, 2, 3)
 	# alice_inputs = (0, 1)
@@ -212,25 +366,13 @@ def test_garbled_circuits_full():
 			bob_bits = bit_decomposition(bob_input)
 
 			# Alice computes her keys and sends them to Bob
-			alice_keys_st = time.time()
-			alice_keys = get_alice_keys(x_keys, alice_bits[0], alice_bits[1])
-			alice_keys_et = time.time()
-			alice_keys_time = alice_keys_et - alice_keys_st
-			print("alice_keys time: {}".format(alice_keys_time))
+			alice_keys = get_alice_keys(x_keys, *alice_bits)
 	
 			# Bob engages with Alice in OT protocol to obtain his keys
-			bob_keys_st = time.time()
-			bob_keys = get_bob_keys(y_keys, bob_bits[0], bob_bits[1])
-			bob_keys_et = time.time()
-			bob_keys_time = bob_keys_et - bob_keys_st
-			print("bob_keys time: {}".format(bob_keys_time))
+			bob_keys = get_bob_keys(y_keys, *bob_bits)
 
 			# Bob evaluate the garbled circuit
-			evaluate_st = time.time()
 			output = evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys)
-			evaluate_et = time.time()
-			evaluate_time = evaluate_et - evaluate_st
-			print("Evaluate Garbled Circuit time: {}".format(evaluate_time))
 
 			output_bool = True
 			if output == 0:
@@ -245,11 +387,7 @@ def test_garbled_circuits_full():
 
 def test_garbled_circuits_once():
 	# Alice computes this and sends garbled_circuit to Bob
-	garble_st = time.time()
 	(garbled_circuit, x_keys, y_keys) = garbled_circuit_2bits()
-	garble_et = time.time()
-	garble_time = garble_et - garble_st
-	print("Garbling time: {}".format(garble_time))
 
 	alice_input = 1
 	bob_input = 2
@@ -257,25 +395,13 @@ def test_garbled_circuits_once():
 	bob_bits = bit_decomposition(bob_input)
 
 	# Alice computes her keys and sends them to Bob
-	alice_keys_st = time.time()
-	alice_keys = get_alice_keys(x_keys, alice_bits[0], alice_bits[1])
-	alice_keys_et = time.time()
-	alice_keys_time = alice_keys_et - alice_keys_st
-	print("alice_keys time: {}".format(alice_keys_time))
+	alice_keys = get_alice_keys(x_keys, *alice_bits)
 
 	# Bob engages with Alice in OT protocol to obtain his keys
-	bob_keys_st = time.time()
-	bob_keys = get_bob_keys(y_keys, bob_bits[0], bob_bits[1])
-	bob_keys_et = time.time()
-	bob_keys_time = bob_keys_et - bob_keys_st
-	print("bob_keys time: {}".format(bob_keys_time))
+	bob_keys = get_bob_keys(y_keys, *bob_bits)
 
 	# Bob evaluate the garbled circuit
-	evaluate_st = time.time()
 	output = evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys)
-	evaluate_et = time.time()
-	evaluate_time = evaluate_et - evaluate_st
-	print("Evaluate Garbled Circuit time: {}".format(evaluate_time))
 
 	output_bool = True
 	if output == 0:
@@ -288,6 +414,146 @@ def test_garbled_circuits_once():
 	else:
 		print("Garbled Circuit: Correctness for {} >= {}: PASSED".format(alice_input, bob_input))
 
+# Checks the garbled comparator for random inputs of several bit widths.
+# Bob's keys are selected directly instead of via OT, which is tested separately in oblivious_transfer.py.
+# Keyword arguments select the garbling options of garbled_circuit_nbits.
+def test_garbled_circuits_nbits(shape="ripple", **options):
+	for num_bits in (1, 2, 3, 8, 32):
+		(garbled_circuit, x_keys, y_keys) = garbled_circuit_nbits(num_bits, **options, shape=shape)
+		passed = True
+		for _ in range(20):
+			alice_input = random.getrandbits(num_bits)
+			bob_input = random.getrandbits(num_bits)
+			alice_keys = get_alice_keys(x_keys, *bit_decomposition(alice_input, num_bits))
+			bob_keys = get_alice_keys(y_keys, *bit_decomposition(bob_input, num_bits))
+			output = evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys, shape)
+			if (output != 0) != (alice_input >= bob_input):
+				print("Garbled Circuit: Correctness for {} bits, {}, options = {}, {} >= {}: FAILED".format(num_bits, shape, options, alice_input, bob_input))
+				passed = False
+		if passed:
+			print("Garbled Circuit: Correctness for {} bits, {}, options = {}: PASSED".format(num_bits, shape, options))
+
+# Same as test_garbled_circuits_nbits, but Bob's keys are obtained via OT extension with kappa base OTs.
+def test_garbled_circuits_ot_extension(kappa=4, **options):
+	(sender, receiver) = setup_ot_extension(kappa)
+	for num_bits in (1, 8, 32):
+		(garbled_circuit, x_keys, y_keys) = garbled_circuit_nbits(num_bits, **options)
+		passed = True
+		for _ in range(5):
+			alice_input = random.getrandbits(num_bits)
+			bob_input = random.getrandbits(num_bits)
+			alice_keys = get_alice_keys(x_keys, *bit_decomposition(alice_input, num_bits))
+			bob_keys = get_bob_keys_ot_extension(sender, receiver, y_keys, *bit_decomposition(bob_input, num_bits))
+			output = evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys)
+			if (output != 0) != (alice_input >= bob_input):
+				passed = False
+		if passed:
+			print("Garbled Circuit with OT extension: Correctness for {} bits, options = {}: PASSED".format(num_bits, options))
+		else:
+			print("Garbled Circuit with OT extension: Correctness for {} bits, options = {}: FAILED".format(num_bits, options))
+
+# Same as test_garbled_circuits_nbits, but Bob's keys are obtained from pools of random OTs,
+# which are generated with OT extension (kappa base OTs) and refilled by a background worker.
+def test_garbled_circuits_random_ot(kappa=4, **options):
+	(sender, receiver) = setup_ot_extension(kappa)
+	sender_pool = random_ot_sender_pool()
+	receiver_pool = random_ot_receiver_pool()
+	refiller = random_ot_refiller(sender_pool, receiver_pool, lambda count: generate_random_ots(sender, receiver, count),
+		capacity=512, low_water=128, batch_size=256)
+	refiller.refill()
+	refiller.start()
+	for num_bits in (1, 8, 32):
+		(garbled_circuit, x_keys, y_keys) = garbled_circuit_nbits(num_bits, **options)
+		passed = True
+		for _ in range(5):
+			alice_input = random.getrandbits(num_bits)
+			bob_input = random.getrandbits(num_bits)
+			alice_keys = get_alice_keys(x_keys, *bit_decomposition(alice_input, num_bits))
+			bob_keys = get_bob_keys_random_ot(sender_pool, receiver_pool, y_keys, *bit_decomposition(bob_input, num_bits), refiller=refiller)
+			output = evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys)
+			if (output != 0) != (alice_input >= bob_input):
+				passed = False
+		if passed:
+			print("Garbled Circuit with random OT pool: Correctness for {} bits, options = {}: PASSED".format(num_bits, options))
+		else:
+			print("Garbled Circuit with random OT pool: Correctness for {} bits, options = {}: FAILED".format(num_bits, options))
+	refiller.stop()
+
+# Checks that seeded garbling is correct, that the keys recomputed from the seed match, and that garbling with
+# the same seed gives the same garbled circuit.
+def test_garbled_circuits_seeded(**options):
+	num_bits = 16
+	circ = comparator_circuit(num_bits)
+	seed = os.urandom(16)
+	(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options, seed=seed)
+	passed = get_seeded_input_keys(circ, seed, **options) == (x_keys, y_keys)
+	for _ in range(10):
+		alice_input = random.getrandbits(num_bits)
+		bob_input = random.getrandbits(num_bits)
+		alice_keys = get_alice_keys(x_keys, *bit_decomposition(alice_input, num_bits))
+		bob_keys = get_alice_keys(y_keys, *bit_decomposition(bob_input, num_bits))
+		if (evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys) != 0) != (alice_input >= bob_input):
+			passed = False
+	if options.get("half_gates") or options.get("fixed_key"):
+		(garbled_circuit_again, _, _) = garble_circuit(circ, **options, seed=seed)
+		passed = passed and pickle.dumps(garbled_circuit_again) == pickle.dumps(garbled_circuit)
+	if passed:
+		print("Garbled Circuit with seed: Correctness for options = {}: PASSED".format(options))
+	else:
+		print("Garbled Circuit with seed: Correctness for options = {}: FAILED".format(options))
+
+# Checks compare_batch on random values, with OT extension on kappa base OTs.
+def test_compare_batch(kappa=4, **options):
+	for (num_bits, num_pairs) in ((1, 4), (8, 50), (32, 10)):
+		alice_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+		bob_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+		# Equal values check the >= boundary.
+		bob_values[0] = alice_values[0]
+		outputs = compare_batch(alice_values, bob_values, num_bits, kappa, **options)
+		if outputs == [x >= y for (x, y) in zip(alice_values, bob_values)]:
+			print("Garbled Circuit batch: Correctness for {} x {} bits, options = {}: PASSED".format(num_pairs, num_bits, options))
+		else:
+			print("Garbled Circuit batch: Correctness for {} x {} bits, options = {}: FAILED".format(num_pairs, num_bits, options))
+
+# Reports garbling and evaluation time and the size of the garbled comparator for several bit widths.
+# This is a quick single-shot check; benchmark.py runs repeated trials and compares them with a baseline.
+# Time and size grow linearly with the bit width since the comparator has 4 * (num_bits - 1) + 1 gates.
+# Keyword arguments select the garbling options of garbled_circuit_nbits.
+def benchmark_garbled_circuits_nbits(**options):
+	for num_bits in (8, 32, 64, 256):
+		garble_st = time.time()
+		(garbled_circuit, x_keys, y_keys) = garbled_circuit_nbits(num_bits, **options)
+		garble_et = time.time()
+		garble_time = garble_et - garble_st
+
+		alice_keys = get_alice_keys(x_keys, *bit_decomposition(random.getrandbits(num_bits), num_bits))
+		bob_keys = get_alice_keys(y_keys, *bit_decomposition(random.getrandbits(num_bits), num_bits))
+		evaluate_st = time.time()
+		evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys)
+		evaluate_et = time.time()
+		evaluate_time = evaluate_et - evaluate_st
+
+		num_gates = len(garbled_circuit)
+		size = len(pickle.dumps(garbled_circuit))
+		print("{} bits, {} gates, options = {}: Garbling time: {}, Evaluate Garbled Circuit time: {}, per gate: {} / {}, size: {} bytes".format(
+			num_bits, num_gates, options, garble_time, evaluate_time, garble_time / num_gates, evaluate_time / num_gates, size))
+
 if __name__ == '__main__':
+	# test_garbled_circuits_nbits()
+	# test_garbled_circuits_nbits(free_xor=True)
+	# test_garbled_circuits_nbits(free_xor=True, point_and_permute=True)
+	# test_garbled_circuits_nbits(half_gates=True)
+	# test_garbled_circuits_nbits(fixed_key=True)
+	# test_garbled_circuits_nbits(half_gates=True, fixed_key=True)
+	# test_garbled_circuits_nbits(half_gates=True, fixed_key=True, shape="tree")
+	# benchmark_garbled_circuits_nbits()
+	# benchmark_garbled_circuits_nbits(free_xor=True)
+	# benchmark_garbled_circuits_nbits(free_xor=True, point_and_permute=True)
+	# benchmark_garbled_circuits_nbits(half_gates=True)
+	# benchmark_garbled_circuits_nbits(half_gates=True, fixed_key=True)
+	# test_garbled_circuits_ot_extension(half_gates=True, fixed_key=True)
+	# test_garbled_circuits_random_ot(half_gates=True, fixed_key=True)
+	# test_compare_batch(half_gates=True, fixed_key=True)
+	# test_garbled_circuits_seeded(half_gates=True, fixed_key=True)
 	# test_garbled_circuits_full()
 	test_garbled_circuits_once()
\ No newline at end of file
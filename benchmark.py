@@ -0,0 +1,301 @@
+############################################################
+#### Description:
+# Benchmark harness for garbling, key selection, OT and evaluation.
+# Run it as a module, e.g.
+#   python -m benchmark --widths 8,32,64 --schemes classic,half_gates --trials 10 --output results.json
+#   python -m benchmark --output new.json --baseline results.json
+# Every measurement runs warm-up trials and then repeated trials timed with time.perf_counter, and reports the
+# median and 95th percentile time, gates per second and the bytes produced. Results are written as JSON, keyed by
+# "phase/width/scheme", and can be compared with a saved baseline: a median slower than the baseline by more than
+# --threshold is flagged as a regression, and the exit status is then 1.
+# --shapes selects the comparator shapes of circuit.py, "ripple" of depth O(n) and "tree" of depth O(log n). Results
+# of the tree comparator are keyed by "phase/width/scheme/tree", and every circuit result records the depth of the
+# circuit. evaluate_engine times compiled_circuit.evaluate of engine.py, which batches the hashes of each level.
+# The base OTs of OT extension are one batch of EC OTs, so --kappa defaults to full security. The cost of the
+# extension phases grows linearly with kappa. --ot elgamal,ec compares OTs per second of the Elgamal OT, which takes
+# hundreds of milliseconds, with batches of --ec-ots EC OTs under one sender key.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from alice_and_bob import garble_circuit, evaluate_circuit, get_alice_keys, bit_decomposition, get_count_per_bit
+from circuit import COMPARATOR_CIRCUITS
+from circuit_file import write_gate_stream
+from engine import compiled_circuit
+from oblivious_transfer import bob_ot1, alice_ot1, bob_ot2, bob_ot_ext_setup1, alice_ot_ext_setup1, bob_ot_ext_setup, alice_ot_ext_setup2, \
+	bob_ot_ext1, alice_ot_ext1, bob_ot_ext2, alice_ec_ot_setup, ec_ot_receiver, bob_ec_ot1, alice_ec_ot1, bob_ec_ot2
+
+import argparse
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+# Garbling options of garble_circuit for each scheme name.
+SCHEMES = {
+	"classic": {},
+	"free_xor": {"free_xor": True},
+	"point_and_permute": {"free_xor": True, "point_and_permute": True},
+	"half_gates": {"half_gates": True},
+	"fixed_key": {"half_gates": True, "fixed_key": True},
+}
+OT_METHODS = ("extension", "elgamal", "ec")
+# Gates that need no ciphertexts with each scheme, which do not count towards the depth of the circuit.
+FREE_GATES = {
+	"classic": (),
+	"free_xor": ("XOR", "EQ"),
+	"point_and_permute": ("XOR", "EQ"),
+	"half_gates": ("XOR", "EQ"),
+	"fixed_key": ("XOR", "EQ"),
+}
+
+# Times run() for warmup untimed and trials timed calls. setup(), if given, is called untimed before every call
+# and its result is passed to run.
+# Returns the list of times in seconds.
+def measure(run, trials: int, warmup: int, setup=None) -> list:
+	times = []
+	for trial in range(warmup + trials):
+		arg = setup() if setup is not None else None
+		gc.collect()
+		start = time.perf_counter()
+		run(arg) if setup is not None else run()
+		end = time.perf_counter()
+		if trial >= warmup:
+			times.append(end - start)
+	return times
+
+# Returns the p-th percentile of times with the nearest-rank method.
+def percentile(times: list, p: float) -> float:
+	ordered = sorted(times)
+	return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+# Returns the result record of a measurement. num_gates, num_bytes and num_ots are optional and give gates per second,
+# bytes and OTs per second.
+def summarize(times: list, num_gates=None, num_bytes=None, num_ots=None) -> dict:
+	median = statistics.median(times)
+	result = {
+		"trials": len(times),
+		"median": median,
+		"p95": percentile(times, 95),
+		"min": min(times),
+	}
+	if num_gates is not None:
+		result["gates"] = num_gates
+		result["gates_per_sec"] = num_gates / median if median > 0 else None
+	if num_bytes is not None:
+		result["bytes"] = num_bytes
+	if num_ots is not None:
+		result["ots"] = num_ots
+		result["ots_per_sec"] = num_ots / median if median > 0 else None
+	return result
+
+# Measures garbling, Alice's key selection and evaluation of the comparator of num_bits bits with the given scheme
+# and shape. Returns a dict of results keyed by name.
+def benchmark_circuit(num_bits: int, scheme: str, trials: int, warmup: int, shape: str = "ripple") -> dict:
+	options = SCHEMES[scheme]
+	circ = COMPARATOR_CIRCUITS[shape](num_bits)
+	num_gates = len(circ.gates)
+	depth = circ.depth(FREE_GATES[scheme])
+	alice_bits = bit_decomposition(random.getrandbits(num_bits), num_bits)
+	bob_bits = bit_decomposition(random.getrandbits(num_bits), num_bits)
+
+	(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+	num_bytes = write_gate_stream(io.BytesIO(), garbled_circuit)
+	alice_keys = get_alice_keys(x_keys, *alice_bits)
+	bob_keys = get_alice_keys(y_keys, *bob_bits)
+	results = {}
+	name = "{}/" + "{}/{}".format(num_bits, scheme) + ("/" + shape if shape != "ripple" else "")
+	results[name.format("garble")] = summarize(measure(lambda: garble_circuit(circ, **options), trials, warmup), num_gates, num_bytes)
+	results[name.format("alice_keys")] = summarize(measure(lambda: get_alice_keys(x_keys, *alice_bits), trials, warmup))
+	results[name.format("evaluate")] = summarize(
+		measure(lambda: evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys), trials, warmup), num_gates)
+	compiled = compiled_circuit.from_garbled_circuit(circ, garbled_circuit)
+	results[name.format("evaluate_engine")] = summarize(
+		measure(lambda: compiled.evaluate(alice_keys, bob_keys), trials, warmup), num_gates)
+	for phase in ("garble", "evaluate", "evaluate_engine"):
+		results[name.format(phase)]["depth"] = depth
+	return results
+
+# Measures the three phases of one batch of OT extension for Bob's keys of the comparator of num_bits bits.
+# sender and receiver are the states of a completed setup with kappa base OTs.
+def benchmark_ot_extension(num_bits: int, sender, receiver, trials: int, warmup: int) -> dict:
+	count_per_bit = get_count_per_bit(num_bits)
+	choices = [bit != 0 for (i, bit) in enumerate(bit_decomposition(random.getrandbits(num_bits), num_bits)) for _ in range(count_per_bit[i])]
+	msgs = [(os.urandom(16), os.urandom(16)) for _ in choices]
+	times = {"bob_ot_ext1": [], "alice_ot_ext1": [], "bob_ot_ext2": []}
+	num_bytes = {}
+	for trial in range(warmup + trials):
+		gc.collect()
+		t_0 = time.perf_counter()
+		(u, batch_state) = bob_ot_ext1(receiver, choices)
+		t_1 = time.perf_counter()
+		alice_all_ct = alice_ot_ext1(sender, u, msgs)
+		t_2 = time.perf_counter()
+		bob_ot_ext2(batch_state, alice_all_ct)
+		t_3 = time.perf_counter()
+		if trial >= warmup:
+			times["bob_ot_ext1"].append(t_1 - t_0)
+			times["alice_ot_ext1"].append(t_2 - t_1)
+			times["bob_ot_ext2"].append(t_3 - t_2)
+		num_bytes["bob_ot_ext1"] = len(u) * ((len(choices) + 7) // 8)
+		num_bytes["alice_ot_ext1"] = sum(len(y_0) + len(y_1) for (y_0, y_1) in alice_all_ct)
+		num_bytes["bob_ot_ext2"] = 0
+	return {"{}/{}/kappa={}".format(phase, num_bits, sender.kappa): summarize(times[phase], None, num_bytes[phase]) for phase in times}
+
+# Measures the three phases of a single Elgamal OT. They do not depend on the circuit, so they are reported per OT.
+def benchmark_elgamal_ot(trials: int, warmup: int) -> dict:
+	times = {"bob_ot1": [], "alice_ot1": [], "bob_ot2": [], "ot": []}
+	for trial in range(warmup + trials):
+		bit = random.getrandbits(1) == 1
+		gc.collect()
+		t_0 = time.perf_counter()
+		((b_0, b_1), bob_sk) = bob_ot1(bit)
+		t_1 = time.perf_counter()
+		(ct_0, ct_1) = alice_ot1(b_0, b_1, os.urandom(16), os.urandom(16))
+		t_2 = time.perf_counter()
+		bob_ot2(bit, bob_sk, ct_0, ct_1)
+		t_3 = time.perf_counter()
+		if trial >= warmup:
+			times["bob_ot1"].append(t_1 - t_0)
+			times["alice_ot1"].append(t_2 - t_1)
+			times["bob_ot2"].append(t_3 - t_2)
+			times["ot"].append(t_3 - t_0)
+	return {"{}/per_ot/elgamal".format(phase): summarize(times[phase], num_ots=1) for phase in times}
+
+# Measures the phases of a batch of num_ots EC OTs, including the sender key and the table of Bob.
+def benchmark_ec_ot(num_ots: int, trials: int, warmup: int) -> dict:
+	times = {"ec_ot_setup": [], "bob_ec_ot1": [], "alice_ec_ot1": [], "bob_ec_ot2": [], "ot": []}
+	for trial in range(warmup + trials):
+		bits = [random.getrandbits(1) == 1 for _ in range(num_ots)]
+		msgs = [(os.urandom(16), os.urandom(16)) for _ in range(num_ots)]
+		gc.collect()
+		t_0 = time.perf_counter()
+		sender = alice_ec_ot_setup()
+		receiver = ec_ot_receiver(sender.public_key)
+		t_1 = time.perf_counter()
+		(bob_all_B, batch_state) = bob_ec_ot1(receiver, bits)
+		t_2 = time.perf_counter()
+		alice_all_ct = alice_ec_ot1(sender, bob_all_B, msgs)
+		t_3 = time.perf_counter()
+		bob_ec_ot2(batch_state, alice_all_ct)
+		t_4 = time.perf_counter()
+		if trial >= warmup:
+			times["ec_ot_setup"].append(t_1 - t_0)
+			times["bob_ec_ot1"].append(t_2 - t_1)
+			times["alice_ec_ot1"].append(t_3 - t_2)
+			times["bob_ec_ot2"].append(t_4 - t_3)
+			times["ot"].append(t_4 - t_0)
+	num_bytes = {"ec_ot_setup": len(sender.public_key), "bob_ec_ot1": sum(len(B) for B in bob_all_B),
+		"alice_ec_ot1": sum(len(y_0) + len(y_1) for (y_0, y_1) in alice_all_ct), "bob_ec_ot2": 0, "ot": None}
+	return {"{}/{}/ec".format(phase, num_ots): summarize(times[phase], None, num_bytes[phase], num_ots) for phase in times}
+
+# Runs the benchmarks selected by args and returns the JSON document.
+def run_benchmarks(args) -> dict:
+	results = {}
+	for num_bits in args.widths:
+		for scheme in args.schemes:
+			for shape in args.shapes:
+				results.update(benchmark_circuit(num_bits, scheme, args.trials, args.warmup, shape))
+	if "extension" in args.ot:
+		(bob_public_key, bob_setup_state) = bob_ot_ext_setup1()
+		(alice_all_B, setup_state) = alice_ot_ext_setup1(bob_public_key, args.kappa)
+		(bob_all_ct, receiver) = bob_ot_ext_setup(bob_setup_state, alice_all_B)
+		sender = alice_ot_ext_setup2(setup_state, bob_all_ct)
+		for num_bits in args.widths:
+			results.update(benchmark_ot_extension(num_bits, sender, receiver, args.trials, args.warmup))
+	if "elgamal" in args.ot:
+		results.update(benchmark_elgamal_ot(args.ot_trials, 0))
+	if "ec" in args.ot:
+		results.update(benchmark_ec_ot(args.ec_ots, args.trials, args.warmup))
+	return {
+		"meta": {
+			"python": platform.python_version(),
+			"platform": platform.platform(),
+			"cpu_count": os.cpu_count(),
+			"trials": args.trials,
+			"warmup": args.warmup,
+		},
+		"results": results,
+	}
+
+# Compares the medians of results with those of baseline.
+# Returns the list of (name, baseline median, median, ratio) for the regressions, i.e. ratio > 1 + threshold.
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+	regressions = []
+	for (name, result) in results["results"].items():
+		if name not in baseline["results"]:
+			continue
+		base = baseline["results"][name]["median"]
+		ratio = result["median"] / base if base > 0 else float("inf")
+		if ratio > 1 + threshold:
+			regressions.append((name, base, result["median"], ratio))
+	return regressions
+
+def format_result(name: str, result: dict) -> str:
+	line = "{:<48} median {:>10.6f} s  p95 {:>10.6f} s".format(name, result["median"], result["p95"])
+	if result.get("gates_per_sec") is not None:
+		line += "  {:>12.0f} gates/s".format(result["gates_per_sec"])
+	if "bytes" in result:
+		line += "  {:>10} bytes".format(result["bytes"])
+	if result.get("ots_per_sec") is not None:
+		line += "  {:>10.1f} OTs/s".format(result["ots_per_sec"])
+	if "depth" in result:
+		line += "  depth {:>4}".format(result["depth"])
+	return line
+
+def parse_list(text: str, convert=str) -> list:
+	return [convert(item) for item in text.split(",") if item]
+
+def main(argv=None) -> int:
+	parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmarks garbling, OT and evaluation.")
+	parser.add_argument("--widths", type=lambda text: parse_list(text, int), default=[8, 32, 64], help="comma separated bit widths")
+	parser.add_argument("--schemes", type=parse_list, default=list(SCHEMES), help="comma separated schemes: " + ", ".join(SCHEMES))
+	parser.add_argument("--shapes", type=parse_list, default=["ripple"], help="comma separated comparator shapes: " + ", ".join(COMPARATOR_CIRCUITS))
+	parser.add_argument("--ot", type=parse_list, default=["extension"], help="comma separated OT methods: " + ", ".join(OT_METHODS) + ", or none")
+	parser.add_argument("--kappa", type=int, default=128, help="number of base OTs of OT extension")
+	parser.add_argument("--trials", type=int, default=10)
+	parser.add_argument("--warmup", type=int, default=2)
+	parser.add_argument("--ot-trials", type=int, default=3, help="number of Elgamal OTs measured")
+	parser.add_argument("--ec-ots", type=int, default=128, help="number of EC OTs per batch")
+	parser.add_argument("--seed", type=int, default=0, help="seed of the random inputs")
+	parser.add_argument("--output", help="write the results as JSON to this path")
+	parser.add_argument("--baseline", help="compare with the JSON results at this path")
+	parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown of the median flagged as a regression")
+	args = parser.parse_args(argv)
+	for scheme in args.schemes:
+		if scheme not in SCHEMES:
+			parser.error("unknown scheme {}".format(scheme))
+	for shape in args.shapes:
+		if shape not in COMPARATOR_CIRCUITS:
+			parser.error("unknown shape {}".format(shape))
+	for method in args.ot:
+		if method not in OT_METHODS + ("none",):
+			parser.error("unknown OT method {}".format(method))
+
+	random.seed(args.seed)
+	results = run_benchmarks(args)
+	for (name, result) in results["results"].items():
+		print(format_result(name, result))
+	if args.output:
+		with open(args.output, "w") as file:
+			json.dump(results, file, indent=2, sort_keys=True)
+
+	if args.baseline:
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+		regressions = compare(results, baseline, args.threshold)
+		for (name, base, median, ratio) in regressions:
+			print("REGRESSION {}: median {:.6f} s, baseline {:.6f} s ({:+.1%})".format(name, median, base, ratio - 1))
+		if regressions:
+			return 1
+		print("No regressions against {}".format(args.baseline))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -12,39 +12,111 @@
 # When Bob writes files to ./files/bob, it indicates storing local state.
 # When Bob writes files to ./files/alice, it indicates send ingthat file to Alice.
 
+# The bit width of the inputs is given as the first command line argument, e.g. `python bob.py 8`, and defaults to 2.
+# Alice must use the same bit width.
+
+# Network mode: `python bob.py 8 --connect 127.0.0.1:5000` asks for Bob's input, connects to Alice and runs the
+# whole protocol, see network.py. Entering comma-separated values compares a batch of pairs with Alice's batch.
+
+# The public key operations of OT can be done offline, before Bob knows his input, by filling a pool of random OTs
+# with the commands 'pool_ot1' (Bob), 'pool_ot1' (Alice) and 'pool_ot2' (Bob), see ot_pool.py.
+# When the pool has enough random OTs, 'bob_ot1' and 'bob_ot2' use it and only XOR keys online.
+
+# The steps take the bit width and Bob's input as arguments, so that cli.py can run them without the prompt.
+
 # Author: Nikhil Vanjani
 ############################################################
 
-from garbled_gate import *
-from oblivious_transfer import bob_ot1, bob_ot2
-from alice_and_bob import evaluate_garbled_circuit, bit_decomposition
+from oblivious_transfer import bob_ot1, bob_ot2, ciphertexts_from_bytes
+from ot_pool import random_ot_receiver_pool, bob_rot1, bob_rot2, ROT_MESSAGE_LENGTH
+from alice_and_bob import bit_decomposition, get_count_per_bit
+from circuit_file import evaluate_garbled_circuit_file, write_keys_file, read_keys_file
 
 import os
+import metrics
 import pickle
+import random
+import sys
+
+POOL_PATH = "./files/bob/rot_pool.bin"
+
+# Returns the receiver pool of random OTs stored locally, or an empty pool if there is none.
+def load_pool():
+	if os.path.exists(POOL_PATH):
+		return random_ot_receiver_pool.load(POOL_PATH)
+	return random_ot_receiver_pool()
+
+# Removes the file at path if it exists.
+def remove_file(path):
+	if os.path.exists(path):
+		os.remove(path)
+
+# Generates Bob's 1st message of the OT protocol for random choice bits, to fill the pool of random OTs offline.
+# Sends public keys to Alice and stores the choice bits and private keys locally.
+def generate_bob_pool_ot1(count: int):
+	os.makedirs("./files/alice", exist_ok=True)
+	os.makedirs("./files/bob", exist_ok=True)
+
+	choices = [random.SystemRandom().getrandbits(1) == 1 for _ in range(count)]
+	bob_pool_pk = []
+	bob_pool_sk = []
+	for choice in choices:
+		((b_0, b_1), bob_sk) = bob_ot1(choice)
+		bob_pool_pk.append((b_0, b_1))
+		bob_pool_sk.append(bob_sk)
+	with open("./files/alice/bob_pool_pk.pkl", "wb") as file:
+		pickle.dump((load_pool().next_index(), bob_pool_pk), file)
+	with open("./files/bob/bob_pool_sk.pkl", "wb") as file:
+		pickle.dump((choices, bob_pool_sk), file)
+
+# Reads Alice's ciphertexts for the random OTs started by 'pool_ot1' and adds the random OTs to the pool.
+def generate_bob_pool_ot2():
+	alice_pool_ct = read_keys_file("./files/bob/alice_pool_ct.bin")
+	with open("./files/bob/bob_pool_sk.pkl", "rb") as file:
+		(choices, bob_pool_sk) = pickle.load(file)
+
+	entries = []
+	for j, (choice, bob_sk) in enumerate(zip(choices, bob_pool_sk)):
+		(ct_0, ct_1) = ciphertexts_from_bytes(alice_pool_ct[0][j])
+		entries.append((choice, bob_ot2(choice, bob_sk, ct_0, ct_1, ROT_MESSAGE_LENGTH)))
+	pool = load_pool()
+	pool.extend(entries)
+	pool.save(POOL_PATH)
+	remove_file("./files/bob/bob_pool_sk.pkl")
+	print("Random OT pool: {} random OTs".format(len(pool)))
 
 
 # Generates Bob's 1st message of OT protocol consisting of public and private keys. 
 # Sends public keys to Alice.
 # Stores own input and private keys locally. 
-def generate_bob_ot1():
+def generate_bob_ot1(num_bits: int, bob_input: int):
 	os.makedirs("./files/alice", exist_ok=True)
 	os.makedirs("./files/bob", exist_ok=True)
 
-	# bob_input = 2
-	bob_input = int(input("Enter Bob's input: "))
-	bob_bits = bit_decomposition(bob_input)
-	bits_bool = [True, True]
-	if bob_bits[0] == 0:
-		bits_bool[0] = False
-	if bob_bits[1] == 0:
-		bits_bool[1] = False
+	bob_bits = bit_decomposition(bob_input, num_bits)
+	bits_bool = [bit != 0 for bit in bob_bits]
 	with open("./files/bob/bob_input.pkl", "wb") as file:
 		pickle.dump(bits_bool, file)
 
+	count_per_bit = get_count_per_bit(num_bits)
+	pool = load_pool()
+	if len(pool) >= sum(count_per_bit):
+		# Online phase with the pool of random OTs: only the choice bits are derandomized.
+		choices = [bits_bool[i] for i in range(num_bits) for _ in range(count_per_bit[i])]
+		((first_index, e), state) = bob_rot1(pool, choices)
+		pool.save(POOL_PATH)
+		with open("./files/alice/bob_rot_choices.pkl", "wb") as file:
+			pickle.dump((first_index, e), file)
+		with open("./files/bob/bob_rot_state.pkl", "wb") as file:
+			pickle.dump(state, file)
+		remove_file("./files/alice/bob_all_pk.pkl")
+		return
+	remove_file("./files/alice/bob_rot_choices.pkl")
+	remove_file("./files/bob/bob_rot_state.pkl")
+
 	bob_all_pk = {}
 	bob_all_sk = {}
-	count_per_bit = [2, 1]
-	for i in range(2):
+	for i in range(num_bits):
 		bob_all_pk[i] = {}
 		bob_all_sk[i] = {}
 		for j in range(count_per_bit[i]):
@@ -58,37 +130,46 @@ def generate_bob_ot1():
 
 # Reads own input and private keys from local state and Alice's message of OT protocol, 
 # computes and stores the OT output consisting of Bob's keys for the garbled circuit.
-def generate_bob_ot2():
+def generate_bob_ot2(num_bits: int):
 	os.makedirs("./files/bob", exist_ok=True)
 
-	with open("./files/bob/alice_all_ct.pkl", "rb") as file:
-		alice_all_ct = pickle.load(file)
-	with open("./files/bob/bob_all_sk.pkl", "rb") as file:
-		bob_all_sk = pickle.load(file)
+	alice_all_ct = read_keys_file("./files/bob/alice_all_ct.bin")
 	with open("./files/bob/bob_input.pkl", "rb") as file:
 		bits_bool = pickle.load(file)
 
 	bob_keys = {}
-	count_per_bit = [2, 1]
-	for i in range(2):
+	count_per_bit = get_count_per_bit(num_bits)
+	if os.path.exists("./files/bob/bob_rot_state.pkl"):
+		with open("./files/bob/bob_rot_state.pkl", "rb") as file:
+			state = pickle.load(file)
+		pairs = [(i, j) for i in range(num_bits) for j in range(count_per_bit[i])]
+		choices = [bits_bool[i] for (i, _) in pairs]
+		received = bob_rot2(state, choices, [alice_all_ct[i][j] for (i, j) in pairs])
+		for ((i, j), msg) in zip(pairs, received):
+			bob_keys.setdefault(i, {})[j] = msg
+		write_keys_file("./files/bob/bob_keys.bin", bob_keys)
+		remove_file("./files/bob/bob_rot_state.pkl")
+		return
+
+	with open("./files/bob/bob_all_sk.pkl", "rb") as file:
+		bob_all_sk = pickle.load(file)
+	for i in range(num_bits):
 		bob_keys[i] = {}
 		for j in range(count_per_bit[i]):
-			(ct_0, ct_1) = alice_all_ct[i][j]
+			(ct_0, ct_1) = ciphertexts_from_bytes(alice_all_ct[i][j])
 			msg = bob_ot2(bits_bool[i], bob_all_sk[i][j], ct_0, ct_1)
 			bob_keys[i][j] = msg
-	with open("./files/bob/bob_keys.pkl", "wb") as file:
-		pickle.dump(bob_keys, file)
+	write_keys_file("./files/bob/bob_keys.bin", bob_keys)
 
 # Reads garbled circuit and alice's keys obtained from Alice, bob's keys from local state and 
 # evaluates garbled circuit to compute the output for function (x >= y).
-def generate_output():
-	with open("./files/bob/garbled_circuit.pkl", "rb") as file:
-		garbled_circuit = pickle.load(file)
-	with open("./files/bob/alice_keys.pkl", "rb") as file:
-		alice_keys = pickle.load(file)
-	with open("./files/bob/bob_keys.pkl", "rb") as file:
-		bob_keys = pickle.load(file)
-	output = evaluate_garbled_circuit(garbled_circuit, alice_keys, bob_keys)
+# The garbled circuit is evaluated straight from the mmap-ed file.
+# Returns the output as a bool.
+def generate_output() -> bool:
+	alice_keys = read_keys_file("./files/bob/alice_keys.bin")
+	bob_keys = read_keys_file("./files/bob/bob_keys.bin")
+	(val_out,) = evaluate_garbled_circuit_file("./files/bob/garbled_circuit.gc", alice_keys, bob_keys)
+	output = int.from_bytes(val_out, byteorder='big')
 	output_bool = True
 	if output == 0:
 		output_bool = False
@@ -96,23 +177,46 @@ def generate_output():
 		print("Alice's value >= Bob's value")
 	else:
 		print("Alice's value < Bob's value")
+	return output_bool
 
 def unknown_command():
-    print("Unknown command. Try 'bob_ot1' or 'bob_ot2' or 'evaluate'.")
-
-# Command mapping
-commands = {
-    "bob_ot1": generate_bob_ot1,
-    "bob_ot2": generate_bob_ot2,
-    "evaluate": generate_output,
-}
-
-while True:
-    user_input = input("Enter a command ('exit' to quit): ").strip().lower()
-    
-    if user_input == "exit":
-        print("Exiting program.")
-        break
-
-    # Execute the corresponding function if the command exists
-    commands.get(user_input, unknown_command)()
\ No newline at end of file
+	print("Unknown command. Try 'pool_ot1' or 'pool_ot2' or 'bob_ot1' or 'bob_ot2' or 'evaluate'.")
+
+if __name__ == '__main__':
+	NUM_BITS = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+	# Serves metrics on http://127.0.0.1:$GC_METRICS_PORT/metrics if that environment variable is set, see metrics.py.
+	metrics.configure_from_environment()
+
+	# Command mapping
+	commands = {
+		"pool_ot1": lambda: generate_bob_pool_ot1(int(input("Enter number of random OTs: "))),
+		"pool_ot2": generate_bob_pool_ot2,
+		"bob_ot1": lambda: generate_bob_ot1(NUM_BITS, int(input("Enter Bob's input: "))),
+		"bob_ot2": lambda: generate_bob_ot2(NUM_BITS),
+		"evaluate": generate_output,
+	}
+
+	if len(sys.argv) > 3 and sys.argv[2] == "--connect":
+		from network import connect_bob, parse_address, parse_values
+
+		bob_input = parse_values(input("Enter Bob's input (comma-separated values for a batch): "))
+		(host, port) = parse_address(sys.argv[3])
+		output = connect_bob(host, port, NUM_BITS, bob_input)
+		if isinstance(output, list):
+			for (c, output_c) in enumerate(output):
+				print("Pair {}: Alice's value {} Bob's value".format(c, ">=" if output_c else "<"))
+		elif output:
+			print("Alice's value >= Bob's value")
+		else:
+			print("Alice's value < Bob's value")
+		sys.exit(0)
+
+	while True:
+		user_input = input("Enter a command ('exit' to quit): ").strip().lower()
+
+		if user_input == "exit":
+			print("Exiting program.")
+			break
+
+		# Execute the corresponding function if the command exists
+		commands.get(user_input, unknown_command)()
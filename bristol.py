@@ -0,0 +1,298 @@
+############################################################
+#### Description:
+# Loader for circuits in the Bristol and Bristol Fashion formats
+# (https://homes.esat.kuleuven.be/~nsmart/MPC/), e.g. the adder, comparator and AES circuits distributed there.
+# A file is compiled into a circuit (see circuit.py) with a flat list of gates over integer wire ids:
+# - XOR and AND map to the gates of the same name, and MAND to one AND per output.
+# - INV a maps to EQ(a, zero), since EQ is XNOR. EQW (copy) maps to no gate, its output is an alias of its input.
+# - EQ c (constant assignment) maps to the zero wire or to one = EQ(zero, zero).
+# The zero wire is an extra input bit of the garbler, which is always 0. With Free-XOR, INV and constants cost nothing.
+# Bristol files have two parties: the first input value belongs to the garbler (Alice, x_wires) and the second one
+# to the evaluator (Bob, y_wires). garbler_bits / evaluator_bits give the input bits of a value and decode_outputs
+# turns the outputs of evaluate_circuit back into values. Values are stored least significant bit first, in the
+# order of their wires, unless lsb_first = False.
+# Compiled circuits are pickled in a cache directory, keyed by the SHA256 of the file contents, so loading the same
+# file again skips parsing.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from circuit import circuit
+
+from Crypto.Hash import SHA256
+import os
+import pickle
+
+# Bumped whenever the compiled representation changes, so that stale cache entries are ignored.
+COMPILER_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "garbled-circuits", "bristol")
+
+# Circuit compiled from a Bristol file.
+# input_widths[k] (resp. output_widths[k]) is the number of bits of the k-th input (resp. output) value.
+# Alice's bits are x_wires[0 ... input_widths[0] - 1], followed by the zero wire at x_wires[zero_bit] if it is used.
+class bristol_circuit(circuit):
+	def __init__(self):
+		super().__init__()
+		self.input_widths = []
+		self.output_widths = []
+		self.zero_bit = None
+
+# Parses the text of a Bristol or Bristol Fashion file.
+# Returns (num_wires, input_widths, output_widths, gates), where gates is a list of (gate_name, input_wires, output_wires).
+def parse_bristol(text: str):
+	lines = [line.split() for line in text.splitlines()]
+	header = [tokens for tokens in lines if tokens]
+	if len(header) < 3:
+		raise ValueError('parse_bristol: expected at least 3 header lines, found {}'.format(len(header)))
+	(num_gates, num_wires) = (int(header[0][0]), int(header[0][1]))
+	# In Bristol Fashion the third line lists the output widths, in Bristol it is already a gate, which ends with a name.
+	if header[2][-1].isdigit():
+		input_widths = [int(token) for token in header[1][1:]]
+		output_widths = [int(token) for token in header[2][1:]]
+		if len(input_widths) != int(header[1][0]) or len(output_widths) != int(header[2][0]):
+			raise ValueError('parse_bristol: malformed input or output widths')
+		gate_lines = header[3:]
+	else:
+		(n_1, n_2, n_out) = [int(token) for token in header[1][:3]]
+		input_widths = [n_1, n_2]
+		output_widths = [n_out]
+		gate_lines = header[2:]
+	if len(gate_lines) != num_gates:
+		raise ValueError('parse_bristol: expected {} gates, found {}'.format(num_gates, len(gate_lines)))
+
+	gates = []
+	for tokens in gate_lines:
+		(num_in, num_out) = (int(tokens[0]), int(tokens[1]))
+		if len(tokens) != 3 + num_in + num_out:
+			raise ValueError('parse_bristol: malformed gate {}'.format(" ".join(tokens)))
+		wires = [int(token) for token in tokens[2:-1]]
+		gates.append((tokens[-1], wires[:num_in], wires[num_in:]))
+	return (num_wires, input_widths, output_widths, gates)
+
+# Compiles a parsed Bristol file into a bristol_circuit, see the description at the top of this file.
+def compile_bristol(num_wires: int, input_widths: list, output_widths: list, gates: list) -> bristol_circuit:
+	if len(input_widths) != 2:
+		raise ValueError('compile_bristol: expected 2 input values, one per party, found {}'.format(len(input_widths)))
+	circ = bristol_circuit()
+	circ.input_widths = list(input_widths)
+	circ.output_widths = list(output_widths)
+
+	# wire_map maps the wires of the file to wires of circ.
+	wire_map = {}
+	for k in range(input_widths[0]):
+		wire_map[k] = circ.new_wire()
+		circ.x_wires[k] = [wire_map[k]]
+	for k in range(input_widths[1]):
+		wire_map[input_widths[0] + k] = circ.new_wire()
+		circ.y_wires[k] = [wire_map[input_widths[0] + k]]
+
+	constants = {}
+	def constant(bit: int) -> int:
+		if 0 not in constants:
+			circ.zero_bit = input_widths[0]
+			constants[0] = circ.new_wire()
+			circ.x_wires[circ.zero_bit] = [constants[0]]
+		if bit and 1 not in constants:
+			constants[1] = circ.add_gate("EQ", constants[0], constants[0])
+		return constants[bit]
+
+	for (name, inputs, outputs) in gates:
+		try:
+			ins = [wire_map[wire] for wire in inputs]
+		except KeyError as e:
+			raise ValueError('compile_bristol: gate {} reads wire {} before it is set'.format(name, e.args[0]))
+		if name in ("XOR", "AND") and len(ins) == 2 and len(outputs) == 1:
+			wire_map[outputs[0]] = circ.add_gate(name, ins[0], ins[1])
+		elif name == "INV" and len(ins) == 1 and len(outputs) == 1:
+			wire_map[outputs[0]] = circ.add_gate("EQ", ins[0], constant(0))
+		elif name == "EQW" and len(ins) == 1 and len(outputs) == 1:
+			wire_map[outputs[0]] = ins[0]
+		elif name == "EQ" and len(inputs) == 1 and len(outputs) == 1:
+			wire_map[outputs[0]] = constant(inputs[0])
+		elif name == "MAND" and len(ins) == 2 * len(outputs):
+			half = len(outputs)
+			for k, wire in enumerate(outputs):
+				wire_map[wire] = circ.add_gate("AND", ins[k], ins[half + k])
+		else:
+			raise ValueError('compile_bristol: unsupported gate {} with {} inputs and {} outputs'.format(name, len(inputs), len(outputs)))
+
+	# The output wires are the last sum(output_widths) wires of the file.
+	# Garbled gates on output wires reveal their output, so every output must be the output of its own gate, which no
+	# other gate reads. Otherwise, e.g. for an alias or an input, the output is copied with XOR(wire, zero).
+	gate_outputs = {out_wire for (_, _, _, out_wire) in circ.gates}
+	read_wires = {wire for (_, left_wire, right_wire, _) in circ.gates for wire in (left_wire, right_wire)}
+	used = set()
+	first_output = num_wires - sum(output_widths)
+	for wire in range(first_output, num_wires):
+		if wire not in wire_map:
+			raise ValueError('compile_bristol: output wire {} is never set'.format(wire))
+		out_wire = wire_map[wire]
+		if out_wire not in gate_outputs or out_wire in read_wires or out_wire in used:
+			out_wire = circ.add_gate("XOR", out_wire, constant(0))
+		used.add(out_wire)
+		circ.output_wires.append(out_wire)
+	return circ
+
+# Returns the SHA256 hex digest of data, which keys the compiled circuit cache.
+def file_digest(data: bytes) -> str:
+	return SHA256.new(data).hexdigest()
+
+# Loads the Bristol or Bristol Fashion file at path, from the cache in cache_dir if it was compiled before.
+# cache_dir = None disables the cache.
+def load_bristol(path: str, cache_dir=DEFAULT_CACHE_DIR) -> bristol_circuit:
+	with open(path, "rb") as file:
+		data = file.read()
+	cache_path = None
+	if cache_dir is not None:
+		cache_path = os.path.join(cache_dir, "{}-v{}.pkl".format(file_digest(data), COMPILER_VERSION))
+		if os.path.exists(cache_path):
+			with open(cache_path, "rb") as file:
+				return pickle.load(file)
+
+	circ = compile_bristol(*parse_bristol(data.decode()))
+	if cache_path is not None:
+		os.makedirs(cache_dir, exist_ok=True)
+		tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+		with open(tmp_path, "wb") as file:
+			pickle.dump(circ, file, protocol=pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, cache_path)
+	return circ
+
+# Returns the width bits of value in wire order.
+def value_to_bits(value: int, width: int, lsb_first=True) -> list:
+	bits = [(value >> k) & 1 for k in range(width)]
+	return bits if lsb_first else bits[::-1]
+
+# Inverse of value_to_bits.
+def bits_to_value(bits: list, lsb_first=True) -> int:
+	if not lsb_first:
+		bits = bits[::-1]
+	return sum(bit << k for (k, bit) in enumerate(bits))
+
+# Returns the input bits of the garbler for input value, including the zero wire, e.g. for get_alice_keys.
+def garbler_bits(circ: bristol_circuit, value: int, lsb_first=True) -> list:
+	bits = value_to_bits(value, circ.input_widths[0], lsb_first)
+	if circ.zero_bit is not None:
+		bits.append(0)
+	return bits
+
+# Returns the input bits of the evaluator for input value.
+def evaluator_bits(circ: bristol_circuit, value: int, lsb_first=True) -> list:
+	return value_to_bits(value, circ.input_widths[1], lsb_first)
+
+# Converts the list of bytes objects returned by evaluate_circuit to the list of output values.
+def decode_outputs(circ: bristol_circuit, outputs: list, lsb_first=True) -> list:
+	bits = [int.from_bytes(val_out, byteorder='big') != 0 for val_out in outputs]
+	values = []
+	offset = 0
+	for width in circ.output_widths:
+		values.append(bits_to_value([int(bit) for bit in bits[offset:offset + width]], lsb_first))
+		offset += width
+	return values
+
+# Returns the text of a Bristol Fashion n-bit adder with inputs a and b and outputs a + b mod 2^n and the carry.
+# The carry is computed as OR(g, p) = INV(AND(INV(g), INV(p))) and copied to the output with EQW,
+# so that the file uses INV and EQW as well as XOR and AND.
+def adder_bristol_fashion(num_bits: int) -> str:
+	gates = []
+	internal = []
+	def wire(name):
+		internal.append(name)
+		return name
+	sums = []
+	carry = None
+	for k in range(num_bits):
+		(a, b) = (k, num_bits + k)
+		p = wire(("p", k))
+		gates.append(("XOR", [a, b], [p]))
+		if carry is None:
+			sums.append(p)
+			carry = wire(("c", k))
+			gates.append(("AND", [a, b], [carry]))
+			continue
+		s = wire(("s", k))
+		gates.append(("XOR", [p, carry], [s]))
+		sums.append(s)
+		g = wire(("g", k))
+		gates.append(("AND", [a, b], [g]))
+		t = wire(("t", k))
+		gates.append(("AND", [p, carry], [t]))
+		(ng, nt, both) = (wire(("ng", k)), wire(("nt", k)), wire(("both", k)))
+		gates.append(("INV", [g], [ng]))
+		gates.append(("INV", [t], [nt]))
+		gates.append(("AND", [ng, nt], [both]))
+		carry = wire(("c", k))
+		gates.append(("INV", [both], [carry]))
+
+	# Wire ids: inputs first, then internal wires, then the outputs.
+	ids = {name: 2 * num_bits + k for (k, name) in enumerate(internal)}
+	first_output = 2 * num_bits + len(internal)
+	outputs = {}
+	for k, s in enumerate(sums):
+		outputs[s] = first_output + k
+	lines = []
+	for (name, ins, outs) in gates:
+		outs = [outputs.get(out, ids.get(out)) for out in outs]
+		ins = [outputs.get(w, ids.get(w, w)) for w in ins]
+		lines.append("{} {} {} {} {}".format(len(ins), len(outs), " ".join(map(str, ins)), " ".join(map(str, outs)), name))
+	lines.append("1 1 {} {} EQW".format(ids[carry], first_output + num_bits))
+	num_wires = first_output + num_bits + 1
+	header = ["{} {}".format(len(lines), num_wires), "2 {} {}".format(num_bits, num_bits), "2 {} 1".format(num_bits), ""]
+	return "\n".join(header + lines) + "\n"
+
+def test_bristol():
+	from alice_and_bob import garble_circuit, evaluate_circuit, get_alice_keys
+	import random
+	import shutil
+	import tempfile
+
+	directory = tempfile.mkdtemp()
+	try:
+		num_bits = 8
+		path = os.path.join(directory, "adder8.txt")
+		with open(path, "w") as file:
+			file.write(adder_bristol_fashion(num_bits))
+		cache_dir = os.path.join(directory, "cache")
+		circ = load_bristol(path, cache_dir)
+		for options in ({}, {"free_xor": True, "point_and_permute": True}, {"half_gates": True, "fixed_key": True}):
+			passed = True
+			(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+			for _ in range(10):
+				(a, b) = (random.getrandbits(num_bits), random.getrandbits(num_bits))
+				alice_keys = get_alice_keys(x_keys, *garbler_bits(circ, a))
+				bob_keys = get_alice_keys(y_keys, *evaluator_bits(circ, b))
+				outputs = decode_outputs(circ, evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys))
+				if outputs != [(a + b) % (1 << num_bits), (a + b) >> num_bits]:
+					passed = False
+			if passed:
+				print("Bristol: {}-bit adder, options = {}: PASSED".format(num_bits, options))
+			else:
+				print("Bristol: {}-bit adder, options = {}: FAILED".format(num_bits, options))
+
+		cached = load_bristol(path, cache_dir)
+		if len(os.listdir(cache_dir)) == 1 and cached.gates == circ.gates and cached.output_wires == circ.output_wires:
+			print("Bristol: Cache: PASSED")
+		else:
+			print("Bristol: Cache: FAILED")
+
+		# Old Bristol format, with a constant output and an output that is an input.
+		path = os.path.join(directory, "old.txt")
+		with open(path, "w") as file:
+			file.write("4 6\n1 1 3\n\n2 1 0 1 2 AND\n1 1 1 3 EQ\n1 1 0 4 EQW\n1 1 2 5 EQW\n")
+		circ = load_bristol(path, None)
+		passed = True
+		for a in (0, 1):
+			for b in (0, 1):
+				(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, half_gates=True)
+				outputs = evaluate_circuit(circ, garbled_circuit, get_alice_keys(x_keys, *garbler_bits(circ, a)), get_alice_keys(y_keys, *evaluator_bits(circ, b)))
+				if decode_outputs(circ, outputs) != [1 | (a << 1) | ((a & b) << 2)]:
+					passed = False
+		if passed:
+			print("Bristol: Old format with constants: PASSED")
+		else:
+			print("Bristol: Old format with constants: FAILED")
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == '__main__':
+	test_bristol()
@@ -0,0 +1,155 @@
+############################################################
+#### Description:
+# Circuit descriptions used for garbling.
+# A circuit is a list of gates in topological order. Each gate is a tuple
+# (gate_name, left_wire, right_wire, out_wire), where wires are integer ids and
+# gate_name is a key of GATE_TRUTH_TABLES in garbled_gate.py.
+# x_wires[i] (resp. y_wires[i]) is the list of wires that bit i of Alice's (resp. Bob's) input feeds into,
+# one wire per fan-out. This matches the x_keys / y_keys maps used in alice_and_bob.py.
+
+# Author: Nikhil Vanjani
+############################################################
+
+class circuit:
+	def __init__(self):
+		self.num_wires = 0
+		self.gates = []
+		self.x_wires = {}
+		self.y_wires = {}
+		self.output_wires = []
+
+	# Returns a fresh wire id.
+	def new_wire(self) -> int:
+		wire = self.num_wires
+		self.num_wires += 1
+		return wire
+
+	# Appends the gate gate_name(left_wire, right_wire) and returns its output wire.
+	def add_gate(self, gate_name: str, left_wire: int, right_wire: int) -> int:
+		out_wire = self.new_wire()
+		self.gates.append((gate_name, left_wire, right_wire, out_wire))
+		return out_wire
+
+	# Returns the number of gates with each gate name.
+	def gate_counts(self) -> dict:
+		counts = {}
+		for (gate_name, _, _, _) in self.gates:
+			counts[gate_name] = counts.get(gate_name, 0) + 1
+		return counts
+
+	# Returns the depth of the circuit, the largest number of gates on a path from an input to an output.
+	# Gates whose name is in free_gates, e.g. the free gates of Free-XOR, count as 0.
+	def depth(self, free_gates=()) -> int:
+		depths = {}
+		for (gate_name, left_wire, right_wire, out_wire) in self.gates:
+			depths[out_wire] = max(depths.get(left_wire, 0), depths.get(right_wire, 0)) + (gate_name not in free_gates)
+		return max((depths.get(wire, 0) for wire in self.output_wires), default=0)
+
+	# Returns a dict mapping each wire to the index of the last gate that reads it.
+	# Output wires map to len(self.gates), since they are read after the last gate.
+	# Wires that are never read are missing from the dict.
+	def get_last_uses(self) -> dict:
+		last_uses = {}
+		for gate_id, (_, left_wire, right_wire, _) in enumerate(self.gates):
+			last_uses[left_wire] = gate_id
+			last_uses[right_wire] = gate_id
+		for wire in self.output_wires:
+			last_uses[wire] = len(self.gates)
+		return last_uses
+
+# Circuit for x >= y, where x and y are both of length num_bits bits.
+# Suppose x = (x0, ..., x{n-1}), y = (y0, ..., y{n-1}) with x0, y0 being the most significant bits.
+# x >= y is computed from the least significant bit upwards as:
+# geq{n-1} = (x{n-1} >= y{n-1})
+# geq{i} = (xi > yi) OR ((xi = yi) AND geq{i+1})
+# Each bit except the last feeds into two gates: gt (fan-out 0) and eq (fan-out 1).
+# The circuit has 4 * (num_bits - 1) + 1 gates, and for num_bits = 2 its gates are ordered as (geq, eq, and, gt, or).
+def comparator_circuit(num_bits: int) -> circuit:
+	if num_bits < 1:
+		raise ValueError('comparator_circuit: num_bits must be at least 1, found {}'.format(num_bits))
+
+	circ = circuit()
+	for i in range(num_bits):
+		fan_out = 2 if i < num_bits - 1 else 1
+		circ.x_wires[i] = [circ.new_wire() for _ in range(fan_out)]
+		circ.y_wires[i] = [circ.new_wire() for _ in range(fan_out)]
+
+	last = num_bits - 1
+	geq = circ.add_gate("GEQ", circ.x_wires[last][0], circ.y_wires[last][0])
+	for i in reversed(range(last)):
+		eq = circ.add_gate("EQ", circ.x_wires[i][1], circ.y_wires[i][1])
+		conj = circ.add_gate("AND", eq, geq)
+		gt = circ.add_gate("GT", circ.x_wires[i][0], circ.y_wires[i][0])
+		geq = circ.add_gate("OR", gt, conj)
+	circ.output_wires = [geq]
+	return circ
+
+# Circuit made of num_copies independent copies of circ, side by side.
+# Input bit i of copy c is input bit c * len(circ.x_wires) + i (resp. c * len(circ.y_wires) + i) of the result,
+# and the outputs of copy c follow the outputs of copy c - 1.
+def batch_circuit(circ: circuit, num_copies: int) -> circuit:
+	if num_copies < 1:
+		raise ValueError('batch_circuit: num_copies must be at least 1, found {}'.format(num_copies))
+
+	batch = circuit()
+	num_x = len(circ.x_wires)
+	num_y = len(circ.y_wires)
+	for c in range(num_copies):
+		offset = c * circ.num_wires
+		for i, wires in circ.x_wires.items():
+			batch.x_wires[c * num_x + i] = [offset + wire for wire in wires]
+		for i, wires in circ.y_wires.items():
+			batch.y_wires[c * num_y + i] = [offset + wire for wire in wires]
+		for (gate_name, left_wire, right_wire, out_wire) in circ.gates:
+			batch.gates.append((gate_name, offset + left_wire, offset + right_wire, offset + out_wire))
+		batch.output_wires.extend(offset + wire for wire in circ.output_wires)
+	batch.num_wires = num_copies * circ.num_wires
+	return batch
+
+# Circuit for num_pairs independent comparisons x_c >= y_c of num_bits bit values, see comparator_circuit.
+# Bit i of x_c (resp. y_c) is input bit c * num_bits + i, and output c is x_c >= y_c.
+def batch_comparator_circuit(num_bits: int, num_pairs: int) -> circuit:
+	return batch_circuit(comparator_circuit(num_bits), num_pairs)
+
+# Circuit for x >= y with the same inputs as comparator_circuit, but with depth O(log num_bits) instead of O(num_bits).
+# The bits are split into segments, and each segment s computes gt{s} = (x_s > y_s) and eq{s} = (x_s = y_s) on its
+# bits, except that the segment holding the least significant bit computes x_s >= y_s instead of x_s > y_s.
+# A segment is the concatenation of a high segment h and a low segment l, which are merged as a prefix network:
+# gt{s} = gt{h} OR (eq{h} AND gt{l}), eq{s} = eq{h} AND eq{l}
+# Segments are split in halves, so the merges form a balanced tree of depth ceil(log2(num_bits)), with 2 gates per level
+# on the path to the output. The circuit has about 5 * num_bits gates, against 4 * num_bits for comparator_circuit.
+def tree_comparator_circuit(num_bits: int) -> circuit:
+	if num_bits < 1:
+		raise ValueError('tree_comparator_circuit: num_bits must be at least 1, found {}'.format(num_bits))
+
+	circ = circuit()
+	for i in range(num_bits):
+		fan_out = 2 if i < num_bits - 1 else 1
+		circ.x_wires[i] = [circ.new_wire() for _ in range(fan_out)]
+		circ.y_wires[i] = [circ.new_wire() for _ in range(fan_out)]
+
+	# Returns (gt, eq) for the segment of bits lo, ..., hi - 1, where eq is None if the segment holds the last bit.
+	def segment(lo: int, hi: int):
+		if hi - lo == 1:
+			if lo == num_bits - 1:
+				return (circ.add_gate("GEQ", circ.x_wires[lo][0], circ.y_wires[lo][0]), None)
+			gt = circ.add_gate("GT", circ.x_wires[lo][0], circ.y_wires[lo][0])
+			eq = circ.add_gate("EQ", circ.x_wires[lo][1], circ.y_wires[lo][1])
+			return (gt, eq)
+		mid = (lo + hi) // 2
+		(gt_high, eq_high) = segment(lo, mid)
+		(gt_low, eq_low) = segment(mid, hi)
+		gt = circ.add_gate("OR", gt_high, circ.add_gate("AND", eq_high, gt_low))
+		eq = circ.add_gate("AND", eq_high, eq_low) if eq_low is not None else None
+		return (gt, eq)
+
+	(geq, _) = segment(0, num_bits)
+	circ.output_wires = [geq]
+	return circ
+
+# Comparator circuits by shape: "ripple" has linear depth and "tree" logarithmic depth.
+COMPARATOR_CIRCUITS = {
+	"ripple": comparator_circuit,
+	"tree": tree_comparator_circuit,
+}
+
@@ -0,0 +1,425 @@
+############################################################
+#### Description:
+# Compact binary file formats for garbled circuits and keys, replacing pickle.
+#
+# A garbled circuit file consists of a header, a gate descriptor array and a contiguous ciphertext region.
+# All integers are little-endian. The descriptor array is stored as one array per field, so that the evaluator
+# can open the file with mmap and read the fields and ciphertexts straight from the buffer
+# without materialising per-gate Python objects.
+#
+# Header (HEADER_FORMAT):
+#   magic, version, hash kind (HASH_SHA256 / HASH_FIXED_KEY), reserved byte,
+#   num_wires, num_gates, num_x_wires, num_y_wires, num_output_wires, size of the ciphertext region,
+#   AES key of the fixed_key_hash (zero bytes if unused).
+# Followed by:
+#   x input wires: num_x_wires pairs (u32 bit index, u32 wire), one per fan-out in fan-out order
+#   y input wires: num_y_wires pairs (u32 bit index, u32 wire)
+#   output wires:  num_output_wires u32
+#   left wires, right wires, out wires: num_gates u32 each
+#   ciphertext offsets: num_gates + 1 u64, the ciphertexts of gate g are at [offsets[g], offsets[g + 1]) in the ciphertext region
+#   gate kinds: num_gates u8 (GATE_*)
+#   decode bits: num_gates u8, the select bit of the key for bit 0 of output gates whose output is a key, NO_DECODE otherwise
+#   ciphertext region
+#
+# The gate_id of a gate is its index in the file.
+#
+# A keys file stores a dict keys[i][j] of bytes objects or tuples of bytes objects, such as alice_keys, bob_keys
+# and Alice's OT message. It consists of KEYS_MAGIC, the u32 number of entries, and for each entry
+# (u32 i, u32 j, u8 number of values, and each value as u32 length followed by its bytes).
+#
+# A garbled gate stream carries the garbled gates of a circuit one at a time, so that Bob can evaluate gate k
+# while Alice is still garbling later gates. The wiring is not part of the stream: both parties know the circuit.
+# It consists of STREAM_MAGIC followed by records (RECORD_FORMAT: u8 kind, u8 decode, u32 length, then length bytes).
+# A record of kind SET_FIXED_KEY carries the AES key of the fixed_key_hash used by the following gates,
+# and a record of kind END_OF_STREAM ends the stream. Other records are gates in the order of the circuit.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from garbled_gate import *
+
+import metrics
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b'GCF1'
+VERSION = 1
+HEADER_FORMAT = struct.Struct('<4sHBBIIIIIQ16s')
+
+HASH_SHA256 = 0
+HASH_FIXED_KEY = 1
+
+# Gate kinds and the layout of their ciphertexts.
+# Classic table: 4 rows of SHA256(P_left || P_right) followed by the Salsa20 ciphertext, sorted by the SHA256 value.
+GATE_CLASSIC = 0
+# Point-and-permute table: 4 Salsa20 ciphertexts of equal length, indexed by the select bits.
+GATE_PP = 1
+# Point-and-permute table with fixed-key AES: 4 rows of equal length, indexed by the select bits.
+GATE_PP_FIXED_KEY = 2
+# Free XOR gate: no ciphertexts.
+GATE_FREE_XOR = 3
+# Half gate: T_G || T_E.
+GATE_HALF_GATE = 4
+
+NO_DECODE = 255
+
+KEYS_MAGIC = b'GCK1'
+
+STREAM_MAGIC = b'GCS1'
+RECORD_FORMAT = struct.Struct('<BBI')
+SET_FIXED_KEY = 254
+END_OF_STREAM = 255
+
+# Returns a bytes object with the items of arr in little-endian order.
+def array_to_bytes(arr: array) -> bytes:
+	if sys.byteorder == 'big':
+		arr = array(arr.typecode, arr)
+		arr.byteswap()
+	return arr.tobytes()
+
+# Returns a view of count items of the given typecode stored little-endian at offset in buf.
+# On little-endian machines this does not copy buf.
+def read_array(buf, offset: int, typecode: str, count: int):
+	size = array(typecode).itemsize * count
+	view = memoryview(buf)[offset:offset + size]
+	if sys.byteorder == 'big':
+		arr = array(typecode, view.tobytes())
+		arr.byteswap()
+		return arr
+	return view.cast(typecode)
+
+# Returns (kind, ciphertexts, decode, fixed_key) for a garbled gate object with index gate_id in its circuit.
+# fixed_key is the fixed_key_hash used by the gate, or None.
+def serialize_gate(garbling, gate_id: int):
+	if isinstance(garbling, free_xor_gate):
+		return (GATE_FREE_XOR, b'', garbling.decode, None)
+	if isinstance(garbling, half_gate):
+		if garbling.gate_id != gate_id:
+			raise ValueError('serialize_gate: half gate has gate_id {}, expected {}'.format(garbling.gate_id, gate_id))
+		fixed_key = garbling.H if isinstance(garbling.H, fixed_key_hash) else None
+		return (GATE_HALF_GATE, garbling.T_G + garbling.T_E, garbling.decode, fixed_key)
+	if isinstance(garbling, garbled_gate_pp):
+		if garbling.H is None:
+			return (GATE_PP, b''.join(garbling.table), None, None)
+		if garbling.gate_id != gate_id:
+			raise ValueError('serialize_gate: point-and-permute gate has gate_id {}, expected {}'.format(garbling.gate_id, gate_id))
+		return (GATE_PP_FIXED_KEY, b''.join(garbling.table), None, garbling.H)
+	if isinstance(garbling, garbled_gate):
+		# Rows are sorted by their SHA256 key so that the row order does not reveal the truth table.
+		rows = [hash_val + ct for (hash_val, ct) in sorted(garbling.table.items())]
+		return (GATE_CLASSIC, b''.join(rows), None, None)
+	raise ValueError('serialize_gate: unknown garbled gate type {}'.format(type(garbling)))
+
+# Inverse of serialize_gate: builds the garbled gate object with index gate_id from its kind, ciphertexts and decode bit.
+# H is the fixed_key_hash of the circuit, or None.
+def deserialize_gate(kind: int, ct: bytes, decode: int, gate_id: int, H = None):
+	decode = None if decode == NO_DECODE else decode
+	if kind == GATE_FREE_XOR:
+		return free_xor_gate(decode)
+	if kind == GATE_HALF_GATE:
+		return half_gate(gate_id, ct[:16], ct[16:], decode, H or hash_tweak)
+	row_len = len(ct) // 4
+	rows = [ct[row * row_len:(row + 1) * row_len] for row in range(4)]
+	if kind == GATE_PP or kind == GATE_PP_FIXED_KEY:
+		garbling = garbled_gate_pp(H if kind == GATE_PP_FIXED_KEY else None, gate_id)
+		garbling.table = rows
+		return garbling
+	if kind == GATE_CLASSIC:
+		garbling = garbled_gate()
+		for row in rows:
+			garbling.table[row[:32]] = row[32:]
+		return garbling
+	raise ValueError('deserialize_gate: unknown gate kind {}'.format(kind))
+
+# Writes the garbled circuit for the circuit circ, as returned by garble_circuit in alice_and_bob.py, to path.
+# Returns the number of bytes written.
+def write_garbled_circuit(path, circ, garbled_circuit) -> int:
+	num_gates = len(circ.gates)
+	if len(garbled_circuit) != num_gates:
+		raise ValueError('write_garbled_circuit: circuit has {} gates but found {} garbled gates'.format(num_gates, len(garbled_circuit)))
+
+	left_wires = array('I')
+	right_wires = array('I')
+	out_wires = array('I')
+	offsets = array('Q', [0])
+	kinds = array('B')
+	decodes = array('B')
+	cts = []
+	ct_size = 0
+	H = None
+	for gate_id, (garbling, (_, left_wire, right_wire, out_wire)) in enumerate(zip(garbled_circuit, circ.gates)):
+		(kind, ct, decode, fixed_key) = serialize_gate(garbling, gate_id)
+		if fixed_key is not None:
+			if H is None:
+				H = fixed_key
+			elif H.key != fixed_key.key:
+				raise ValueError('write_garbled_circuit: all gates must use the same fixed_key_hash')
+		left_wires.append(left_wire)
+		right_wires.append(right_wire)
+		out_wires.append(out_wire)
+		kinds.append(kind)
+		decodes.append(NO_DECODE if decode is None else decode)
+		cts.append(ct)
+		ct_size += len(ct)
+		offsets.append(ct_size)
+
+	x_inputs = array('I')
+	for i, wires in circ.x_wires.items():
+		for wire in wires:
+			x_inputs.extend((i, wire))
+	y_inputs = array('I')
+	for i, wires in circ.y_wires.items():
+		for wire in wires:
+			y_inputs.extend((i, wire))
+	output_wires = array('I', circ.output_wires)
+
+	hash_kind = HASH_SHA256 if H is None else HASH_FIXED_KEY
+	aes_key = bytes(16) if H is None else H.key
+	header = HEADER_FORMAT.pack(MAGIC, VERSION, hash_kind, 0, circ.num_wires, num_gates,
+		len(x_inputs) // 2, len(y_inputs) // 2, len(output_wires), ct_size, aes_key)
+
+	with open(path, "wb") as file:
+		file.write(header)
+		for arr in (x_inputs, y_inputs, output_wires, left_wires, right_wires, out_wires, offsets, kinds, decodes):
+			file.write(array_to_bytes(arr))
+		for ct in cts:
+			file.write(ct)
+		size = file.tell()
+	if metrics.enabled:
+		metrics.count("message_bytes_total", size, message="garbled_circuit")
+	return size
+
+# Read-only view of a garbled circuit file held in a buffer such as an mmap.
+# The fields are views into the buffer, so opening a file costs O(1) and no per-gate objects are created.
+class garbled_circuit_view:
+	def __init__(self, buf):
+		(magic, version, hash_kind, _, self.num_wires, self.num_gates, num_x_wires, num_y_wires, num_output_wires,
+			ct_size, aes_key) = HEADER_FORMAT.unpack_from(buf, 0)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('garbled_circuit_view: not a garbled circuit file of version {}'.format(VERSION))
+		self.H = fixed_key_hash(aes_key) if hash_kind == HASH_FIXED_KEY else hash_tweak
+
+		offset = HEADER_FORMAT.size
+		self.x_inputs = read_array(buf, offset, 'I', 2 * num_x_wires)
+		offset += 8 * num_x_wires
+		self.y_inputs = read_array(buf, offset, 'I', 2 * num_y_wires)
+		offset += 8 * num_y_wires
+		self.output_wires = read_array(buf, offset, 'I', num_output_wires)
+		offset += 4 * num_output_wires
+		self.left_wires = read_array(buf, offset, 'I', self.num_gates)
+		offset += 4 * self.num_gates
+		self.right_wires = read_array(buf, offset, 'I', self.num_gates)
+		offset += 4 * self.num_gates
+		self.out_wires = read_array(buf, offset, 'I', self.num_gates)
+		offset += 4 * self.num_gates
+		self.offsets = read_array(buf, offset, 'Q', self.num_gates + 1)
+		offset += 8 * (self.num_gates + 1)
+		self.kinds = read_array(buf, offset, 'B', self.num_gates)
+		offset += self.num_gates
+		self.decodes = read_array(buf, offset, 'B', self.num_gates)
+		offset += self.num_gates
+		self.cts = memoryview(buf)[offset:offset + ct_size]
+		if len(self.cts) != ct_size:
+			raise ValueError('garbled_circuit_view: file is truncated')
+
+	# Releases the views into the buffer, so that the buffer can be closed.
+	def release(self):
+		for view in (self.x_inputs, self.y_inputs, self.output_wires, self.left_wires, self.right_wires,
+				self.out_wires, self.offsets, self.kinds, self.decodes, self.cts):
+			if isinstance(view, memoryview):
+				view.release()
+
+	# Evaluates the garbled circuit gate by gate in the order of the file.
+	# alice_keys[i][j] (resp. bob_keys[i][j]) is the key on the j-th fan-out wire of input bit i of x (resp. y).
+	# Returns the list of bytes objects on the output wires.
+	def evaluate(self, alice_keys, bob_keys) -> list:
+		wire_vals = [None] * self.num_wires
+		for (inputs, input_keys) in ((self.x_inputs, alice_keys), (self.y_inputs, bob_keys)):
+			fan_out = {}
+			for k in range(0, len(inputs), 2):
+				i = inputs[k]
+				j = fan_out.get(i, 0)
+				fan_out[i] = j + 1
+				wire_vals[inputs[k + 1]] = input_keys[i][j]
+
+		H = self.H
+		cts = self.cts
+		offsets = self.offsets
+		for gate_id in range(self.num_gates):
+			kind = self.kinds[gate_id]
+			P_left = wire_vals[self.left_wires[gate_id]]
+			P_right = wire_vals[self.right_wires[gate_id]]
+			ct = cts[offsets[gate_id]:offsets[gate_id + 1]]
+			if kind == GATE_FREE_XOR:
+				P_out = xor_bytes(P_left, P_right)
+			elif kind == GATE_HALF_GATE:
+				P_out = evaluate_half_gate(H, gate_id, ct[:16], ct[16:], P_left, P_right)
+			elif kind == GATE_PP_FIXED_KEY:
+				row_len = len(ct) // 4
+				row = 2 * select_bit(P_left) + select_bit(P_right)
+				pad = H.hash_pair(P_left, P_right, gate_id)[:row_len]
+				P_out = xor_bytes(ct[row * row_len:(row + 1) * row_len], pad)
+			elif kind == GATE_PP:
+				row_len = len(ct) // 4
+				row = 2 * select_bit(P_left) + select_bit(P_right)
+				P_out = decrypt_2_keys(P_left, P_right, bytes(ct[row * row_len:(row + 1) * row_len]))
+			elif kind == GATE_CLASSIC:
+				row_len = len(ct) // 4
+				hash_val = hash_2_vals(P_left, P_right)
+				P_out = None
+				for row in range(4):
+					if ct[row * row_len:row * row_len + 32] == hash_val:
+						P_out = decrypt_2_keys(P_left, P_right, bytes(ct[row * row_len + 32:(row + 1) * row_len]))
+						break
+				if P_out is None:
+					raise ValueError('garbled_circuit_view: no row of gate {} matches the input keys'.format(gate_id))
+			else:
+				raise ValueError('garbled_circuit_view: unknown gate kind {}'.format(kind))
+			decode = self.decodes[gate_id]
+			if decode != NO_DECODE:
+				P_out = decode_key(P_out, decode)
+			wire_vals[self.out_wires[gate_id]] = P_out
+		return [wire_vals[wire] for wire in self.output_wires]
+
+# Opens the garbled circuit file at path with mmap and evaluates it, see garbled_circuit_view.evaluate.
+def evaluate_garbled_circuit_file(path, alice_keys, bob_keys) -> list:
+	with open(path, "rb") as file:
+		with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+			view = garbled_circuit_view(buf)
+			try:
+				return view.evaluate(alice_keys, bob_keys)
+			finally:
+				view.release()
+
+# Writes keys[i][j], each a bytes object or a tuple of bytes objects, to the binary file object file.
+def write_keys(file, keys: dict):
+	entries = [(i, j, keys[i][j]) for i in keys for j in keys[i]]
+	file.write(KEYS_MAGIC)
+	file.write(struct.pack('<I', len(entries)))
+	size = 8
+	for (i, j, values) in entries:
+		if isinstance(values, (bytes, bytearray)):
+			values = (values,)
+		file.write(struct.pack('<IIB', i, j, len(values)))
+		size += 9
+		for value in values:
+			file.write(struct.pack('<I', len(value)))
+			file.write(value)
+			size += 4 + len(value)
+	if metrics.enabled:
+		metrics.count("message_bytes_total", size, message="keys")
+
+# Reads keys written by write_keys from the binary file object file.
+# Entries with a single value are returned as bytes objects, others as tuples.
+def read_keys(file) -> dict:
+	if read_exactly(file, 4) != KEYS_MAGIC:
+		raise ValueError('read_keys: not a keys file')
+	(num_entries,) = struct.unpack('<I', read_exactly(file, 4))
+	keys = {}
+	for _ in range(num_entries):
+		(i, j, num_values) = struct.unpack('<IIB', read_exactly(file, 9))
+		values = []
+		for _ in range(num_values):
+			(length,) = struct.unpack('<I', read_exactly(file, 4))
+			values.append(read_exactly(file, length))
+		keys.setdefault(i, {})[j] = values[0] if num_values == 1 else tuple(values)
+	return keys
+
+# Writes keys to path, see write_keys.
+def write_keys_file(path, keys: dict):
+	with open(path, "wb") as file:
+		write_keys(file, keys)
+
+# Reads keys from path, see read_keys.
+def read_keys_file(path) -> dict:
+	with open(path, "rb") as file:
+		return read_keys(file)
+
+# Reads exactly length bytes from the binary file object file.
+def read_exactly(file, length: int) -> bytes:
+	data = file.read(length)
+	if len(data) != length:
+		raise ValueError('read_exactly: stream ended after {} of {} bytes'.format(len(data), length))
+	return data
+
+# Writes the garbled gates from the iterable gate_stream to the binary file object file as they are produced.
+# The file is flushed every flush_every gates so that the reader can start evaluating early.
+# Returns the number of bytes written.
+def write_gate_stream(file, gate_stream, flush_every: int = 1000) -> int:
+	file.write(STREAM_MAGIC)
+	size = len(STREAM_MAGIC)
+	H = None
+	for gate_id, garbling in enumerate(gate_stream):
+		(kind, ct, decode, fixed_key) = serialize_gate(garbling, gate_id)
+		if fixed_key is not None and (H is None or H.key != fixed_key.key):
+			H = fixed_key
+			file.write(RECORD_FORMAT.pack(SET_FIXED_KEY, NO_DECODE, len(H.key)))
+			file.write(H.key)
+			size += RECORD_FORMAT.size + len(H.key)
+		file.write(RECORD_FORMAT.pack(kind, NO_DECODE if decode is None else decode, len(ct)))
+		file.write(ct)
+		size += RECORD_FORMAT.size + len(ct)
+		if (gate_id + 1) % flush_every == 0:
+			file.flush()
+	file.write(RECORD_FORMAT.pack(END_OF_STREAM, NO_DECODE, 0))
+	file.flush()
+	size += RECORD_FORMAT.size
+	if metrics.enabled:
+		metrics.count("message_bytes_total", size, message="gate_stream")
+	return size
+
+# Generator that reads the garbled gates written by write_gate_stream from the binary file object file
+# and yields them one at a time, e.g. for evaluate_circuit in alice_and_bob.py.
+def read_gate_stream(file):
+	if read_exactly(file, 4) != STREAM_MAGIC:
+		raise ValueError('read_gate_stream: not a garbled gate stream')
+	H = None
+	gate_id = 0
+	while True:
+		(kind, decode, length) = RECORD_FORMAT.unpack(read_exactly(file, RECORD_FORMAT.size))
+		if kind == END_OF_STREAM:
+			return
+		data = read_exactly(file, length)
+		if kind == SET_FIXED_KEY:
+			H = fixed_key_hash(data)
+			continue
+		yield deserialize_gate(kind, data, decode, gate_id, H)
+		gate_id += 1
+
+def test_circuit_file():
+	from alice_and_bob import garble_circuit, get_alice_keys, bit_decomposition
+	from circuit import comparator_circuit
+	import os
+	import random
+	import tempfile
+
+	schemes = ({}, {"point_and_permute": True}, {"fixed_key": True}, {"free_xor": True}, {"half_gates": True}, {"half_gates": True, "fixed_key": True})
+	num_bits = 8
+	circ = comparator_circuit(num_bits)
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		path = os.path.join(tmp_dir, "garbled_circuit.gc")
+		keys_path = os.path.join(tmp_dir, "keys.bin")
+		for options in schemes:
+			(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+			size = write_garbled_circuit(path, circ, garbled_circuit)
+			passed = True
+			for _ in range(10):
+				alice_input = random.getrandbits(num_bits)
+				bob_input = random.getrandbits(num_bits)
+				alice_keys = get_alice_keys(x_keys, *bit_decomposition(alice_input, num_bits))
+				bob_keys = get_alice_keys(y_keys, *bit_decomposition(bob_input, num_bits))
+				write_keys_file(keys_path, alice_keys)
+				if read_keys_file(keys_path) != alice_keys:
+					passed = False
+				(val_out,) = evaluate_garbled_circuit_file(path, alice_keys, bob_keys)
+				if (int.from_bytes(val_out, byteorder='big') != 0) != (alice_input >= bob_input):
+					passed = False
+			if passed:
+				print("Circuit File: Correctness for options = {}, size = {} bytes: PASSED".format(options, size))
+			else:
+				print("Circuit File: Correctness for options = {}: FAILED".format(options))
+
+if __name__ == '__main__':
+	test_circuit_file()
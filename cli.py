@@ -0,0 +1,420 @@
+############################################################
+#### Description:
+# Non-interactive command line for the steps of alice.py and bob.py, for scripts and benchmarks:
+#   python cli.py garble --bits 8 --input 5          Alice garbles and sends her keys ('garble', 'alice_keys')
+#   python cli.py ot --bits 8 --input 3              Bob's keys via OT ('bob_ot1', 'alice_ot1', 'bob_ot2'),
+#                                                    or a single step with --step
+#   python cli.py evaluate                           Bob evaluates and prints the output
+#   python cli.py run --batch steps.txt              runs one command per line of steps.txt in this process
+# The files are exchanged in ./files, as with alice.py and bob.py.
+# Every command imports the modules it needs when it runs, so that the interpreter only pays for them once a command
+# needs them, and `python cli.py --help` imports only argparse and metrics.
+# Each process still pays the interpreter startup and the imports of pycryptodome and Elgamal. A daemon keeps them
+# warm between invocations:
+#   python cli.py daemon --socket /tmp/gc.sock       imports every step and builds the EC OT tables once
+#   python cli.py --socket /tmp/gc.sock garble ...   sends the command to the daemon, which runs it in the client's
+#                                                    working directory and returns its output and exit status
+#   python cli.py --socket /tmp/gc.sock stop         stops the daemon
+# --socket must be the first argument (--socket PATH or --socket=PATH), since only then is the command forwarded.
+# A daemon replaces a stale socket left at its path, but refuses to start if another daemon listens there.
+# The client only imports json, socket and struct. The daemon runs one command at a time, since the commands share
+# ./files. benchmark_cli reports the time per command of cold processes, of the daemon and of a batch file.
+
+# Author: Nikhil Vanjani
+############################################################
+
+import json
+import os
+import socket
+import struct
+import sys
+
+# payload length
+FRAME_HEADER = struct.Struct('<I')
+OT_STEPS = ("bob_ot1", "alice_ot1", "bob_ot2")
+
+def command_garble(args) -> int:
+	import alice
+
+	alice.generate_garbled_circuit(args.bits)
+	if args.input is not None:
+		alice.generate_alice_keys(args.bits, args.input)
+	return 0
+
+def command_ot(args) -> int:
+	steps = OT_STEPS if args.step is None else (args.step,)
+	if "bob_ot1" in steps and args.input is None:
+		print("error: bob_ot1 needs Bob's --input", file=sys.stderr)
+		return 2
+	for step in steps:
+		if step == "alice_ot1":
+			import alice
+			alice.generate_alice_ot1(args.bits)
+		else:
+			import bob
+			if step == "bob_ot1":
+				bob.generate_bob_ot1(args.bits, args.input)
+			else:
+				bob.generate_bob_ot2(args.bits)
+	return 0
+
+def command_evaluate(args) -> int:
+	import bob
+
+	bob.generate_output()
+	return 0
+
+# Runs the commands of the file args.batch, one per line, in this process. Empty lines and lines starting with '#'
+# are skipped, and the first command that fails stops the batch.
+def command_run(args) -> int:
+	import shlex
+
+	with open(args.batch) as file:
+		for line in file:
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			status = dispatch(shlex.split(line))
+			if status != 0:
+				return status
+	return 0
+
+def command_daemon(args) -> int:
+	try:
+		serve_daemon(args.socket)
+	except ValueError as error:
+		print("error: {}".format(error), file=sys.stderr)
+		return 2
+	return 0
+
+def command_stop(args) -> int:
+	print("error: stop is a command of the daemon, use --socket", file=sys.stderr)
+	return 2
+
+def make_parser():
+	import argparse
+
+	parser = argparse.ArgumentParser(prog="python cli.py", description="Runs the steps of alice.py and bob.py without prompts.")
+	parser.add_argument("--socket", help="send the command to the daemon listening on this Unix socket")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	garble = commands.add_parser("garble", help="Alice garbles the comparator and sends her keys")
+	garble.add_argument("--bits", type=int, default=2, help="bit width of the inputs")
+	garble.add_argument("--input", type=int, help="Alice's input. Without it, her keys are not sent")
+	garble.set_defaults(run=command_garble)
+
+	ot = commands.add_parser("ot", help="Bob obtains his keys via OT")
+	ot.add_argument("--bits", type=int, default=2, help="bit width of the inputs")
+	ot.add_argument("--input", type=int, help="Bob's input, needed by bob_ot1")
+	ot.add_argument("--step", choices=OT_STEPS, help="run only this step")
+	ot.set_defaults(run=command_ot)
+
+	evaluate = commands.add_parser("evaluate", help="Bob evaluates the garbled circuit")
+	evaluate.set_defaults(run=command_evaluate)
+
+	run = commands.add_parser("run", help="run the commands of a file, one per line")
+	run.add_argument("--batch", required=True, help="file of commands")
+	run.set_defaults(run=command_run)
+
+	daemon = commands.add_parser("daemon", help="serve commands on a Unix socket, with warm imports and tables")
+	daemon.add_argument("--socket", required=True, help="path of the Unix socket")
+	daemon.set_defaults(run=command_daemon)
+
+	stop = commands.add_parser("stop", help="stop the daemon given by --socket")
+	stop.set_defaults(run=command_stop)
+	return parser
+
+# Runs the command line argv in this process. Returns the exit status.
+def dispatch(argv: list) -> int:
+	try:
+		args = make_parser().parse_args(argv)
+	except SystemExit as error:
+		return error.code if isinstance(error.code, int) else 1
+	# main forwards the commands for a daemon, so --socket only gets here if it was not the first argument.
+	if args.socket is not None and args.command != "daemon":
+		print("error: --socket must be the first argument, as --socket PATH or --socket=PATH", file=sys.stderr)
+		return 2
+	return args.run(args)
+
+def send_frame(sock, payload: bytes):
+	sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+def recv_frame(sock) -> bytes:
+	header = recv_exactly(sock, FRAME_HEADER.size)
+	(length,) = FRAME_HEADER.unpack(header)
+	return recv_exactly(sock, length)
+
+def recv_exactly(sock, length: int) -> bytes:
+	data = bytearray()
+	while len(data) < length:
+		chunk = sock.recv(length - len(data))
+		if not chunk:
+			raise ValueError('recv_exactly: connection closed after {} of {} bytes'.format(len(data), length))
+		data.extend(chunk)
+	return bytes(data)
+
+# Imports every step and builds the precomputed tables, so that the first command does not pay for them.
+def warm_up():
+	import alice
+	import bob
+	import oblivious_transfer
+
+	oblivious_transfer.ed25519_multiply_g(1)
+
+# Runs argv in the working directory cwd and captures its output. Returns (status, output).
+def run_captured(argv: list, cwd: str) -> (int, str):
+	import contextlib
+	import io
+	import traceback
+
+	output = io.StringIO()
+	previous = os.getcwd()
+	with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+		try:
+			os.chdir(cwd)
+			status = dispatch(argv)
+		except Exception:
+			traceback.print_exc()
+			status = 1
+		finally:
+			os.chdir(previous)
+	return (status, output.getvalue())
+
+# Handles the request of one client of serve_daemon. Returns True if the client asked the daemon to stop.
+def handle_request(conn) -> bool:
+	request = json.loads(recv_frame(conn))
+	(argv, cwd) = (request["argv"], request["cwd"])
+	if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv) or not isinstance(cwd, str):
+		raise ValueError('handle_request: argv must be a list of strings and cwd a string')
+	if argv[:1] == ["stop"]:
+		send_frame(conn, json.dumps({"status": 0, "output": ""}).encode())
+		return True
+	if argv[:1] == ["daemon"]:
+		(status, output) = (2, "error: the daemon cannot start another daemon\n")
+	else:
+		(status, output) = run_captured(argv, cwd)
+	send_frame(conn, json.dumps({"status": status, "output": output}).encode())
+	return False
+
+# Removes the socket left at path by a daemon that has exited. Raises ValueError if path is not a socket, or if
+# another daemon is listening on it.
+def remove_stale_socket(path: str):
+	import stat
+
+	if not os.path.exists(path):
+		return
+	if not stat.S_ISSOCK(os.stat(path).st_mode):
+		raise ValueError('serve_daemon: {} exists and is not a socket'.format(path))
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+		try:
+			probe.connect(path)
+		except ConnectionRefusedError:
+			os.remove(path)
+			return
+	raise ValueError('serve_daemon: another daemon is listening on {}'.format(path))
+
+# Serves commands on the Unix socket path until a client sends 'stop'. ready, if given, is set once the socket listens.
+# A request that cannot be read or answered is reported on stderr, and the daemon serves the next one.
+def serve_daemon(path: str, ready=None):
+	remove_stale_socket(path)
+	warm_up()
+	server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	server.bind(path)
+	server.listen()
+	if ready is not None:
+		ready.set()
+	try:
+		while True:
+			(conn, _) = server.accept()
+			with conn:
+				try:
+					if handle_request(conn):
+						return
+				except (OSError, ValueError, KeyError, TypeError) as error:
+					print("daemon: dropped a request: {}".format(error), file=sys.stderr)
+	finally:
+		server.close()
+		os.remove(path)
+
+# Sends argv to the daemon on the Unix socket path, to run in the working directory cwd. Returns (status, output).
+def send_command(path: str, argv: list, cwd: str = None) -> (int, str):
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.connect(path)
+		send_frame(sock, json.dumps({"argv": argv, "cwd": cwd or os.getcwd()}).encode())
+		response = json.loads(recv_frame(sock))
+	return (response["status"], response["output"])
+
+def main(argv=None) -> int:
+	argv = sys.argv[1:] if argv is None else argv
+	if argv[:1] and argv[0].startswith("--socket="):
+		argv = ["--socket", argv[0][len("--socket="):]] + argv[1:]
+	# A command for the daemon is forwarded before argparse is even imported.
+	if len(argv) > 2 and argv[0] == "--socket" and argv[2] != "daemon":
+		(status, output) = send_command(argv[1], argv[2:])
+		sys.stdout.write(output)
+		return status
+	import metrics
+
+	# Serves metrics on http://127.0.0.1:$GC_METRICS_PORT/metrics if that environment variable is set, see metrics.py.
+	metrics.configure_from_environment()
+	return dispatch(argv)
+
+# Checks the commands in this process, in a batch file and through a daemon, in a temporary directory.
+# 1 bit inputs keep the Elgamal OT to a single key generation.
+def test_cli():
+	import contextlib
+	import io
+	import tempfile
+	import threading
+
+	# The modules are imported before changing directory, where they would not be found when this file is not the script.
+	warm_up()
+	previous = os.getcwd()
+	with tempfile.TemporaryDirectory() as directory:
+		os.chdir(directory)
+		try:
+			output = io.StringIO()
+			with contextlib.redirect_stdout(output):
+				status = [dispatch(["garble", "--bits", "1", "--input", "1"]), dispatch(["ot", "--bits", "1", "--input", "0"]), dispatch(["evaluate"])]
+			if status == [0, 0, 0] and output.getvalue() == "Alice's value >= Bob's value\n":
+				print("CLI: Commands: PASSED")
+			else:
+				print("CLI: Commands: FAILED")
+
+			# Bob's OT keys from bob_ot1 are reused, so the batch garbles again without a new Elgamal key generation.
+			with open("steps.txt", "w") as file:
+				file.write("# Alice's input 0 against Bob's input 0\ngarble --bits 1 --input 0\n\not --bits 1 --step alice_ot1\not --bits 1 --step bob_ot2\nevaluate\n")
+			output = io.StringIO()
+			with contextlib.redirect_stdout(output):
+				status = dispatch(["run", "--batch", "steps.txt"])
+			with contextlib.redirect_stderr(io.StringIO()):
+				unknown = dispatch(["unknown"])
+			if status == 0 and output.getvalue() == "Alice's value >= Bob's value\n" and unknown == 2:
+				print("CLI: Batch file: PASSED")
+			else:
+				print("CLI: Batch file: FAILED")
+
+			path = os.path.join(directory, "gc.sock")
+			ready = threading.Event()
+			daemon = threading.Thread(target=serve_daemon, args=(path, ready))
+			daemon.start()
+			ready.wait()
+			results = [send_command(path, argv) for argv in (["run", "--batch", "steps.txt"], ["ot", "--bits", "1", "--step", "bob_ot1"], ["daemon", "--socket", path])]
+			output = io.StringIO()
+			with contextlib.redirect_stdout(output):
+				status = main(["--socket=" + path, "evaluate"])
+			results.append((status, output.getvalue()))
+			with contextlib.redirect_stderr(io.StringIO()):
+				results.append(dispatch(["garble", "--socket", path]))
+			send_command(path, ["stop"])
+			daemon.join()
+			if results == [(0, "Alice's value >= Bob's value\n"), results[1], results[2], (0, "Alice's value >= Bob's value\n"), 2] and \
+					results[1][0] == 2 and results[2][0] == 2 and not os.path.exists(path):
+				print("CLI: Daemon: PASSED")
+			else:
+				print("CLI: Daemon: FAILED")
+
+			# Requests that are empty, not JSON or without a cwd are dropped, and the daemon keeps serving.
+			errors = io.StringIO()
+			daemon = threading.Thread(target=serve_daemon, args=(path, ready))
+			ready.clear()
+			with contextlib.redirect_stderr(errors):
+				daemon.start()
+				ready.wait()
+				for payload in (None, b"not json", json.dumps({"argv": ["evaluate"]}).encode()):
+					with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+						sock.connect(path)
+						if payload is not None:
+							send_frame(sock, payload)
+						sock.shutdown(socket.SHUT_WR)
+						sock.recv(1)
+				# A second daemon must not take over the socket of a running one. Its probe is the 4th dropped request.
+				try:
+					serve_daemon(path)
+					refused = False
+				except ValueError:
+					refused = True
+				result = send_command(path, ["evaluate"])
+				send_command(path, ["stop"])
+				daemon.join()
+			if result == (0, "Alice's value >= Bob's value\n") and refused and errors.getvalue().count("daemon: dropped a request") == 4:
+				print("CLI: Daemon errors: PASSED")
+			else:
+				print("CLI: Daemon errors: FAILED")
+
+			# A stale socket is replaced, but a file that is not a socket is left alone.
+			stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			stale.bind(path)
+			stale.close()
+			remove_stale_socket(path)
+			with open(path, "w") as file:
+				file.write("not a socket")
+			with contextlib.redirect_stderr(io.StringIO()):
+				status = dispatch(["daemon", "--socket", path])
+			if status == 2 and os.path.exists(path):
+				print("CLI: Stale socket: PASSED")
+			else:
+				print("CLI: Stale socket: FAILED")
+		finally:
+			os.chdir(previous)
+
+# Writes Bob's keys for bob_input from Alice's seed, as the OT would, without its Elgamal key generations.
+def write_bob_keys(num_bits: int, bob_input: int):
+	import alice
+	from alice_and_bob import get_alice_keys, bit_decomposition
+	from circuit_file import write_keys_file
+
+	(_, y_keys) = alice.load_input_keys(num_bits)
+	write_keys_file("./files/bob/bob_keys.bin", get_alice_keys(y_keys, *bit_decomposition(bob_input, num_bits)))
+
+# Reports the time per command of `python cli.py ...` processes (cold), of the same commands sent to a daemon (warm,
+# which still starts the client interpreter) and of garble in a batch file run by one process, together with the
+# startup time of an empty interpreter. OT is left out, since its Elgamal OTs take hundreds of milliseconds whatever the
+# startup.
+def benchmark_cli(num_bits=8, trials=5):
+	import statistics
+	import subprocess
+	import tempfile
+	import time
+
+	script = os.path.abspath(__file__)
+	commands = [["garble", "--bits", str(num_bits), "--input", "5"], ["evaluate"]]
+
+	def timed(argv) -> float:
+		start = time.perf_counter()
+		subprocess.run([sys.executable] + argv, check=True, stdout=subprocess.DEVNULL)
+		return time.perf_counter() - start
+
+	warm_up()
+	previous = os.getcwd()
+	with tempfile.TemporaryDirectory() as directory:
+		os.chdir(directory)
+		try:
+			path = os.path.join(directory, "gc.sock")
+			daemon = subprocess.Popen([sys.executable, script, "daemon", "--socket", path])
+			while not os.path.exists(path):
+				time.sleep(0.01)
+
+			print("interpreter startup: {:.1f} ms".format(statistics.median(timed(["-c", "pass"]) for _ in range(trials)) * 1e3))
+			for argv in commands:
+				if argv[0] == "evaluate":
+					write_bob_keys(num_bits, 3)
+				cold = statistics.median(timed([script] + argv) for _ in range(trials))
+				warm = statistics.median(timed([script, "--socket", path] + argv) for _ in range(trials))
+				print("{:<10} cold {:.1f} ms, warm {:.1f} ms".format(argv[0], cold * 1e3, warm * 1e3))
+
+			# The batch only repeats garble, since evaluate needs Bob's keys of the latest garbled circuit.
+			with open("steps.txt", "w") as file:
+				file.write("\n".join(" ".join(commands[0]) for _ in range(trials)) + "\n")
+			batch = timed([script, "run", "--batch", "steps.txt"])
+			print("batch      garble {:.1f} ms per command".format(batch / trials * 1e3))
+			send_command(path, ["stop"])
+			daemon.wait()
+		finally:
+			os.chdir(previous)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		sys.exit(main())
+	test_cli()
+	# benchmark_cli()
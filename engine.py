@@ -0,0 +1,313 @@
+############################################################
+#### Description:
+# Array-backed evaluation engine for garbled circuits.
+# evaluate_circuit in alice_and_bob.py walks a tuple of garbled gate objects, and each lookup builds cipher objects
+# and passes keys around as separate bytes objects. compiled_circuit instead stores the garbled circuit in parallel
+# arrays, like the circuit file format of circuit_file.py: gate kinds, left / right / output wires, decode bits, and the
+# offsets of each gate's ciphertexts in one bytes object. The keys of all wires live in one preallocated list of
+# LABEL_SIZE byte keys, indexed by wire id, so reading and writing a key does not copy it.
+# Gates are scheduled by crypto depth: the depth of a gate is the number of gates needing a hash on its longest input
+# path. All gates of a depth that need the fixed-key AES hash (half gates and point-and-permute tables with a
+# fixed_key_hash) are hashed with a single AES-ECB call over all their blocks, since the cost of one call is dominated
+# by its overhead and not by the number of blocks. Free-XOR gates of the same depth follow in circuit order.
+# Other gates (Salsa20 tables and SHA256 half gates) are evaluated one at a time, but still without gate objects, and
+# the SHA256 hashes use hashlib instead of pycryptodome, whose per-call overhead is several times the hash itself.
+# Salsa20 tables cost the same as with evaluate_circuit, since pycryptodome's Salsa20 dominates both.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from garbled_gate import decrypt_2_keys, evaluate_half_gate, decode_key, fixed_key_hash
+from circuit_file import serialize_gate, garbled_circuit_view, GATE_CLASSIC, GATE_PP, GATE_PP_FIXED_KEY, \
+	GATE_FREE_XOR, GATE_HALF_GATE, NO_DECODE
+
+from array import array
+from hashlib import sha256
+import metrics
+
+LABEL_SIZE = 16
+MASK_128 = (1 << 128) - 1
+
+# Garbled circuit stored in parallel arrays, see the description at the top of this file.
+# x_inputs (resp. y_inputs) holds (input bit, wire) pairs for alice's (resp. bob's) keys, in fan-out order.
+# H is the fixed_key_hash of the circuit, or None.
+class compiled_circuit:
+	def __init__(self, num_wires, x_inputs, y_inputs, output_wires, left_wires, right_wires, out_wires, kinds, decodes, offsets, cts, H=None):
+		self.num_wires = num_wires
+		self.x_inputs = x_inputs
+		self.y_inputs = y_inputs
+		self.output_wires = output_wires
+		self.left_wires = left_wires
+		self.right_wires = right_wires
+		self.out_wires = out_wires
+		self.kinds = kinds
+		self.decodes = decodes
+		self.offsets = offsets
+		self.cts = cts
+		self.H = H
+		self.schedule = self.get_schedule()
+
+	# Compiles the garbled circuit returned by garble_circuit in alice_and_bob.py for the circuit circ.
+	@classmethod
+	def from_garbled_circuit(cls, circ, garbled_circuit):
+		left_wires = array('I')
+		right_wires = array('I')
+		out_wires = array('I')
+		kinds = bytearray()
+		decodes = bytearray()
+		offsets = array('Q', [0])
+		cts = []
+		H = None
+		for gate_id, (garbling, (_, left_wire, right_wire, out_wire)) in enumerate(zip(garbled_circuit, circ.gates)):
+			(kind, ct, decode, fixed_key) = serialize_gate(garbling, gate_id)
+			if fixed_key is not None:
+				if H is not None and H.key != fixed_key.key:
+					raise ValueError('compiled_circuit: gates use different fixed-key hashes')
+				H = fixed_key
+			left_wires.append(left_wire)
+			right_wires.append(right_wire)
+			out_wires.append(out_wire)
+			kinds.append(kind)
+			decodes.append(NO_DECODE if decode is None else decode)
+			cts.append(ct)
+			offsets.append(offsets[-1] + len(ct))
+		x_inputs = array('I', [v for (i, wires) in circ.x_wires.items() for wire in wires for v in (i, wire)])
+		y_inputs = array('I', [v for (i, wires) in circ.y_wires.items() for wire in wires for v in (i, wire)])
+		return cls(circ.num_wires, x_inputs, y_inputs, array('I', circ.output_wires), left_wires, right_wires, out_wires,
+			kinds, decodes, offsets, b''.join(cts), H)
+
+	# Compiles a garbled circuit file opened as a garbled_circuit_view, copying its arrays out of the buffer.
+	@classmethod
+	def from_view(cls, view: garbled_circuit_view):
+		H = view.H if isinstance(view.H, fixed_key_hash) else None
+		return cls(view.num_wires, array('I', view.x_inputs), array('I', view.y_inputs), array('I', view.output_wires),
+			array('I', view.left_wires), array('I', view.right_wires), array('I', view.out_wires), bytearray(view.kinds),
+			bytearray(view.decodes), array('Q', view.offsets), bytes(view.cts), H)
+
+	# Returns the list of (batched gates, other gates) per crypto depth, where each entry is an array of gate ids
+	# in circuit order. Batched gates need the fixed-key AES hash, other gates are free-XOR gates or gates evaluated
+	# one at a time, which come after the batched gates of their depth.
+	def get_schedule(self) -> list:
+		wire_depths = [0] * self.num_wires
+		batched = []
+		others = []
+		for gate_id in range(len(self.kinds)):
+			kind = self.kinds[gate_id]
+			depth = max(wire_depths[self.left_wires[gate_id]], wire_depths[self.right_wires[gate_id]])
+			if kind != GATE_FREE_XOR:
+				depth += 1
+			wire_depths[self.out_wires[gate_id]] = depth
+			while len(batched) <= depth:
+				batched.append(array('I'))
+				others.append(array('I'))
+			if self.H is not None and (kind == GATE_HALF_GATE or kind == GATE_PP_FIXED_KEY) and depth > 0:
+				batched[depth].append(gate_id)
+			else:
+				others[depth].append(gate_id)
+		return list(zip(batched, others))
+
+	# Evaluates the garbled circuit.
+	# alice_keys[i][j] (resp. bob_keys[i][j]) is the key on the j-th fan-out wire of input bit i of x (resp. y).
+	# Returns the list of bytes objects on the output wires.
+	def evaluate(self, alice_keys, bob_keys) -> list:
+		labels = [None] * self.num_wires
+		for (inputs, input_keys) in ((self.x_inputs, alice_keys), (self.y_inputs, bob_keys)):
+			fan_out = {}
+			for k in range(0, len(inputs), 2):
+				i = inputs[k]
+				j = fan_out.get(i, 0)
+				fan_out[i] = j + 1
+				labels[inputs[k + 1]] = input_keys[i][j]
+
+		kinds = self.kinds
+		left_wires = self.left_wires
+		right_wires = self.right_wires
+		out_wires = self.out_wires
+		decodes = self.decodes
+		offsets = self.offsets
+		cts = self.cts
+		encrypt = self.H.cipher.encrypt if self.H is not None else None
+		from_bytes = int.from_bytes
+		# Keys of the output wires, or plain outputs of tables on output wires.
+		outputs = {}
+
+		for (batched, others) in self.schedule:
+			if batched:
+				# First pass: the AES inputs K of every batched gate, 2 blocks per half gate and 1 per table.
+				blocks = []
+				for gate_id in batched:
+					P_left = from_bytes(labels[left_wires[gate_id]], 'big')
+					P_right = from_bytes(labels[right_wires[gate_id]], 'big')
+					if kinds[gate_id] == GATE_HALF_GATE:
+						K = P_left << 1
+						if K >> 128:
+							K ^= 0x100000000000000000000000000000087
+						blocks.append(K ^ (2 * gate_id))
+						K = P_right << 1
+						if K >> 128:
+							K ^= 0x100000000000000000000000000000087
+						blocks.append(K ^ (2 * gate_id + 1))
+					else:
+						K = double_int(double_int(P_left) ^ double_int(double_int(P_right))) ^ gate_id
+						blocks.append(K)
+				hashed = encrypt(b''.join(K.to_bytes(16, 'big') for K in blocks))
+				# Second pass: H(K) = AES(K) XOR K and the output keys.
+				k = 0
+				for gate_id in batched:
+					P_left = labels[left_wires[gate_id]]
+					P_right = labels[right_wires[gate_id]]
+					ct = cts[offsets[gate_id]:offsets[gate_id + 1]]
+					if kinds[gate_id] == GATE_HALF_GATE:
+						W_G = from_bytes(hashed[16 * k:16 * k + 16], 'big') ^ blocks[k]
+						W_E = from_bytes(hashed[16 * k + 16:16 * k + 32], 'big') ^ blocks[k + 1]
+						k += 2
+						if P_left[-1] & 1:
+							W_G ^= from_bytes(ct[:16], 'big')
+						if P_right[-1] & 1:
+							W_E ^= from_bytes(ct[16:], 'big') ^ from_bytes(P_left, 'big')
+						P_out = (W_G ^ W_E).to_bytes(LABEL_SIZE, 'big')
+						decode = decodes[gate_id]
+						if decode != NO_DECODE:
+							outputs[out_wires[gate_id]] = decode_key(P_out, decode)
+							continue
+					else:
+						pad = (from_bytes(hashed[16 * k:16 * k + 16], 'big') ^ blocks[k]).to_bytes(16, 'big')
+						k += 1
+						row_len = len(ct) // 4
+						row = 2 * (P_left[-1] & 1) + (P_right[-1] & 1)
+						P_out = (from_bytes(ct[row * row_len:(row + 1) * row_len], 'big') ^ from_bytes(pad[:row_len], 'big')).to_bytes(row_len, 'big')
+						if row_len != LABEL_SIZE:
+							outputs[out_wires[gate_id]] = P_out
+							continue
+					labels[out_wires[gate_id]] = P_out
+
+			for gate_id in others:
+				P_left = labels[left_wires[gate_id]]
+				P_right = labels[right_wires[gate_id]]
+				kind = kinds[gate_id]
+				if kind == GATE_FREE_XOR:
+					P_out = (from_bytes(P_left, 'big') ^ from_bytes(P_right, 'big')).to_bytes(LABEL_SIZE, 'big')
+				elif kind == GATE_PP:
+					ct = cts[offsets[gate_id]:offsets[gate_id + 1]]
+					row_len = len(ct) // 4
+					row = 2 * (P_left[-1] & 1) + (P_right[-1] & 1)
+					P_out = decrypt_2_keys(P_left, P_right, ct[row * row_len:(row + 1) * row_len])
+					if len(P_out) != LABEL_SIZE:
+						outputs[out_wires[gate_id]] = P_out
+						continue
+				else:
+					P_out = self.evaluate_gate(gate_id, P_left, P_right)
+					if len(P_out) != LABEL_SIZE:
+						outputs[out_wires[gate_id]] = P_out
+						continue
+				decode = decodes[gate_id]
+				if decode != NO_DECODE:
+					outputs[out_wires[gate_id]] = decode_key(P_out, decode)
+					continue
+				labels[out_wires[gate_id]] = P_out
+
+		return [outputs[wire] if wire in outputs else labels[wire] for wire in self.output_wires]
+
+	# Evaluates a single gate that is neither free nor batched, from its input keys P_left and P_right.
+	# The SHA256 hashes of classic tables and half gates without a fixed_key_hash use hashlib, which computes the same
+	# digests as hash_2_vals and hash_tweak with less overhead per call.
+	def evaluate_gate(self, gate_id: int, P_left: bytes, P_right: bytes) -> bytes:
+		kind = self.kinds[gate_id]
+		ct = self.cts[self.offsets[gate_id]:self.offsets[gate_id + 1]]
+		if kind == GATE_HALF_GATE:
+			if self.H is not None:
+				return evaluate_half_gate(self.H, gate_id, ct[:16], ct[16:], P_left, P_right)
+			if metrics.enabled:
+				metrics.count("crypto_ops_total", 2, op="sha256")
+			W_G = int.from_bytes(sha256(P_left + (2 * gate_id).to_bytes(8, 'big')).digest()[:16], 'big')
+			if P_left[-1] & 1:
+				W_G ^= int.from_bytes(ct[:16], 'big')
+			W_E = int.from_bytes(sha256(P_right + (2 * gate_id + 1).to_bytes(8, 'big')).digest()[:16], 'big')
+			if P_right[-1] & 1:
+				W_E ^= int.from_bytes(ct[16:], 'big') ^ int.from_bytes(P_left, 'big')
+			return (W_G ^ W_E).to_bytes(LABEL_SIZE, 'big')
+		row_len = len(ct) // 4
+		if kind == GATE_PP_FIXED_KEY:
+			row = 2 * (P_left[-1] & 1) + (P_right[-1] & 1)
+			pad = self.H.hash_pair(P_left, P_right, gate_id)[:row_len]
+			return (int.from_bytes(ct[row * row_len:(row + 1) * row_len], 'big') ^ int.from_bytes(pad, 'big')).to_bytes(row_len, 'big')
+		if kind == GATE_PP:
+			row = 2 * (P_left[-1] & 1) + (P_right[-1] & 1)
+			return decrypt_2_keys(P_left, P_right, ct[row * row_len:(row + 1) * row_len])
+		if kind == GATE_CLASSIC:
+			if metrics.enabled:
+				metrics.count("crypto_ops_total", op="sha256")
+			hash_val = sha256(P_left + P_right).digest()
+			for row in range(4):
+				if ct[row * row_len:row * row_len + 32] == hash_val:
+					return decrypt_2_keys(P_left, P_right, ct[row * row_len + 32:(row + 1) * row_len])
+			raise ValueError('compiled_circuit: no row of gate {} matches the input keys'.format(gate_id))
+		raise ValueError('compiled_circuit: unknown gate kind {}'.format(kind))
+
+# gf_double on ints, see garbled_gate.py.
+def double_int(x: int) -> int:
+	x <<= 1
+	if x >> 128:
+		x ^= 0x100000000000000000000000000000087
+	return x
+
+def test_engine():
+	from alice_and_bob import garble_circuit, evaluate_circuit, get_alice_keys, bit_decomposition
+	from circuit import comparator_circuit
+	import random
+
+	num_bits = 16
+	circ = comparator_circuit(num_bits)
+	all_options = ({}, {"free_xor": True}, {"free_xor": True, "point_and_permute": True}, {"fixed_key": True},
+		{"half_gates": True}, {"half_gates": True, "fixed_key": True})
+	for options in all_options:
+		(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+		compiled = compiled_circuit.from_garbled_circuit(circ, garbled_circuit)
+		passed = True
+		for _ in range(10):
+			alice_input = random.getrandbits(num_bits)
+			bob_input = random.getrandbits(num_bits)
+			alice_keys = get_alice_keys(x_keys, *bit_decomposition(alice_input, num_bits))
+			bob_keys = get_alice_keys(y_keys, *bit_decomposition(bob_input, num_bits))
+			(val_out,) = compiled.evaluate(alice_keys, bob_keys)
+			if (int.from_bytes(val_out, byteorder='big') != 0) != (alice_input >= bob_input):
+				passed = False
+			if [val_out] != evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys):
+				passed = False
+		if passed:
+			print("Engine: Correctness for options = {}: PASSED".format(options))
+		else:
+			print("Engine: Correctness for options = {}: FAILED".format(options))
+
+# Compares the gates per second of compiled_circuit.evaluate with evaluate_circuit on circuits of about 100k gates:
+# the ripple comparator of num_bits bits, which has one gate per crypto depth, and two wide circuits where the hashes
+# of a depth can be batched: the tree comparator of num_bits bits, and num_pairs comparisons of 32 bits.
+def benchmark_engine(num_bits=25001, num_pairs=800):
+	from alice_and_bob import garble_circuit, evaluate_circuit, get_alice_keys
+	from circuit import comparator_circuit, tree_comparator_circuit, batch_comparator_circuit
+	import random
+	import time
+
+	circuits = (("ripple", comparator_circuit(num_bits)), ("tree", tree_comparator_circuit(num_bits)),
+		("batch of {}".format(num_pairs), batch_comparator_circuit(32, num_pairs)))
+	for (name, circ) in circuits:
+		num_gates = len(circ.gates)
+		alice_bits = [random.getrandbits(1) for _ in circ.x_wires]
+		bob_bits = [random.getrandbits(1) for _ in circ.y_wires]
+		for options in ({}, {"free_xor": True, "point_and_permute": True}, {"half_gates": True}, {"half_gates": True, "fixed_key": True}):
+			(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+			alice_keys = get_alice_keys(x_keys, *alice_bits)
+			bob_keys = get_alice_keys(y_keys, *bob_bits)
+			objects_st = time.perf_counter()
+			evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys)
+			objects_et = time.perf_counter()
+			compiled = compiled_circuit.from_garbled_circuit(circ, garbled_circuit)
+			engine_st = time.perf_counter()
+			compiled.evaluate(alice_keys, bob_keys)
+			engine_et = time.perf_counter()
+			print("{}, {} gates, options = {}: objects: {:.0f} gates/s, engine: {:.0f} gates/s".format(
+				name, num_gates, options, num_gates / (objects_et - objects_st), num_gates / (engine_et - engine_st)))
+
+if __name__ == '__main__':
+	test_engine()
+	# benchmark_engine()
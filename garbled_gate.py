@@ -6,17 +6,48 @@
 # Author: Nikhil Vanjani
 ############################################################
 
-from Crypto.Cipher import Salsa20
+from Crypto.Cipher import AES, Salsa20
 from Crypto.Hash import SHA256
+import metrics
 import os
+import time
 
 # Computes SHA256(P_left || P_right)
 def hash_2_vals(P_left, P_right):
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="sha256")
 	P_concatenated = P_left + P_right
 	h = SHA256.new(P_concatenated)
 	hash_val = h.digest()
 	return hash_val
 
+# Computes Enc(P_right, Enc(P_left, value)) with Salsa20. The two 8 byte nonces are prepended to the ciphertext.
+# ASSUMPTION: value is a bytes object
+def encrypt_2_keys(P_left: bytes, P_right: bytes, value: bytes) -> bytes:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", 2, op="salsa20")
+	cipher_left = Salsa20.new(P_left)
+	nonce_left = cipher_left.nonce
+	cipher_right = Salsa20.new(P_right)
+	nonce_right = cipher_right.nonce
+	ct_left = cipher_left.encrypt(value)
+	ct_right = cipher_right.encrypt(ct_left)
+	return nonce_left + nonce_right + ct_right
+
+# Decrypts a ciphertext computed by encrypt_2_keys using keys P_left and P_right.
+# Returns a bytes object
+def decrypt_2_keys(P_left: bytes, P_right: bytes, ct: bytes) -> bytes:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", 2, op="salsa20")
+	nonce_left = ct[:8]
+	nonce_right = ct[8:16]
+	ct_right = ct[16:]
+	cipher_right = Salsa20.new(P_right, nonce_right)
+	ct_left = cipher_right.decrypt(ct_right)
+	cipher_left = Salsa20.new(P_left, nonce_left)
+	value = cipher_left.decrypt(ct_left)
+	return value
+
 class garbled_gate:
 	# Garbled table is stored as a dict
 	def __init__(self):
@@ -26,38 +57,181 @@ class garbled_gate:
 	# ASSUMPTION: value is a bytes object
 	def insert(self, P_left: bytes, P_right: bytes, value: bytes):
 		hash_val = hash_2_vals(P_left, P_right)
-
-		cipher_left = Salsa20.new(P_left)
-		nonce_left = cipher_left.nonce
-		cipher_right = Salsa20.new(P_right)
-		nonce_right = cipher_right.nonce
-		ct_left = cipher_left.encrypt(value)
-		ct_right = cipher_right.encrypt(ct_left)
-		ct = nonce_left + nonce_right + ct_right
-
-		self.table[hash_val] = ct
+		self.table[hash_val] = encrypt_2_keys(P_left, P_right, value)
 
 	# Looks up the value at key = SHA256(P_left || P_right) and decrypts it using keys P_left and P_right.
 	# Returns a bytes object
 	def lookup(self, P_left: bytes, P_right: bytes) -> bytes:
 		hash_val = hash_2_vals(P_left, P_right)
-
 		ct = self.table[hash_val]
-		nonce_left = ct[:8]
-		nonce_right = ct[8:16]
-		ct_right = ct[16:]
-		cipher_right = Salsa20.new(P_right, nonce_right)
-		ct_left = cipher_right.decrypt(ct_right)
-		cipher_left = Salsa20.new(P_left, nonce_left)
-		value = cipher_left.decrypt(ct_left)
-		return value
+		return decrypt_2_keys(P_left, P_right, ct)
+
+# Returns the select bit of a key, which is the least significant bit of its last byte.
+def select_bit(P: bytes) -> int:
+	return P[-1] & 1
+
+# Multiplies x by 2 in GF(2^128) with the reduction polynomial x^128 + x^7 + x^2 + x + 1.
+def gf_double(x: int) -> int:
+	x <<= 1
+	if x >> 128:
+		x ^= (1 << 128) | 0x87
+	return x
+
+# Tweakable hash from a fixed-key block cipher, as used by JustGarble and half-gates
+# (Bellare et al., "Efficient Garbling from a Fixed-Key Blockcipher").
+# H(P, tweak) = AES_k(K) XOR K, where K = 2P XOR tweak.
+# The AES key k is public. It is scheduled once when the object is created, so hashing needs no cipher construction
+# and no nonces. Pickling the object only stores k.
+class fixed_key_hash:
+	def __init__(self, key: bytes = None):
+		if key is None:
+			key = os.urandom(16)
+		self.key = key
+		self.cipher = AES.new(key, AES.MODE_ECB)
+
+	def __reduce__(self):
+		return (fixed_key_hash, (self.key,))
+
+	# Computes H(P, tweak).
+	def __call__(self, P: bytes, tweak: int) -> bytes:
+		if metrics.enabled:
+			metrics.count("crypto_ops_total", op="aes")
+		K = gf_double(int.from_bytes(P, byteorder='big')) ^ tweak
+		ct = self.cipher.encrypt(K.to_bytes(length=16, byteorder='big'))
+		return (int.from_bytes(ct, byteorder='big') ^ K).to_bytes(length=16, byteorder='big')
+
+	# Computes H(2 * P_left XOR 4 * P_right, tweak), the hash of a pair of keys used for garbled table rows.
+	def hash_pair(self, P_left: bytes, P_right: bytes, tweak: int) -> bytes:
+		if metrics.enabled:
+			metrics.count("crypto_ops_total", op="aes")
+		K = gf_double(gf_double(int.from_bytes(P_left, byteorder='big')) ^ gf_double(gf_double(int.from_bytes(P_right, byteorder='big'))))
+		K ^= tweak
+		ct = self.cipher.encrypt(K.to_bytes(length=16, byteorder='big'))
+		return (int.from_bytes(ct, byteorder='big') ^ K).to_bytes(length=16, byteorder='big')
+
+	# Computes H(Ps[k], tweaks[k]) for every k, with one AES-ECB call for the whole batch.
+	def hash_batch(self, Ps: list, tweaks: list) -> list:
+		return self.hash_blocks(b''.join((gf_double(int.from_bytes(P, byteorder='big')) ^ tweak).to_bytes(length=16, byteorder='big')
+			for (P, tweak) in zip(Ps, tweaks)))
+
+	# Computes hash_pair(P_lefts[k], P_rights[k], tweaks[k]) for every k, with one AES-ECB call for the whole batch.
+	def hash_pair_batch(self, P_lefts: list, P_rights: list, tweaks: list) -> list:
+		return self.hash_blocks(b''.join((gf_double(gf_double(int.from_bytes(P_left, byteorder='big')) ^ gf_double(gf_double(int.from_bytes(P_right, byteorder='big')))) ^ tweak).to_bytes(length=16, byteorder='big')
+			for (P_left, P_right, tweak) in zip(P_lefts, P_rights, tweaks)))
+
+	# Returns the list of AES_k(K) XOR K for the concatenated 16 byte blocks K of blocks.
+	# The blocks are encrypted with one AES-ECB call and XORed with K as one big int, so the cost of a batch
+	# outside of the C code is a few operations per block.
+	def hash_blocks(self, blocks: bytes) -> list:
+		if not blocks:
+			return []
+		if metrics.enabled:
+			metrics.count("crypto_ops_total", len(blocks) // 16, op="aes")
+		ct = self.cipher.encrypt(blocks)
+		hashes = (int.from_bytes(ct, byteorder='big') ^ int.from_bytes(blocks, byteorder='big')).to_bytes(length=len(blocks), byteorder='big')
+		return [hashes[k:k + 16] for k in range(0, len(hashes), 16)]
+
+# Garbled gate with point-and-permute (Beaver, Micali and Rogaway, "The Round Complexity of Secure Protocols").
+# The two keys of every wire have different select bits, so the pair of select bits of the input keys
+# indexes the row of the table to decrypt. The evaluator decrypts exactly one row, without hashing and without a dict lookup.
+# The select bits are independent of the bits the keys correspond to, so the row index reveals nothing about them.
+# If H is a fixed_key_hash, each row is value XOR H.hash_pair(P_left, P_right, gate_id) instead of a double Salsa20 encryption,
+# so rows carry no nonces.
+class garbled_gate_pp:
+	# Garbled table is stored as a list of 4 rows
+	def __init__(self, H: fixed_key_hash = None, gate_id: int = 0):
+		self.table = [None] * 4
+		self.H = H
+		self.gate_id = gate_id
+
+	# Inserts Enc(P_right, Enc(P_left, value)) at row 2 * select_bit(P_left) + select_bit(P_right).
+	# ASSUMPTION: value is a bytes object of at most 16 bytes if H is set.
+	def insert(self, P_left: bytes, P_right: bytes, value: bytes):
+		row = 2 * select_bit(P_left) + select_bit(P_right)
+		if self.H is None:
+			self.table[row] = encrypt_2_keys(P_left, P_right, value)
+		else:
+			self.table[row] = xor_bytes(value, self.H.hash_pair(P_left, P_right, self.gate_id)[:len(value)])
+
+	# Decrypts the row at 2 * select_bit(P_left) + select_bit(P_right) using keys P_left and P_right.
+	# Returns a bytes object
+	def lookup(self, P_left: bytes, P_right: bytes) -> bytes:
+		row = 2 * select_bit(P_left) + select_bit(P_right)
+		ct = self.table[row]
+		if self.H is None:
+			return decrypt_2_keys(P_left, P_right, ct)
+		return xor_bytes(ct, self.H.hash_pair(P_left, P_right, self.gate_id)[:len(ct)])
+
+# Returns the plain output bytes for a key on an output wire, given the select bit decode of the key for bit 0.
+def decode_key(P: bytes, decode: int) -> bytes:
+	if select_bit(P) ^ decode:
+		return one_bytes
+	return zero_bytes
+
+# Free-XOR gate (Kolesnikov and Schneider, "Improved Garbled Circuit: Free XOR Gates and Applications").
+# In Free-XOR mode all wire keys share a global offset R, i.e. P_1 = P_0 XOR R on every wire.
+# The output keys of an XOR gate are then P_left XOR P_right, so the gate has no table and evaluating it needs no cipher calls.
+# If the gate is on an output wire, decode is the select bit of the output key for bit 0, which is enough to
+# recover the plain output since the select bit of R is 1.
+class free_xor_gate:
+	def __init__(self, decode: int = None):
+		self.decode = decode
+
+	# Returns P_left XOR P_right, or the plain output if the gate is on an output wire.
+	def lookup(self, P_left: bytes, P_right: bytes) -> bytes:
+		P_out = xor_bytes(P_left, P_right)
+		if self.decode is not None:
+			return decode_key(P_out, self.decode)
+		return P_out
+
+# Computes H(P, tweak) = SHA256(P || tweak) truncated to 16 bytes, the hash used by half_gate.
+def hash_tweak(P: bytes, tweak: int) -> bytes:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="sha256")
+	h = SHA256.new(P + tweak.to_bytes(length=8, byteorder='big'))
+	return h.digest()[:16]
+
+# Half-gates garbling of an AND gate (Zahur, Rosulek and Evans, "Two Halves Make a Whole").
+# Requires Free-XOR keys with point-and-permute select bits. The table consists of only two ciphertexts:
+# T_G for the garbler half gate and T_E for the evaluator half gate.
+# gate_id is a per-circuit unique index used to tweak the hash H, which is hash_tweak or a fixed_key_hash.
+# If the gate is on an output wire, decode is the select bit of the output key for bit 0.
+class half_gate:
+	def __init__(self, gate_id: int, T_G: bytes, T_E: bytes, decode: int = None, H = hash_tweak):
+		self.gate_id = gate_id
+		self.T_G = T_G
+		self.T_E = T_E
+		self.decode = decode
+		self.H = H
+
+	# Computes the output key from the input keys, or the plain output if the gate is on an output wire.
+	def lookup(self, P_left: bytes, P_right: bytes) -> bytes:
+		P_out = evaluate_half_gate(self.H, self.gate_id, self.T_G, self.T_E, P_left, P_right)
+		if self.decode is not None:
+			return decode_key(P_out, self.decode)
+		return P_out
+
+# Computes the output key of a half gate with ciphertexts T_G and T_E from the input keys P_left and P_right.
+def evaluate_half_gate(H, gate_id: int, T_G: bytes, T_E: bytes, P_left: bytes, P_right: bytes) -> bytes:
+	W_G = H(P_left, 2 * gate_id)
+	if select_bit(P_left):
+		W_G = xor_bytes(W_G, T_G)
+	W_E = H(P_right, 2 * gate_id + 1)
+	if select_bit(P_right):
+		W_E = xor_bytes(W_E, xor_bytes(T_E, P_left))
+	return xor_bytes(W_G, W_E)
 
 # Computes the garbled gate corresponding to the gate_truth_table. 
 # Assumes the gate has 'left' and 'right' input wires and an 'out' output wire.
 # For each of the three wires, it takes two keys as input, one each corresponding to bits 0 and 1 on that wire.
+# If point_and_permute = True, the input keys of each wire must have different select bits (see sample_wire_keys).
+# H and gate_id are only used with point_and_permute = True, see garbled_gate_pp.
 # ASSUMPTION: The values in the dict gate_truth_table are bytes object.
-def garble(P_left_0, P_left_1, P_right_0, P_right_1, P_out_0, P_out_1, gate_truth_table: dict) -> garbled_gate:
-	garbling = garbled_gate()
+def garble(P_left_0, P_left_1, P_right_0, P_right_1, P_out_0, P_out_1, gate_truth_table: dict, point_and_permute=False, H=None, gate_id=0) -> garbled_gate:
+	if point_and_permute:
+		garbling = garbled_gate_pp(H, gate_id)
+	else:
+		garbling = garbled_gate()
 	garbling.insert(P_left_0, P_right_0, gate_truth_table[0][0])
 	garbling.insert(P_left_0, P_right_1, gate_truth_table[0][1])
 	garbling.insert(P_left_1, P_right_0, gate_truth_table[1][0])
@@ -68,6 +242,260 @@ def garble(P_left_0, P_left_1, P_right_0, P_right_1, P_out_0, P_out_1, gate_trut
 def evaluate(garbling: garbled_gate, P_left, P_right) -> bytes:
 	return garbling.lookup(P_left, P_right)
 
+# Computes the bytewise XOR of two bytes objects of equal length.
+def xor_bytes(a: bytes, b: bytes) -> bytes:
+	return (int.from_bytes(a, byteorder='big') ^ int.from_bytes(b, byteorder='big')).to_bytes(len(a), byteorder='big')
+
+# Samples the global offset R used by all wires in Free-XOR mode.
+# The select bit of R is 1, so that P_0 and P_0 XOR R have different select bits as needed for point-and-permute.
+def generate_free_xor_offset() -> bytes:
+	R = bytearray(os.urandom(16))
+	R[-1] |= 1
+	return bytes(R)
+
+# Samples a pair of keys for a wire, one each corresponding to bits 0 and 1 on that wire.
+# In Free-XOR mode, R is the global offset and the key for bit 1 is P_0 XOR R.
+# If point_and_permute = True, the two keys have different select bits.
+def sample_wire_keys(R: bytes = None, point_and_permute=False) -> dict:
+	P = {}
+	P[0] = os.urandom(16)
+	if R is not None:
+		P[1] = xor_bytes(P[0], R)
+	elif point_and_permute:
+		P_1 = bytearray(os.urandom(16))
+		P_1[-1] = (P_1[-1] & 0xfe) | (1 - select_bit(P[0]))
+		P[1] = bytes(P_1)
+	else:
+		P[1] = os.urandom(16)
+	return P
+
+# PRF for seed-derived wire keys: every key of a circuit is computed from one master seed and the id of its wire,
+# so the garbler only needs to store the seed and can recompute any key on demand.
+# F(seed, wire, domain) = AES_seed(wire || domain), with the domains below. Pickling the object only stores the seed.
+class wire_key_prf:
+	# domain of the key for bit 0 and bit 1 of a wire, of the Free-XOR offset and of the fixed-key AES key
+	KEY_0 = 0
+	KEY_1 = 1
+	FREE_XOR_OFFSET = 2
+	FIXED_KEY = 3
+
+	def __init__(self, seed: bytes = None):
+		if seed is None:
+			seed = os.urandom(16)
+		self.seed = seed
+		self.cipher = AES.new(seed, AES.MODE_ECB)
+
+	def __reduce__(self):
+		return (wire_key_prf, (self.seed,))
+
+	def __call__(self, wire: int, domain: int) -> bytes:
+		return self.cipher.encrypt(wire.to_bytes(length=8, byteorder='big') + domain.to_bytes(length=8, byteorder='big'))
+
+	# Same as generate_free_xor_offset, derived from the seed.
+	def free_xor_offset(self) -> bytes:
+		R = bytearray(self(0, wire_key_prf.FREE_XOR_OFFSET))
+		R[-1] |= 1
+		return bytes(R)
+
+	# Returns the fixed_key_hash whose AES key is derived from the seed.
+	def fixed_key_hash(self) -> fixed_key_hash:
+		return fixed_key_hash(self(0, wire_key_prf.FIXED_KEY))
+
+	# Same as sample_wire_keys, for the wire with id wire.
+	def wire_keys(self, wire: int, R: bytes = None, point_and_permute=False) -> dict:
+		P = {}
+		P[0] = self(wire, wire_key_prf.KEY_0)
+		if R is not None:
+			P[1] = xor_bytes(P[0], R)
+		elif point_and_permute:
+			P_1 = bytearray(self(wire, wire_key_prf.KEY_1))
+			P_1[-1] = (P_1[-1] & 0xfe) | (1 - select_bit(P[0]))
+			P[1] = bytes(P_1)
+		else:
+			P[1] = self(wire, wire_key_prf.KEY_1)
+		return P
+
+# Computes the free gate for XOR (negate = False) or XNOR (negate = True) in Free-XOR mode.
+# The keys of the output wire are determined by the keys for bit 0 on the input wires and the global offset R.
+# If plain = True, the gate is on an output wire and the garbling outputs the plain output bytes.
+# Returns (garbling, P_out), where P_out[b] is the key for bit b on the output wire.
+def garble_free_xor(P_left_0, P_right_0, R, negate=False, plain=False) -> (free_xor_gate, dict):
+	P_out = {}
+	P_xor_0 = xor_bytes(P_left_0, P_right_0)
+	P_xor_1 = xor_bytes(P_xor_0, R)
+	if negate:
+		P_out[0] = P_xor_1
+		P_out[1] = P_xor_0
+	else:
+		P_out[0] = P_xor_0
+		P_out[1] = P_xor_1
+	decode = select_bit(P_out[0]) if plain else None
+	return (free_xor_gate(decode), P_out)
+
+# Returns (alpha_left, alpha_right, alpha_out) such that the gate computes ((a XOR alpha_left) AND (b XOR alpha_right)) XOR alpha_out.
+# Such a gate is called AND-type: exactly one row of its truth table differs from the other three.
+# ASSUMPTION: gate_truth_table is a plain truth table.
+def get_and_type_masks(gate_truth_table: dict) -> (int, int, int):
+	ones = [(i, j) for i in range(2) for j in range(2) if gate_truth_table[i][j] == one_bytes]
+	if len(ones) == 1:
+		(i, j) = ones[0]
+		return (1 - i, 1 - j, 0)
+	zeros = [(i, j) for i in range(2) for j in range(2) if gate_truth_table[i][j] == zero_bytes]
+	if len(zeros) == 1:
+		(i, j) = zeros[0]
+		return (1 - i, 1 - j, 1)
+	raise ValueError('get_and_type_masks: gate is not an AND-type gate')
+
+# Computes the half-gates garbling of an AND-type gate in Free-XOR mode with point-and-permute.
+# P_left_0 and P_right_0 are the keys for bit 0 on the input wires, R is the global offset,
+# gate_truth_table is the plain truth table of the gate and gate_id is a per-circuit unique index of the gate.
+# H is the tweakable hash, hash_tweak or a fixed_key_hash.
+# If plain = True, the gate is on an output wire and the garbling outputs the plain output bytes.
+# Returns (garbling, P_out), where P_out[b] is the key for bit b on the output wire.
+def garble_half_gate(P_left_0, P_right_0, R, gate_truth_table: dict, gate_id: int, plain=False, H=hash_tweak) -> (half_gate, dict):
+	(alpha_left, alpha_right, alpha_out) = get_and_type_masks(gate_truth_table)
+	# Relabel the input keys so that the gate is an AND gate on (a XOR alpha_left) and (b XOR alpha_right).
+	A_0 = xor_bytes(P_left_0, R) if alpha_left else P_left_0
+	A_1 = xor_bytes(A_0, R)
+	B_0 = xor_bytes(P_right_0, R) if alpha_right else P_right_0
+	B_1 = xor_bytes(B_0, R)
+	p_a = select_bit(A_0)
+	p_b = select_bit(B_0)
+
+	# Garbler half gate
+	H_A_0 = H(A_0, 2 * gate_id)
+	H_A_1 = H(A_1, 2 * gate_id)
+	T_G = xor_bytes(H_A_0, H_A_1)
+	if p_b:
+		T_G = xor_bytes(T_G, R)
+	W_G_0 = xor_bytes(H_A_0, T_G) if p_a else H_A_0
+
+	# Evaluator half gate
+	H_B_0 = H(B_0, 2 * gate_id + 1)
+	H_B_1 = H(B_1, 2 * gate_id + 1)
+	T_E = xor_bytes(xor_bytes(H_B_0, H_B_1), A_0)
+	W_E_0 = xor_bytes(H_B_0, xor_bytes(T_E, A_0)) if p_b else H_B_0
+
+	W_0 = xor_bytes(W_G_0, W_E_0)
+	P_out = {}
+	P_out[alpha_out] = W_0
+	P_out[1 - alpha_out] = xor_bytes(W_0, R)
+
+	decode = select_bit(P_out[0]) if plain else None
+	return (half_gate(gate_id, T_G, T_E, decode, H), P_out)
+
+############################################################
+# Batch API: garbles or evaluates K independent gates, e.g. the gates of one layer of a circuit, at once.
+# With a fixed_key_hash, all the hashes of the batch are computed with one AES-ECB call over a contiguous buffer of
+# blocks, see fixed_key_hash.hash_blocks, and keys are XORed as ints. Other hashes fall back to one call per hash.
+############################################################
+
+# Computes H(Ps[k], tweaks[k]) for every k, in one batch if H is a fixed_key_hash.
+def hash_batch(H, Ps: list, tweaks: list) -> list:
+	if isinstance(H, fixed_key_hash):
+		return H.hash_batch(Ps, tweaks)
+	return [H(P, tweak) for (P, tweak) in zip(Ps, tweaks)]
+
+# Batch version of garble_half_gate: garbles gate k with the keys P_left_0s[k] and P_right_0s[k] for bit 0 on its input
+# wires, the plain truth table truth_tables[k], the index gate_ids[k] and plains[k].
+# Returns (garblings, P_outs), the lists of the results of garble_half_gate for each gate.
+def garble_half_gate_batch(P_left_0s: list, P_right_0s: list, R: bytes, truth_tables: list, gate_ids: list, plains: list, H=hash_tweak) -> (list, list):
+	R_int = int.from_bytes(R, byteorder='big')
+	all_masks = [get_and_type_masks(truth_table) for truth_table in truth_tables]
+	A_0s = []
+	B_0s = []
+	Ps = []
+	tweaks = []
+	for (P_left_0, P_right_0, (alpha_left, alpha_right, _), gate_id) in zip(P_left_0s, P_right_0s, all_masks, gate_ids):
+		A_0 = int.from_bytes(P_left_0, byteorder='big') ^ (R_int if alpha_left else 0)
+		B_0 = int.from_bytes(P_right_0, byteorder='big') ^ (R_int if alpha_right else 0)
+		A_0s.append(A_0)
+		B_0s.append(B_0)
+		Ps += [A_0.to_bytes(length=16, byteorder='big'), (A_0 ^ R_int).to_bytes(length=16, byteorder='big'),
+			B_0.to_bytes(length=16, byteorder='big'), (B_0 ^ R_int).to_bytes(length=16, byteorder='big')]
+		tweaks += [2 * gate_id, 2 * gate_id, 2 * gate_id + 1, 2 * gate_id + 1]
+	hashes = [int.from_bytes(h, byteorder='big') for h in hash_batch(H, Ps, tweaks)]
+
+	garblings = []
+	P_outs = []
+	for (k, (A_0, B_0, (_, _, alpha_out), gate_id, plain)) in enumerate(zip(A_0s, B_0s, all_masks, gate_ids, plains)):
+		(H_A_0, H_A_1, H_B_0, H_B_1) = hashes[4 * k:4 * k + 4]
+		# See garble_half_gate, with p_a = A_0 & 1 and p_b = B_0 & 1.
+		T_G = H_A_0 ^ H_A_1 ^ (R_int if B_0 & 1 else 0)
+		W_G_0 = H_A_0 ^ T_G if A_0 & 1 else H_A_0
+		T_E = H_B_0 ^ H_B_1 ^ A_0
+		W_E_0 = H_B_0 ^ T_E ^ A_0 if B_0 & 1 else H_B_0
+		W_0 = W_G_0 ^ W_E_0
+		P_out = {}
+		P_out[alpha_out] = W_0.to_bytes(length=16, byteorder='big')
+		P_out[1 - alpha_out] = (W_0 ^ R_int).to_bytes(length=16, byteorder='big')
+		decode = select_bit(P_out[0]) if plain else None
+		garblings.append(half_gate(gate_id, T_G.to_bytes(length=16, byteorder='big'), T_E.to_bytes(length=16, byteorder='big'), decode, H))
+		P_outs.append(P_out)
+	return (garblings, P_outs)
+
+# Batch version of garble: garbles gate k with the pairs of keys P_lefts[k] and P_rights[k] of its input wires
+# and truth_tables[k]. With point_and_permute = True and a fixed_key_hash H, the 4 rows of all the gates are hashed
+# in one batch, and gate_ids[k] is the index of gate k. Returns the list of garbled gates.
+def garble_batch(P_lefts: list, P_rights: list, truth_tables: list, point_and_permute=False, H=None, gate_ids=None) -> list:
+	if gate_ids is None:
+		gate_ids = [0] * len(truth_tables)
+	if not point_and_permute or H is None:
+		return [garble(P_left[0], P_left[1], P_right[0], P_right[1], None, None, truth_table, point_and_permute, H, gate_id)
+			for (P_left, P_right, truth_table, gate_id) in zip(P_lefts, P_rights, truth_tables, gate_ids)]
+	rows = [(P_left[i], P_right[j], gate_id) for (P_left, P_right, gate_id) in zip(P_lefts, P_rights, gate_ids) for i in range(2) for j in range(2)]
+	hashes = H.hash_pair_batch(*zip(*rows)) if rows else []
+	garblings = []
+	for (k, (truth_table, gate_id)) in enumerate(zip(truth_tables, gate_ids)):
+		garbling = garbled_gate_pp(H, gate_id)
+		for i in range(2):
+			for j in range(2):
+				(P_left, P_right, _) = rows[4 * k + 2 * i + j]
+				value = truth_table[i][j]
+				garbling.table[2 * select_bit(P_left) + select_bit(P_right)] = xor_bytes(value, hashes[4 * k + 2 * i + j][:len(value)])
+		garblings.append(garbling)
+	return garblings
+
+# Batch version of evaluate: evaluates garblings[k] on the keys P_lefts[k] and P_rights[k].
+# The hashes of the half gates and point-and-permute tables with a fixed_key_hash are computed in one batch per hash,
+# and the other gates are evaluated one at a time. Returns the list of outputs.
+def evaluate_batch(garblings: list, P_lefts: list, P_rights: list) -> list:
+	outputs = [None] * len(garblings)
+	# Per fixed_key_hash, the indices of the gates and the inputs and tweaks of their hashes.
+	half_gates = {}
+	pp_gates = {}
+	for (k, (garbling, P_left, P_right)) in enumerate(zip(garblings, P_lefts, P_rights)):
+		if isinstance(garbling, half_gate) and isinstance(garbling.H, fixed_key_hash):
+			(H, indices, Ps, tweaks) = half_gates.setdefault(id(garbling.H), (garbling.H, [], [], []))
+			indices.append(k)
+			Ps += [P_left, P_right]
+			tweaks += [2 * garbling.gate_id, 2 * garbling.gate_id + 1]
+		elif isinstance(garbling, garbled_gate_pp) and garbling.H is not None:
+			(H, indices, rows) = pp_gates.setdefault(id(garbling.H), (garbling.H, [], []))
+			indices.append(k)
+			rows.append((P_left, P_right, garbling.gate_id))
+		else:
+			outputs[k] = garbling.lookup(P_left, P_right)
+
+	for (H, indices, Ps, tweaks) in half_gates.values():
+		hashes = H.hash_batch(Ps, tweaks)
+		for (n, k) in enumerate(indices):
+			garbling = garblings[k]
+			(P_left, P_right) = (P_lefts[k], P_rights[k])
+			W = int.from_bytes(hashes[2 * n], byteorder='big') ^ int.from_bytes(hashes[2 * n + 1], byteorder='big')
+			if select_bit(P_left):
+				W ^= int.from_bytes(garbling.T_G, byteorder='big')
+			if select_bit(P_right):
+				W ^= int.from_bytes(garbling.T_E, byteorder='big') ^ int.from_bytes(P_left, byteorder='big')
+			P_out = W.to_bytes(length=16, byteorder='big')
+			outputs[k] = decode_key(P_out, garbling.decode) if garbling.decode is not None else P_out
+	for (H, indices, rows) in pp_gates.values():
+		hashes = H.hash_pair_batch(*zip(*rows))
+		for (n, k) in enumerate(indices):
+			ct = garblings[k].table[2 * select_bit(P_lefts[k]) + select_bit(P_rights[k])]
+			outputs[k] = xor_bytes(ct, hashes[n][:len(ct)])
+	return outputs
+
 val0 = 0
 val1 = 1
 zero_bytes = val0.to_bytes(length=2, byteorder='big')
@@ -162,32 +590,216 @@ def get_truth_table_eq(plain: bool, P_0 = None, P_1 = None):
 		truth_table[1][1] = P_1
 	return truth_table
 
-def test_garbled_gate():
-	P_left = {}
-	P_left[0] = os.urandom(16)
-	P_left[1] = os.urandom(16)
-	P_right = {}
-	P_right[0] = os.urandom(16)
-	P_right[1] = os.urandom(16)
-	P_out = {}
-	P_out[0] = os.urandom(16)
-	P_out[1] = os.urandom(16)
+# Truth table for XOR gate.
+def get_truth_table_xor(plain: bool, P_0 = None, P_1 = None):
+	truth_table = {}
+	truth_table[0] = {}
+	truth_table[1] = {}
+	if plain:
+		truth_table[0][0] = zero_bytes
+		truth_table[0][1] = one_bytes
+		truth_table[1][0] = one_bytes
+		truth_table[1][1] = zero_bytes
+	else:
+		truth_table[0][0] = P_0
+		truth_table[0][1] = P_1
+		truth_table[1][0] = P_1
+		truth_table[1][1] = P_0
+	return truth_table
+
+# Maps the gate names used in circuit descriptions (see circuit.py) to their truth tables.
+GATE_TRUTH_TABLES = {
+	"AND": get_truth_table_and,
+	"OR": get_truth_table_or,
+	"GEQ": get_truth_table_geq,
+	"GT": get_truth_table_gt,
+	"EQ": get_truth_table_eq,
+	"XOR": get_truth_table_xor,
+}
+
+# Gates that are free in Free-XOR mode, mapped to whether their output is negated.
+# EQ is XNOR.
+FREE_XOR_GATES = {
+	"XOR": False,
+	"EQ": True,
+}
+
+def test_garbled_gate(point_and_permute=False, H=None):
+	P_left = sample_wire_keys(point_and_permute=point_and_permute)
+	P_right = sample_wire_keys(point_and_permute=point_and_permute)
+	P_out = sample_wire_keys(point_and_permute=point_and_permute)
 
 	truth_table_and = get_truth_table_and(True)
 	truth_table_or = get_truth_table_or(True)
 	truth_table_geq = get_truth_table_geq(True)
 	truth_table_gt = get_truth_table_gt(True)
 	truth_table_eq = get_truth_table_eq(True)
-	truth_tables = (truth_table_and, truth_table_or, truth_table_geq, truth_table_gt, truth_table_eq)
-	truth_tables_names = ("AND", "OR", "Greater Than Or Equal To", "Greater Than", "Equal")
+	truth_table_xor = get_truth_table_xor(True)
+	truth_tables = (truth_table_and, truth_table_or, truth_table_geq, truth_table_gt, truth_table_eq, truth_table_xor)
+	truth_tables_names = ("AND", "OR", "Greater Than Or Equal To", "Greater Than", "Equal", "XOR")
 	for truth_table, name in zip(truth_tables, truth_tables_names):
-		garbling = garble(P_left[0], P_left[1], P_right[0], P_right[1], P_out[0], P_out[1], truth_table)
+		garbling = garble(P_left[0], P_left[1], P_right[0], P_right[1], P_out[0], P_out[1], truth_table, point_and_permute, H, 3)
 		for i in range(2):
 			for j in range(2):
 				val = evaluate(garbling, P_left[i], P_right[j])
 				if val != truth_table[i][j]:
-					print("Garbled Gate: Correctness for gate = {}: FAILED".format(name))
-		print("Garbled Gate: Correctness for gate = {}: PASSED".format(name))
+					print("Garbled Gate: Correctness for gate = {}, point_and_permute = {}, fixed_key = {}: FAILED".format(name, point_and_permute, H is not None))
+		print("Garbled Gate: Correctness for gate = {}, point_and_permute = {}, fixed_key = {}: PASSED".format(name, point_and_permute, H is not None))
+
+def test_free_xor_gate():
+	R = generate_free_xor_offset()
+	P_left = sample_wire_keys(R)
+	P_right = sample_wire_keys(R)
+	for name, negate in FREE_XOR_GATES.items():
+		truth_table = GATE_TRUTH_TABLES[name](True)
+		(garbling, P_out) = garble_free_xor(P_left[0], P_right[0], R, negate)
+		passed = True
+		for i in range(2):
+			for j in range(2):
+				val = evaluate(garbling, P_left[i], P_right[j])
+				if val != P_out[int.from_bytes(truth_table[i][j], byteorder='big')]:
+					passed = False
+		if passed:
+			print("Free-XOR Gate: Correctness for gate = {}: PASSED".format(name))
+		else:
+			print("Free-XOR Gate: Correctness for gate = {}: FAILED".format(name))
+
+def test_half_gate(H=hash_tweak):
+	R = generate_free_xor_offset()
+	P_left = sample_wire_keys(R)
+	P_right = sample_wire_keys(R)
+	for name in ("AND", "OR", "GEQ", "GT"):
+		truth_table = GATE_TRUTH_TABLES[name](True)
+		for plain in (False, True):
+			(garbling, P_out) = garble_half_gate(P_left[0], P_right[0], R, truth_table, 7, plain, H)
+			passed = True
+			for i in range(2):
+				for j in range(2):
+					val = evaluate(garbling, P_left[i], P_right[j])
+					expected = truth_table[i][j]
+					if not plain:
+						expected = P_out[int.from_bytes(expected, byteorder='big')]
+					if val != expected:
+						passed = False
+			if passed:
+				print("Half Gate: Correctness for gate = {}, plain = {}, fixed_key = {}: PASSED".format(name, plain, H is not hash_tweak))
+			else:
+				print("Half Gate: Correctness for gate = {}, plain = {}, fixed_key = {}: FAILED".format(name, plain, H is not hash_tweak))
+
+def test_batch(num_gates=50):
+	R = generate_free_xor_offset()
+	H = fixed_key_hash()
+	names = ["AND", "OR", "GEQ", "GT"] * num_gates
+	P_lefts = [sample_wire_keys(R) for _ in names]
+	P_rights = [sample_wire_keys(R) for _ in names]
+	gate_ids = list(range(len(names)))
+	plains = [gate_id % 3 == 0 for gate_id in gate_ids]
+	truth_tables = [GATE_TRUTH_TABLES[name](True) for name in names]
+	inputs = [(gate_id % 2, (gate_id // 2) % 2) for gate_id in gate_ids]
+	P_left_keys = [P_left[i] for (P_left, (i, _)) in zip(P_lefts, inputs)]
+	P_right_keys = [P_right[j] for (P_right, (_, j)) in zip(P_rights, inputs)]
+	for hash_name in ("SHA256", "fixed-key AES"):
+		H_k = hash_tweak if hash_name == "SHA256" else H
+		(garblings, P_outs) = garble_half_gate_batch([P[0] for P in P_lefts], [P[0] for P in P_rights], R, truth_tables, gate_ids, plains, H_k)
+		passed = True
+		for (k, gate_id) in enumerate(gate_ids):
+			(garbling, P_out) = garble_half_gate(P_lefts[k][0], P_rights[k][0], R, truth_tables[k], gate_id, plains[k], H_k)
+			if (garbling.T_G, garbling.T_E, garbling.decode, P_out) != (garblings[k].T_G, garblings[k].T_E, garblings[k].decode, P_outs[k]):
+				passed = False
+		outputs = evaluate_batch(garblings, P_left_keys, P_right_keys)
+		for (k, (i, j)) in enumerate(inputs):
+			expected = truth_tables[k][i][j]
+			if outputs[k] != (expected if plains[k] else P_outs[k][int.from_bytes(expected, byteorder='big')]):
+				passed = False
+		if passed:
+			print("Batch: Half gates with {}: PASSED".format(hash_name))
+		else:
+			print("Batch: Half gates with {}: FAILED".format(hash_name))
+
+	P_lefts = [sample_wire_keys(point_and_permute=True) for _ in names]
+	P_rights = [sample_wire_keys(point_and_permute=True) for _ in names]
+	P_left_keys = [P_left[i] for (P_left, (i, _)) in zip(P_lefts, inputs)]
+	P_right_keys = [P_right[j] for (P_right, (_, j)) in zip(P_rights, inputs)]
+	for hash_name in ("Salsa20", "fixed-key AES"):
+		H_k = None if hash_name == "Salsa20" else H
+		garblings = garble_batch(P_lefts, P_rights, truth_tables, True, H_k, gate_ids)
+		outputs = evaluate_batch(garblings, P_left_keys, P_right_keys)
+		if outputs == [truth_table[i][j] for (truth_table, (i, j)) in zip(truth_tables, inputs)]:
+			print("Batch: Point-and-permute tables with {}: PASSED".format(hash_name))
+		else:
+			print("Batch: Point-and-permute tables with {}: FAILED".format(hash_name))
+
+# Compares garbling and evaluating num_gates fixed-key half gates and point-and-permute tables one at a time with
+# the batch API.
+def benchmark_batch(num_gates=10000):
+	R = generate_free_xor_offset()
+	H = fixed_key_hash()
+	P_lefts = [sample_wire_keys(R) for _ in range(num_gates)]
+	P_rights = [sample_wire_keys(R) for _ in range(num_gates)]
+	P_left_keys = [P_left[1] for P_left in P_lefts]
+	P_right_keys = [P_right[0] for P_right in P_rights]
+	truth_tables = [get_truth_table_and(True)] * num_gates
+	gate_ids = list(range(num_gates))
+	plains = [False] * num_gates
+
+	def half_gates_one():
+		return [garble_half_gate(P_lefts[k][0], P_rights[k][0], R, truth_tables[k], k, False, H)[0] for k in gate_ids]
+	def half_gates_batch():
+		return garble_half_gate_batch([P[0] for P in P_lefts], [P[0] for P in P_rights], R, truth_tables, gate_ids, plains, H)[0]
+	def pp_one():
+		return [garble(P_lefts[k][0], P_lefts[k][1], P_rights[k][0], P_rights[k][1], None, None, truth_tables[k], True, H, k) for k in gate_ids]
+	def pp_batch():
+		return garble_batch(P_lefts, P_rights, truth_tables, True, H, gate_ids)
+	for (name, garble_one, garble_many) in (("half gates", half_gates_one, half_gates_batch), ("point-and-permute", pp_one, pp_batch)):
+		st = time.perf_counter()
+		garblings = garble_one()
+		garble_one_time = time.perf_counter() - st
+		st = time.perf_counter()
+		garble_many()
+		garble_batch_time = time.perf_counter() - st
+		st = time.perf_counter()
+		[evaluate(garbling, P_left, P_right) for (garbling, P_left, P_right) in zip(garblings, P_left_keys, P_right_keys)]
+		evaluate_one_time = time.perf_counter() - st
+		st = time.perf_counter()
+		evaluate_batch(garblings, P_left_keys, P_right_keys)
+		evaluate_batch_time = time.perf_counter() - st
+		print("{} (fixed-key AES), {} gates: garble {:.0f} -> {:.0f} gates/s, evaluate {:.0f} -> {:.0f} gates/s".format(
+			name, num_gates, num_gates / garble_one_time, num_gates / garble_batch_time, num_gates / evaluate_one_time, num_gates / evaluate_batch_time))
+
+# Reports garbled AND gates per second for each table kind and hash primitive.
+def benchmark_garbled_gate(num_gates=2000):
+	R = generate_free_xor_offset()
+	P_left = sample_wire_keys(R)
+	P_right = sample_wire_keys(R)
+	P_out = sample_wire_keys(R)
+	truth_table_plain = get_truth_table_and(True)
+	truth_table = get_truth_table_and(False, P_out[0], P_out[1])
+	H = fixed_key_hash()
+	garblers = {
+		"classic (SHA256 + Salsa20)": lambda gate_id: garble(P_left[0], P_left[1], P_right[0], P_right[1], P_out[0], P_out[1], truth_table),
+		"point-and-permute (Salsa20)": lambda gate_id: garble(P_left[0], P_left[1], P_right[0], P_right[1], P_out[0], P_out[1], truth_table, True),
+		"point-and-permute (fixed-key AES)": lambda gate_id: garble(P_left[0], P_left[1], P_right[0], P_right[1], P_out[0], P_out[1], truth_table, True, H, gate_id),
+		"half-gates (SHA256)": lambda gate_id: garble_half_gate(P_left[0], P_right[0], R, truth_table_plain, gate_id)[0],
+		"half-gates (fixed-key AES)": lambda gate_id: garble_half_gate(P_left[0], P_right[0], R, truth_table_plain, gate_id, False, H)[0],
+	}
+	for name, garbler in garblers.items():
+		garble_st = time.time()
+		garblings = [garbler(gate_id) for gate_id in range(num_gates)]
+		garble_et = time.time()
+		evaluate_st = time.time()
+		for garbling in garblings:
+			evaluate(garbling, P_left[1], P_right[0])
+		evaluate_et = time.time()
+		print("{}: garble {:.0f} gates/s, evaluate {:.0f} gates/s".format(
+			name, num_gates / (garble_et - garble_st), num_gates / (evaluate_et - evaluate_st)))
 
 if __name__ == '__main__':
-	test_garbled_gate()
\ No newline at end of file
+	test_garbled_gate()
+	test_garbled_gate(point_and_permute=True)
+	test_garbled_gate(point_and_permute=True, H=fixed_key_hash())
+	test_free_xor_gate()
+	test_half_gate()
+	test_half_gate(fixed_key_hash())
+	test_batch()
+	# benchmark_garbled_gate()
+	# benchmark_batch()
\ No newline at end of file
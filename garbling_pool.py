@@ -0,0 +1,288 @@
+############################################################
+#### Description:
+# Offline pool of pre-garbled circuits, so that garbling is off the critical path of a comparison.
+# Garbling does not depend on the inputs, so circuits can be garbled ahead of time for the circuit shapes in use,
+# e.g. comparators of a given bit width, batch size and garbling options, and kept with their x_keys / y_keys.
+# - pop(shape) takes the oldest ready circuit of a shape in O(1). On a miss, the circuit is garbled on the spot.
+# - Every circuit is removed from the pool under the lock when it is popped, so it is handed out at most once:
+#   reusing a garbled circuit with other inputs would leak them.
+# - The pool holds at most capacity circuits. When it is full, refilling a shape evicts the oldest circuit of the
+#   least recently used shape, if that shape was used less recently. Circuits older than max_age seconds are dropped.
+# - A background thread, started with start(), keeps every shape at its target, like random_ot_refiller in ot_pool.py.
+# - stats() returns the hit, miss, refill and eviction counts, which are also reported to the metrics hooks.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from alice_and_bob import garbled_circuit_batch
+
+import collections
+import metrics
+import threading
+import time
+
+# Returns the shape of the comparator of num_pairs pairs of num_bits bit values garbled with options,
+# a hashable key for garbled_circuit_pool.
+def comparator_shape(num_bits: int, num_pairs: int = 1, options: dict = {}) -> tuple:
+	return (num_bits, num_pairs, tuple(sorted((option, bool(value)) for (option, value) in options.items() if value)))
+
+# Garbles the comparator of a shape returned by comparator_shape.
+# Returns (garbled_circuit, x_keys, y_keys), see garble_circuit in alice_and_bob.py.
+def garble_comparator_shape(shape: tuple):
+	(num_bits, num_pairs, options) = shape
+	return garbled_circuit_batch(num_bits, num_pairs, **dict(options))
+
+# Pool of pre-garbled circuits, see the description at the top of this file.
+# targets maps each shape to the number of circuits to keep ready. garble(shape) returns
+# (garbled_circuit, x_keys, y_keys) for a shape, and clock returns the current time in seconds.
+class garbled_circuit_pool:
+	def __init__(self, targets: dict, capacity=64, max_age=None, garble=garble_comparator_shape, clock=time.monotonic):
+		if capacity < 0:
+			raise ValueError('garbled_circuit_pool: capacity must be non-negative, found {}'.format(capacity))
+		self.targets = dict(targets)
+		self.capacity = capacity
+		self.max_age = max_age
+		self.garble = garble
+		self.clock = clock
+		# entries[shape] is a deque of (creation time, garbled circuit) pairs, oldest first.
+		self.entries = {shape: collections.deque() for shape in self.targets}
+		# Shapes from the least to the most recently used.
+		self.usage = collections.OrderedDict((shape, None) for shape in self.targets)
+		self.size = 0
+		# Number of pops so far, so that the background worker can tell whether a pop happened during a refill.
+		self.pops = 0
+		self.counts = collections.Counter()
+		self.lock = threading.Lock()
+		self.refill_lock = threading.Lock()
+		self.condition = threading.Condition()
+		self.thread = None
+		self.stopped = False
+
+	def __len__(self) -> int:
+		return self.size
+
+	def count(self, event: str, value: int = 1):
+		self.counts[event] += value
+		if metrics.enabled:
+			metrics.count("garbling_pool_total", value, event=event)
+
+	# Drops the circuits of shape older than max_age. Must be called with the lock held.
+	def expire(self, shape):
+		if self.max_age is None:
+			return
+		entries = self.entries[shape]
+		oldest = self.clock() - self.max_age
+		while entries and entries[0][0] < oldest:
+			entries.popleft()
+			self.size -= 1
+			self.count("evicted_age")
+
+	# Takes a garbled circuit of shape, which is never handed out again.
+	# Returns (garbled_circuit, x_keys, y_keys), garbled now if the pool has no circuit of shape.
+	def pop(self, shape):
+		with self.lock:
+			if shape not in self.entries:
+				self.entries[shape] = collections.deque()
+				self.targets[shape] = 0
+			self.pops += 1
+			self.usage[shape] = None
+			self.usage.move_to_end(shape)
+			self.expire(shape)
+			entries = self.entries[shape]
+			if entries:
+				(_, garbling) = entries.popleft()
+				self.size -= 1
+				self.count("hit")
+			else:
+				garbling = None
+				self.count("miss")
+		self.notify()
+		if garbling is None:
+			garbling = self.garble(shape)
+		return garbling
+
+	# Makes room for one circuit of shape, by evicting the oldest circuit of a shape used less recently than shape.
+	# Returns False if the pool is full of circuits of shapes used more recently. Must be called with the lock held.
+	def make_room(self, shape) -> bool:
+		if self.size < self.capacity:
+			return True
+		for victim in self.usage:
+			if victim == shape:
+				return False
+			if self.entries[victim]:
+				self.entries[victim].popleft()
+				self.size -= 1
+				self.count("evicted_capacity")
+				return True
+		return False
+
+	def needs_refill(self) -> bool:
+		with self.lock:
+			return any(len(self.entries[shape]) < target for (shape, target) in self.targets.items())
+
+	# Garbles circuits until every shape has its target number of circuits or the pool is full, starting with the
+	# most recently used shapes. Returns the number of circuits garbled.
+	def refill(self) -> int:
+		with self.refill_lock:
+			garbled = 0
+			with self.lock:
+				shapes = list(reversed(self.usage))
+			for shape in shapes:
+				while True:
+					with self.lock:
+						self.expire(shape)
+						if len(self.entries[shape]) >= self.targets[shape] or self.stopped:
+							break
+						if self.size >= self.capacity and not self.make_room(shape):
+							break
+					garbling = self.garble(shape)
+					with self.lock:
+						if not self.make_room(shape):
+							break
+						self.entries[shape].append((self.clock(), garbling))
+						self.size += 1
+						self.count("refilled")
+					garbled += 1
+			return garbled
+
+	# Returns the counts of hits, misses, circuits garbled by refill, and circuits evicted for capacity or age,
+	# together with the current number of circuits per shape.
+	def stats(self) -> dict:
+		with self.lock:
+			stats = {event: self.counts[event] for event in ("hit", "miss", "refilled", "evicted_capacity", "evicted_age")}
+			stats["size"] = self.size
+			stats["shapes"] = {shape: len(entries) for (shape, entries) in self.entries.items()}
+			return stats
+
+	# Wakes up the background worker, which is done after every pop.
+	def notify(self):
+		with self.condition:
+			self.condition.notify()
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.stopped and not self.needs_refill():
+					self.condition.wait()
+				if self.stopped:
+					return
+			with self.lock:
+				pops = self.pops
+			self.refill()
+			# The pool is full of circuits of more recently used shapes, wait for the next pop. A pop during refill
+			# has already sent its notify, and may have taken a circuit of a shape refill was done with, so refill again.
+			with self.condition:
+				if not self.stopped and self.needs_refill() and self.pops == pops:
+					self.condition.wait()
+
+	# Starts the background worker, which garbles circuits whenever a shape is below its target.
+	def start(self):
+		self.stopped = False
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		self.notify()
+
+	def stop(self):
+		with self.condition:
+			self.stopped = True
+			self.condition.notify()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+def test_garbling_pool():
+	from alice_and_bob import get_alice_keys, batch_bit_decomposition, evaluate_garbled_circuit_batch
+	import random
+
+	# A fake clock, so that ages do not depend on the time garbling takes.
+	now = [0.0]
+	shape_8 = comparator_shape(8, 1, {"half_gates": True})
+	shape_16 = comparator_shape(16, 4, {"half_gates": True, "fixed_key": True})
+	pool = garbled_circuit_pool({shape_8: 3, shape_16: 2}, capacity=4, max_age=10, clock=lambda: now[0])
+	pool.refill()
+	stats = pool.stats()
+	# The targets add up to 5, so the least recently used shape, shape_8, gets 1 circuit less.
+	if stats["size"] == 4 and stats["refilled"] == 4 and stats["shapes"] == {shape_8: 2, shape_16: 2}:
+		print("Garbling pool: Capacity: PASSED")
+	else:
+		print("Garbling pool: Capacity: FAILED")
+
+	passed = True
+	seen = set()
+	for shape in (shape_16, shape_16, shape_16, shape_8):
+		(num_bits, num_pairs, _) = shape
+		(garbled_circuit, x_keys, y_keys) = pool.pop(shape)
+		if id(garbled_circuit) in seen:
+			passed = False
+		seen.add(id(garbled_circuit))
+		alice_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+		bob_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+		alice_keys = get_alice_keys(x_keys, *batch_bit_decomposition(alice_values, num_bits))
+		bob_keys = get_alice_keys(y_keys, *batch_bit_decomposition(bob_values, num_bits))
+		if evaluate_garbled_circuit_batch(num_bits, garbled_circuit, alice_keys, bob_keys) != [x >= y for (x, y) in zip(alice_values, bob_values)]:
+			passed = False
+	stats = pool.stats()
+	if passed and stats["hit"] == 3 and stats["miss"] == 1 and stats["size"] == 1:
+		print("Garbling pool: Use once and hit / miss stats: PASSED")
+	else:
+		print("Garbling pool: Use once and hit / miss stats: FAILED")
+
+	# shape_8 was used last, so it is refilled first and shape_16 cannot evict it.
+	pool.refill()
+	stats = pool.stats()
+	passed = stats["shapes"] == {shape_8: 3, shape_16: 1} and stats["evicted_capacity"] == 0
+	# Once shape_16 is used again, refilling it evicts a circuit of shape_8.
+	pool.pop(shape_16)
+	pool.refill()
+	stats = pool.stats()
+	if passed and stats["shapes"] == {shape_8: 2, shape_16: 2} and stats["evicted_capacity"] == 1:
+		print("Garbling pool: LRU eviction: PASSED")
+	else:
+		print("Garbling pool: LRU eviction: FAILED")
+
+	now[0] = 11
+	pool.pop(shape_8)
+	stats = pool.stats()
+	if stats["evicted_age"] == 2 and stats["shapes"][shape_8] == 0 and stats["shapes"][shape_16] == 2:
+		print("Garbling pool: Age eviction: PASSED")
+	else:
+		print("Garbling pool: Age eviction: FAILED")
+
+	pool.start()
+	deadline = time.time() + 60
+	while pool.stats()["size"] < 4 and time.time() < deadline:
+		time.sleep(0.01)
+	pool.stop()
+	stats = pool.stats()
+	# shape_8 was used last, so it gets its 3 circuits and shape_16 the room left.
+	if stats["size"] == 4 and stats["shapes"] == {shape_8: 3, shape_16: 1}:
+		print("Garbling pool: Background refill: PASSED")
+	else:
+		print("Garbling pool: Background refill: FAILED")
+
+	# A pop of shape_a while the worker garbles shape_b, after shape_a was refilled, must still get shape_a refilled.
+	# The pop waits for start() to return, so that the notify of start() cannot stand in for the one of the pop.
+	(shape_a, shape_b) = (comparator_shape(1), comparator_shape(2))
+	popped = []
+	started = threading.Event()
+
+	def garble(shape):
+		if shape == shape_b and not popped:
+			started.wait()
+			popped.append(pool.pop(shape_a))
+		return (shape, object())
+
+	pool = garbled_circuit_pool({shape_b: 1, shape_a: 1}, garble=garble)
+	pool.start()
+	started.set()
+	deadline = time.time() + 10
+	while pool.stats()["shapes"] != {shape_a: 1, shape_b: 1} and time.time() < deadline:
+		time.sleep(0.01)
+	pool.stop()
+	if popped and pool.stats()["shapes"] == {shape_a: 1, shape_b: 1}:
+		print("Garbling pool: Pop during refill: PASSED")
+	else:
+		print("Garbling pool: Pop during refill: FAILED")
+
+if __name__ == '__main__':
+	test_garbling_pool()
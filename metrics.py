@@ -0,0 +1,226 @@
+############################################################
+#### Description:
+# Metrics hooks for protocol phases, crypto operations, message sizes and gate counts.
+# garbled_gate.py, oblivious_transfer.py, alice_and_bob.py and the Alice/Bob drivers report into the current sink:
+# - count(name, value, **labels) adds value to a counter, e.g. count("crypto_ops_total", 2, op="salsa20").
+# - observe(name, seconds, **labels) records a duration, and phase(name) times a with block as "phase_seconds".
+# The default sink is null_metrics, which drops everything. Hot paths check the module level flag enabled before
+# calling into the sink, so disabled hooks cost one global lookup and branch.
+# memory_metrics aggregates in memory, and prometheus_text renders it in the Prometheus text exposition format,
+# which serve_prometheus serves over HTTP.
+#
+# Usage:
+#   sink = metrics.memory_metrics()
+#   metrics.set_metrics(sink)
+#   ... run the protocol ...
+#   print(metrics.prometheus_text(sink))
+
+# Author: Nikhil Vanjani
+############################################################
+
+import os
+import threading
+import time
+
+# Prefix of the exported metric names.
+NAMESPACE = "garbled_circuits"
+# If this environment variable is set, configure_from_environment serves metrics on the port it holds.
+PORT_VARIABLE = "GC_METRICS_PORT"
+
+# Metrics sink that drops everything.
+class null_metrics:
+	def count(self, name: str, value=1, **labels):
+		pass
+
+	def observe(self, name: str, seconds: float, **labels):
+		pass
+
+	def phase(self, name: str):
+		return NULL_PHASE
+
+# Context manager that does nothing, returned by null_metrics.phase.
+class null_phase:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		return False
+
+NULL_PHASE = null_phase()
+
+# Context manager that reports the duration of a with block to sink as phase_seconds{phase=name}.
+class timed_phase:
+	def __init__(self, sink, name: str):
+		self.sink = sink
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.sink.observe("phase_seconds", time.perf_counter() - self.start, phase=self.name)
+		return False
+
+# Metrics sink that aggregates counters and durations in memory. It is safe to use from several threads.
+# counters maps (name, labels) to a number and summaries maps (name, labels) to [count, sum, max],
+# where labels is a sorted tuple of (label, value) pairs.
+class memory_metrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.summaries = {}
+
+	def count(self, name: str, value=1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, name: str, seconds: float, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			summary = self.summaries.setdefault(key, [0, 0.0, 0.0])
+			summary[0] += 1
+			summary[1] += seconds
+			summary[2] = max(summary[2], seconds)
+
+	def phase(self, name: str):
+		return timed_phase(self, name)
+
+	# Returns the value of a counter, e.g. get("crypto_ops_total", op="sha256").
+	def get(self, name: str, **labels):
+		with self.lock:
+			return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+	def reset(self):
+		with self.lock:
+			self.counters.clear()
+			self.summaries.clear()
+
+sink = null_metrics()
+enabled = False
+
+# Makes new_sink the sink of all hooks. None restores the no-op default.
+def set_metrics(new_sink):
+	global sink, enabled
+	sink = new_sink if new_sink is not None else null_metrics()
+	enabled = not isinstance(sink, null_metrics)
+
+def get_metrics():
+	return sink
+
+def count(name: str, value=1, **labels):
+	sink.count(name, value, **labels)
+
+def observe(name: str, seconds: float, **labels):
+	sink.observe(name, seconds, **labels)
+
+def phase(name: str):
+	return sink.phase(name)
+
+def format_labels(labels: tuple) -> str:
+	if not labels:
+		return ""
+	escaped = ('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (label, value) in labels)
+	return "{" + ",".join(escaped) + "}"
+
+# Renders a memory_metrics in the Prometheus text exposition format.
+# Counters are exported as counters and durations as summaries (_count and _sum), with an extra _max gauge.
+def prometheus_text(metrics: memory_metrics) -> str:
+	with metrics.lock:
+		counters = sorted(metrics.counters.items())
+		summaries = sorted(metrics.summaries.items())
+	lines = []
+	last_name = None
+	for ((name, labels), value) in counters:
+		full_name = "{}_{}".format(NAMESPACE, name)
+		if name != last_name:
+			lines.append("# TYPE {} counter".format(full_name))
+			last_name = name
+		lines.append("{}{} {}".format(full_name, format_labels(labels), value))
+	last_name = None
+	for ((name, labels), (num, total, _)) in summaries:
+		full_name = "{}_{}".format(NAMESPACE, name)
+		if name != last_name:
+			lines.append("# TYPE {} summary".format(full_name))
+			last_name = name
+		lines.append("{}_count{} {}".format(full_name, format_labels(labels), num))
+		lines.append("{}_sum{} {}".format(full_name, format_labels(labels), total))
+	last_name = None
+	for ((name, labels), (_, _, maximum)) in summaries:
+		full_name = "{}_{}_max".format(NAMESPACE, name)
+		if name != last_name:
+			lines.append("# TYPE {} gauge".format(full_name))
+			last_name = name
+		lines.append("{}{} {}".format(full_name, format_labels(labels), maximum))
+	return "\n".join(lines) + "\n"
+
+# Serves prometheus_text(metrics) on http://host:port/metrics from a daemon thread.
+# Returns the http.server.ThreadingHTTPServer, whose shutdown method stops it.
+# http.server is imported here, since it takes longer to import than the rest of this module.
+def serve_prometheus(metrics: memory_metrics, port: int, host: str = "127.0.0.1"):
+	import http.server
+
+	class handler(http.server.BaseHTTPRequestHandler):
+		def do_GET(self):
+			if self.path != "/metrics":
+				self.send_error(404)
+				return
+			body = prometheus_text(metrics).encode()
+			self.send_response(200)
+			self.send_header("Content-Type", "text/plain; version=0.0.4")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = http.server.ThreadingHTTPServer((host, port), handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+# Enables a memory_metrics served over HTTP if the environment variable GC_METRICS_PORT is set,
+# so that the drivers can be instrumented without editing code. Returns the sink.
+def configure_from_environment():
+	port = os.environ.get(PORT_VARIABLE)
+	if port:
+		set_metrics(memory_metrics())
+		serve_prometheus(sink, int(port))
+	return sink
+
+def test_metrics():
+	# The hooks live in the imported module, which differs from __main__ when this file is run as a script.
+	import metrics
+	from alice_and_bob import garble_circuit, evaluate_circuit, get_alice_keys
+	from circuit import comparator_circuit
+
+	circ = comparator_circuit(8)
+	sink = metrics.memory_metrics()
+	metrics.set_metrics(sink)
+	try:
+		(garbled_circuit, x_keys, y_keys) = garble_circuit(circ)
+		evaluate_circuit(circ, garbled_circuit, get_alice_keys(x_keys, *[0] * 8), get_alice_keys(y_keys, *[1] * 8))
+	finally:
+		metrics.set_metrics(None)
+	num_gates = len(circ.gates)
+	# Classic garbling hashes and double encrypts 4 rows per gate, evaluation hashes and decrypts 1 row per gate.
+	if (sink.get("crypto_ops_total", op="sha256") == 5 * num_gates and sink.get("crypto_ops_total", op="salsa20") == 10 * num_gates
+			and sink.get("gates_total", gate="AND", role="garble") == circ.gate_counts()["AND"]):
+		print("Metrics: Counters: PASSED")
+	else:
+		print("Metrics: Counters: FAILED")
+	text = metrics.prometheus_text(sink)
+	if '# TYPE garbled_circuits_crypto_ops_total counter' in text and 'garbled_circuits_phase_seconds_count{phase="garble"} 1' in text:
+		print("Metrics: Prometheus text: PASSED")
+	else:
+		print("Metrics: Prometheus text: FAILED")
+
+	(garbled_circuit, _, _) = garble_circuit(circ)
+	if sink.get("crypto_ops_total", op="sha256") == 5 * num_gates:
+		print("Metrics: Disabled hooks: PASSED")
+	else:
+		print("Metrics: Disabled hooks: FAILED")
+
+if __name__ == '__main__':
+	test_metrics()
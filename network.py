@@ -0,0 +1,453 @@
+############################################################
+#### Description:
+# Network mode of alice.py and bob.py: the protocol runs over a TCP connection instead of the ./files directory.
+# Every message is a frame (message type: u8, payload length: u32, payload), and payloads reuse the binary formats of
+# circuit_file.py. Alice listens and Bob connects, and each party runs a state machine that drives
+# hello -> garble -> keys -> OT -> evaluate without any manual step:
+# - Alice sends a hello with the bit width, the garbling options and the OT method, samples the wire keys and
+#   sends her own keys right away, so that they travel while Bob runs the OT.
+# - Alice and Bob run the OT for Bob's keys. With the Elgamal OT, Bob sends the public keys of each input bit as soon as
+#   they are generated, and Alice answers each of them immediately. With OT extension, the base OTs and one extension
+#   batch are run, see oblivious_transfer.py. Bob is the sender of the base OTs, so he sends his EC OT public key first.
+# - Alice garbles the circuit gate by gate and flushes the gate stream every GATES_PER_FRAME gates, while Bob
+#   evaluates each frame as it arrives, as in streaming.py.
+# A session can compare a batch of value pairs: the hello carries the number of pairs, the circuit is
+# batch_comparator_circuit, and the OT for Bob's keys of all the pairs runs once, so the connection, the OT setup and
+# the message round trips are shared by the whole batch.
+# With a garbled_circuit_pool (garbling_pool.py), Alice takes a pre-garbled circuit instead of garbling during the session.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from alice_and_bob import garble_circuit_stream, evaluate_circuit, get_alice_keys, batch_bit_decomposition, get_count_per_bit
+from circuit import batch_comparator_circuit
+from garbling_pool import comparator_shape
+from circuit_file import write_keys, read_keys, write_gate_stream, read_gate_stream, read_exactly
+from oblivious_transfer import bob_ot1, alice_ot1, bob_ot2, public_keys_to_bytes, public_keys_from_bytes, \
+	ciphertexts_to_bytes, ciphertexts_from_bytes, OT_EXTENSION_KAPPA, bob_ot_ext_setup1, alice_ot_ext_setup1, bob_ot_ext_setup, \
+	alice_ot_ext_setup2, bob_ot_ext1, alice_ot_ext1, bob_ot_ext2
+
+import io
+import metrics
+import random
+import socket
+import struct
+import threading
+
+# message type, payload length
+FRAME_HEADER = struct.Struct('<BI')
+MSG_HELLO = 1
+MSG_ALICE_KEYS = 2
+MSG_OT_PK = 3
+MSG_OT_CT = 4
+MSG_OT_EXT_U = 5
+MSG_GATES = 6
+# Messages of the sessions of async_network.py.
+MSG_OPEN = 7
+MSG_ERROR = 8
+MESSAGE_NAMES = {MSG_HELLO: "hello", MSG_ALICE_KEYS: "alice_keys", MSG_OT_PK: "ot_pk", MSG_OT_CT: "ot_ct", MSG_OT_EXT_U: "ot_ext_u", MSG_GATES: "gates",
+	MSG_OPEN: "open", MSG_ERROR: "error"}
+
+# bit width, garbling options (bit flags in the order of GARBLING_OPTIONS), OT method, kappa, number of pairs
+HELLO_FORMAT = struct.Struct('<IBBHI')
+GARBLING_OPTIONS = ("free_xor", "point_and_permute", "half_gates", "fixed_key")
+OT_ELGAMAL = 0
+OT_EXTENSION = 1
+OT_METHODS = {"elgamal": OT_ELGAMAL, "extension": OT_EXTENSION}
+
+GATES_PER_FRAME = 1000
+
+# A framed, bidirectional message channel over a connected socket.
+class channel:
+	def __init__(self, sock):
+		self.sock = sock
+		self.reader = sock.makefile("rb")
+
+	def send(self, msg_type: int, payload: bytes):
+		self.sock.sendall(FRAME_HEADER.pack(msg_type, len(payload)) + payload)
+		if metrics.enabled:
+			metrics.count("network_bytes_total", FRAME_HEADER.size + len(payload), message=MESSAGE_NAMES.get(msg_type, msg_type), direction="sent")
+
+	# Returns the payload of the next frame, which must be of type msg_type.
+	def recv(self, msg_type: int) -> bytes:
+		(found_type, length) = FRAME_HEADER.unpack(read_exactly(self.reader, FRAME_HEADER.size))
+		if found_type != msg_type:
+			raise ValueError('channel: expected message type {}, found {}'.format(msg_type, found_type))
+		if metrics.enabled:
+			metrics.count("network_bytes_total", FRAME_HEADER.size + length, message=MESSAGE_NAMES.get(msg_type, msg_type), direction="received")
+		return read_exactly(self.reader, length)
+
+	def close(self):
+		self.reader.close()
+		self.sock.close()
+
+# Binary file object that sends whatever is written to it as one frame of type msg_type on every flush,
+# e.g. for write_gate_stream in circuit_file.py.
+class frame_writer(io.RawIOBase):
+	def __init__(self, chan: channel, msg_type: int):
+		self.chan = chan
+		self.msg_type = msg_type
+		self.buffer = bytearray()
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, data) -> int:
+		self.buffer += data
+		return len(data)
+
+	def flush(self):
+		if self.buffer:
+			self.chan.send(self.msg_type, bytes(self.buffer))
+			self.buffer.clear()
+
+# Binary file object that reads the concatenated payloads of the frames of type msg_type,
+# e.g. for read_gate_stream in circuit_file.py.
+class frame_reader(io.RawIOBase):
+	def __init__(self, chan: channel, msg_type: int):
+		self.chan = chan
+		self.msg_type = msg_type
+		self.buffer = b''
+		self.offset = 0
+
+	def readable(self) -> bool:
+		return True
+
+	# Reads size bytes, across frame boundaries if needed, or the rest of the current frame if size is negative.
+	def read(self, size: int = -1) -> bytes:
+		data = bytearray()
+		while size < 0 and not data or len(data) < size:
+			if self.offset == len(self.buffer):
+				self.buffer = self.chan.recv(self.msg_type)
+				self.offset = 0
+			end = len(self.buffer) if size < 0 else min(len(self.buffer), self.offset + size - len(data))
+			data += self.buffer[self.offset:end]
+			self.offset = end
+		return bytes(data)
+
+# Returns the keys encoded with the keys format of circuit_file.py.
+def encode_keys(keys: dict) -> bytes:
+	file = io.BytesIO()
+	write_keys(file, keys)
+	return file.getvalue()
+
+# Inverse of encode_keys.
+def decode_keys(payload: bytes) -> dict:
+	return read_keys(io.BytesIO(payload))
+
+# Returns a dict {0: {j: values[j]}}, so that a list can be sent with encode_keys.
+def list_to_keys(values: list) -> dict:
+	return {0: dict(enumerate(values))}
+
+# Inverse of list_to_keys.
+def keys_to_list(keys: dict) -> list:
+	values = keys.get(0, {})
+	return [values[j] for j in range(len(values))]
+
+# The message computations of the OTs below are separate from the channel, so that async_network.py can run them
+# in an executor.
+
+# Bob's message of the Elgamal OT for input bit i, which feeds into count gates.
+# Returns (payload, bob_sk), where bob_sk is kept by Bob for bob_elgamal_ot_keys.
+def bob_elgamal_ot_request(i: int, bit: int, count: int) -> (bytes, dict):
+	bob_pk = {i: {}}
+	bob_sk = {}
+	for j in range(count):
+		((b_0, b_1), sk) = bob_ot1(bit != 0)
+		bob_pk[i][j] = public_keys_to_bytes(b_0, b_1)
+		bob_sk[j] = sk
+	return (encode_keys(bob_pk), bob_sk)
+
+# Alice's answer to the Elgamal OT message payload of Bob for input bit i.
+def alice_elgamal_ot_answer(y_keys, i: int, payload: bytes) -> bytes:
+	bob_pk = decode_keys(payload)
+	alice_ct = {i: {}}
+	for j in range(len(y_keys[i][0])):
+		(b_0, b_1) = public_keys_from_bytes(bob_pk[i][j])
+		(ct_0, ct_1) = alice_ot1(b_0, b_1, y_keys[i][0][j], y_keys[i][1][j])
+		alice_ct[i][j] = ciphertexts_to_bytes(ct_0, ct_1)
+	return encode_keys(alice_ct)
+
+# Returns Bob's keys {j: key} of input bit i, from Alice's answer payload and bob_sk of bob_elgamal_ot_request.
+def bob_elgamal_ot_keys(i: int, bit: int, bob_sk: dict, payload: bytes) -> dict:
+	alice_ct = decode_keys(payload)
+	keys = {}
+	for j in range(len(bob_sk)):
+		(ct_0, ct_1) = ciphertexts_from_bytes(alice_ct[i][j])
+		keys[j] = bob_ot2(bit != 0, bob_sk[j], ct_0, ct_1)
+	return keys
+
+# Alice's side of the OT for Bob's keys, with the Elgamal OT: one message from Bob and one answer per input bit.
+def alice_elgamal_ot(chan: channel, y_keys):
+	for i in range(len(y_keys)):
+		chan.send(MSG_OT_CT, alice_elgamal_ot_answer(y_keys, i, chan.recv(MSG_OT_PK)))
+
+# Bob's side of alice_elgamal_ot. Returns bob_keys.
+def bob_elgamal_ot(chan: channel, bits: list, count_per_bit: list) -> dict:
+	bob_sk = {}
+	for i, bit in enumerate(bits):
+		(payload, bob_sk[i]) = bob_elgamal_ot_request(i, bit, count_per_bit[i])
+		chan.send(MSG_OT_PK, payload)
+	return {i: bob_elgamal_ot_keys(i, bit, bob_sk[i], chan.recv(MSG_OT_CT)) for i, bit in enumerate(bits)}
+
+# Bob's public key for the base OTs of OT extension, in which he is the sender.
+# Returns (payload, setup_state), where setup_state is kept by Bob for bob_extension_ot_setup.
+def bob_extension_ot_setup_request() -> (bytes, object):
+	return bob_ot_ext_setup1()
+
+# Alice's base OT messages for Bob's public key payload.
+# Returns (payload, setup_state), where setup_state is kept by Alice for alice_extension_ot_setup.
+def alice_extension_ot_setup_request(kappa: int, payload: bytes) -> (bytes, tuple):
+	(alice_all_B, setup_state) = alice_ot_ext_setup1(payload, kappa)
+	return (encode_keys(list_to_keys(alice_all_B)), setup_state)
+
+# Bob's answer to the base OT messages payload of Alice. Returns (payload, receiver).
+def bob_extension_ot_setup(setup_state, payload: bytes) -> (bytes, object):
+	(bob_all_ct, receiver) = bob_ot_ext_setup(setup_state, keys_to_list(decode_keys(payload)))
+	return (encode_keys(list_to_keys(bob_all_ct)), receiver)
+
+# Returns Alice's ot_extension_sender from setup_state and Bob's answer payload.
+def alice_extension_ot_setup(setup_state, payload: bytes):
+	return alice_ot_ext_setup2(setup_state, keys_to_list(decode_keys(payload)))
+
+# Bob's message of one extension batch for bits, where bit i feeds into count_per_bit[i] gates.
+# Returns (payload, batch_state), where batch_state is kept by Bob for bob_extension_ot_keys.
+def bob_extension_ot_request(receiver, bits: list, count_per_bit: list) -> (bytes, tuple):
+	pairs = [(i, j) for i in range(len(bits)) for j in range(count_per_bit[i])]
+	(u, batch_state) = bob_ot_ext1(receiver, [bits[i] != 0 for (i, _) in pairs])
+	num_bytes = (len(pairs) + 7) // 8
+	return (encode_keys(list_to_keys([column.to_bytes(num_bytes, byteorder='big') for column in u])), (pairs, batch_state))
+
+# Alice's answer to the extension batch message payload of Bob, which carries all the keys of y_keys.
+def alice_extension_ot_answer(sender, y_keys, payload: bytes) -> bytes:
+	msgs = [(y_keys[i][0][j], y_keys[i][1][j]) for i in range(len(y_keys)) for j in range(len(y_keys[i][0]))]
+	u = [int.from_bytes(column, byteorder='big') for column in keys_to_list(decode_keys(payload))]
+	return encode_keys(list_to_keys(alice_ot_ext1(sender, u, msgs)))
+
+# Returns bob_keys from Alice's answer payload and the batch_state of bob_extension_ot_request.
+def bob_extension_ot_keys(batch_state, payload: bytes) -> dict:
+	(pairs, batch_state) = batch_state
+	received = bob_ot_ext2(batch_state, keys_to_list(decode_keys(payload)))
+	bob_keys = {}
+	for ((i, j), msg) in zip(pairs, received):
+		bob_keys.setdefault(i, {})[j] = msg
+	return bob_keys
+
+# Alice's side of the OT for Bob's keys, with OT extension on kappa base OTs.
+def alice_extension_ot(chan: channel, y_keys, kappa: int):
+	(payload, setup_state) = alice_extension_ot_setup_request(kappa, chan.recv(MSG_OT_PK))
+	chan.send(MSG_OT_PK, payload)
+	sender = alice_extension_ot_setup(setup_state, chan.recv(MSG_OT_CT))
+	chan.send(MSG_OT_CT, alice_extension_ot_answer(sender, y_keys, chan.recv(MSG_OT_EXT_U)))
+
+# Bob's side of alice_extension_ot. Returns bob_keys.
+def bob_extension_ot(chan: channel, bits: list, count_per_bit: list) -> dict:
+	(payload, setup_state) = bob_extension_ot_setup_request()
+	chan.send(MSG_OT_PK, payload)
+	(payload, receiver) = bob_extension_ot_setup(setup_state, chan.recv(MSG_OT_PK))
+	chan.send(MSG_OT_CT, payload)
+	(payload, batch_state) = bob_extension_ot_request(receiver, bits, count_per_bit)
+	chan.send(MSG_OT_EXT_U, payload)
+	return bob_extension_ot_keys(batch_state, chan.recv(MSG_OT_CT))
+
+# Returns (values, batched): values is the list of inputs, and batched is False if value was a single int.
+def input_values(value) -> (list, bool):
+	if isinstance(value, int):
+		return ([value], False)
+	return (list(value), True)
+
+# Alice's state machine for one connection. Each state is a method that returns the name of the next state.
+# alice_input is an int, or a list of ints to compare a batch of pairs.
+class alice_session:
+	def __init__(self, chan: channel, num_bits: int, alice_input, options: dict, ot_method="elgamal", kappa=OT_EXTENSION_KAPPA, garbling_pool=None):
+		self.chan = chan
+		self.garbling_pool = garbling_pool
+		self.num_bits = num_bits
+		(self.alice_values, _) = input_values(alice_input)
+		self.options = options
+		self.ot_method = OT_METHODS[ot_method]
+		self.kappa = kappa
+		self.states = {
+			"hello": self.hello,
+			"garble": self.garble,
+			"ot": self.ot,
+			"gates": self.gates,
+		}
+
+	def hello(self) -> str:
+		flags = sum(1 << k for (k, option) in enumerate(GARBLING_OPTIONS) if self.options.get(option))
+		self.chan.send(MSG_HELLO, HELLO_FORMAT.pack(self.num_bits, flags, self.ot_method, self.kappa, len(self.alice_values)))
+		return "garble"
+
+	# Samples the wire keys and sends Alice's keys. The gates are garbled lazily while they are sent,
+	# unless a pre-garbled circuit is taken from the garbling pool.
+	def garble(self) -> str:
+		if self.garbling_pool is not None:
+			(garbled_circuit, x_keys, self.y_keys) = self.garbling_pool.pop(comparator_shape(self.num_bits, len(self.alice_values), self.options))
+			self.gate_stream = iter(garbled_circuit)
+		else:
+			self.circ = batch_comparator_circuit(self.num_bits, len(self.alice_values))
+			(self.gate_stream, x_keys, self.y_keys) = garble_circuit_stream(self.circ, **self.options)
+		alice_keys = get_alice_keys(x_keys, *batch_bit_decomposition(self.alice_values, self.num_bits))
+		self.chan.send(MSG_ALICE_KEYS, encode_keys(alice_keys))
+		return "ot"
+
+	def ot(self) -> str:
+		if self.ot_method == OT_EXTENSION:
+			alice_extension_ot(self.chan, self.y_keys, self.kappa)
+		else:
+			alice_elgamal_ot(self.chan, self.y_keys)
+		return "gates"
+
+	def gates(self) -> str:
+		write_gate_stream(frame_writer(self.chan, MSG_GATES), self.gate_stream, GATES_PER_FRAME)
+		return "done"
+
+	def run(self):
+		state = "hello"
+		while state != "done":
+			with metrics.phase("alice_" + state):
+				state = self.states[state]()
+
+# Bob's state machine for one connection, see alice_session.
+# bob_input is an int, or a list of ints with as many values as Alice's batch.
+class bob_session:
+	def __init__(self, chan: channel, num_bits: int, bob_input):
+		self.chan = chan
+		self.num_bits = num_bits
+		(self.bob_values, self.batched) = input_values(bob_input)
+		self.output = None
+		self.states = {
+			"hello": self.hello,
+			"keys": self.keys,
+			"ot": self.ot,
+			"evaluate": self.evaluate,
+		}
+
+	def hello(self) -> str:
+		(num_bits, _, self.ot_method, _, num_pairs) = HELLO_FORMAT.unpack(self.chan.recv(MSG_HELLO))
+		if num_bits != self.num_bits:
+			raise ValueError('bob_session: Alice uses {} bits, Bob uses {} bits'.format(num_bits, self.num_bits))
+		if num_pairs != len(self.bob_values):
+			raise ValueError('bob_session: Alice has {} values, Bob has {} values'.format(num_pairs, len(self.bob_values)))
+		self.circ = batch_comparator_circuit(self.num_bits, num_pairs)
+		return "keys"
+
+	def keys(self) -> str:
+		self.alice_keys = decode_keys(self.chan.recv(MSG_ALICE_KEYS))
+		return "ot"
+
+	def ot(self) -> str:
+		bits = batch_bit_decomposition(self.bob_values, self.num_bits)
+		count_per_bit = get_count_per_bit(self.num_bits, len(self.bob_values))
+		if self.ot_method == OT_EXTENSION:
+			self.bob_keys = bob_extension_ot(self.chan, bits, count_per_bit)
+		else:
+			self.bob_keys = bob_elgamal_ot(self.chan, bits, count_per_bit)
+		return "evaluate"
+
+	# Evaluates each frame of the gate stream as soon as it arrives.
+	def evaluate(self) -> str:
+		gate_stream = read_gate_stream(frame_reader(self.chan, MSG_GATES))
+		outputs = [int.from_bytes(val_out, byteorder='big') != 0 for val_out in evaluate_circuit(self.circ, gate_stream, self.alice_keys, self.bob_keys)]
+		self.output = outputs if self.batched else outputs[0]
+		return "done"
+
+	# Returns True if and only if Alice's value >= Bob's value.
+	# For a batch, returns the list of the results of each pair.
+	def run(self):
+		state = "hello"
+		while state != "done":
+			with metrics.phase("bob_" + state):
+				state = self.states[state]()
+		return self.output
+
+# Listens on (host, port) and runs Alice's side of the protocol for each connection, one at a time.
+# num_sessions bounds the number of connections served, None serves forever.
+# If ready is given, it is called with the bound address once the socket listens.
+# If garbling_pool is given, the garbled circuits are taken from it, see alice_session.
+def serve_alice(host: str, port: int, num_bits: int, alice_input, options: dict, ot_method="elgamal",
+		kappa=OT_EXTENSION_KAPPA, num_sessions=None, ready=None, garbling_pool=None):
+	with socket.create_server((host, port)) as server:
+		if ready is not None:
+			ready(server.getsockname())
+		served = 0
+		while num_sessions is None or served < num_sessions:
+			(sock, _) = server.accept()
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			chan = channel(sock)
+			try:
+				alice_session(chan, num_bits, alice_input, options, ot_method, kappa, garbling_pool).run()
+			finally:
+				chan.close()
+			served += 1
+
+# Connects to Alice at (host, port) and runs Bob's side of the protocol.
+# Returns True if and only if Alice's value >= Bob's value, or the list of results for a batch, see bob_session.
+def connect_bob(host: str, port: int, num_bits: int, bob_input):
+	sock = socket.create_connection((host, port))
+	sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	chan = channel(sock)
+	try:
+		return bob_session(chan, num_bits, bob_input).run()
+	finally:
+		chan.close()
+
+# Parses "host:port".
+def parse_address(address: str) -> (str, int):
+	(host, _, port) = address.rpartition(":")
+	return (host or "127.0.0.1", int(port))
+
+# Parses "x" into the int x, and "x0,x1,..." into the list of ints of a batch.
+def parse_values(text: str):
+	values = [int(value) for value in text.split(",")]
+	return values if len(values) > 1 else values[0]
+
+def test_network():
+	tests = (
+		(1, {}, "elgamal"),
+		(16, {"free_xor": True, "point_and_permute": True}, "extension"),
+		(16, {"half_gates": True, "fixed_key": True}, "extension"),
+	)
+	for (num_bits, options, ot_method) in tests:
+		alice_input = random.getrandbits(num_bits)
+		bob_input = random.getrandbits(num_bits)
+		address = []
+		listening = threading.Event()
+		def ready(bound):
+			address.append(bound)
+			listening.set()
+		alice = threading.Thread(target=serve_alice, args=("127.0.0.1", 0, num_bits, alice_input, options, ot_method, 2, 1, ready))
+		alice.start()
+		listening.wait()
+		output = connect_bob(*address[0], num_bits, bob_input)
+		alice.join()
+		if output == (alice_input >= bob_input):
+			print("Network: Correctness for {} bits, options = {}, OT = {}: PASSED".format(num_bits, options, ot_method))
+		else:
+			print("Network: Correctness for {} bits, options = {}, OT = {}: FAILED".format(num_bits, options, ot_method))
+
+	# A batch of pairs in one session, with a pre-garbled circuit.
+	from garbling_pool import garbled_circuit_pool
+	(num_bits, num_pairs) = (8, 20)
+	alice_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+	bob_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+	address = []
+	listening = threading.Event()
+	def ready(bound):
+		address.append(bound)
+		listening.set()
+	pool = garbled_circuit_pool({comparator_shape(num_bits, num_pairs, {"half_gates": True}): 1})
+	pool.refill()
+	alice = threading.Thread(target=serve_alice, args=("127.0.0.1", 0, num_bits, alice_values, {"half_gates": True}, "extension", 2, 1, ready, pool))
+	alice.start()
+	listening.wait()
+	outputs = connect_bob(*address[0], num_bits, bob_values)
+	alice.join()
+	if outputs == [x >= y for (x, y) in zip(alice_values, bob_values)] and pool.stats()["hit"] == 1:
+		print("Network: Correctness for a batch of {} pairs: PASSED".format(num_pairs))
+	else:
+		print("Network: Correctness for a batch of {} pairs: FAILED".format(num_pairs))
+
+if __name__ == '__main__':
+	test_network()
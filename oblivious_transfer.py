@@ -7,44 +7,417 @@
 ############################################################
 
 from elgamal.elgamal import Elgamal, PublicKey, PrivateKey, CipherText
+from Crypto.Cipher import AES
+from Crypto.Hash import SHA256, SHAKE256
+from Crypto.PublicKey.ECC import EccPoint
 from copy import deepcopy
+import metrics
+import os
+import random
+import time
 
 
 # This is a toy OT protocol and may not be fully secure.
 # For OT protocol's security, it is essential that Bob does not know the secret key sk2 corresponding to the fake public key pk2.
-# In Elgamal encryption, pk = g^{sk}. 
-# To ensure full security, we need that ARITHMETIC_PROGRESSION_DIFF = random value, for example SHA(1). 
-# This helps formally argue that pk2 is a random value and thus finding sk2 is no easier than breaking the discrete log assumption.
-ARITHMETIC_PROGRESSION_DIFF = 1
+# In Elgamal encryption, pk = g^{sk}. If Bob could choose the group, he could choose one where he knows the logs of two keys
+# with the required difference, e.g. g = 1 + diff, b_0 = 1 = g^0 and b_1 = g = g^1. So all keys are in a fixed group,
+# the 2048-bit MODP group of RFC 3526 with g = 2, and alice_ot1 rejects keys in any other group.
+# With a small difference such as 1, Bob could still pick small keys with known logs, e.g. 1 = g^0 and 2 = g^1.
+# The difference is a SHA256 hash of the group instead, see arithmetic_progression_diff, so finding two keys with known logs
+# and that difference is no easier than breaking the discrete log assumption in the group.
+ARITHMETIC_PROGRESSION_LABEL = b"garbled-circuits/elgamal-ot/arithmetic-progression-diff"
 
-# Creates a valid (pk, sk) pair. Also creates a fake public key pk2.
+# The 2048-bit MODP group of RFC 3526, section 3. OT_GROUP_P is a safe prime and OT_GROUP_G generates the subgroup of
+# order (OT_GROUP_P - 1) / 2.
+OT_GROUP_P = int(
+	"FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD"
+	"EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED"
+	"EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F"
+	"83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B"
+	"E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510"
+	"15728E5A8AACAA68FFFFFFFFFFFFFFFF", 16)
+OT_GROUP_G = 2
+
+# Length of the messages of bob_ot2, the length of the keys of a wire.
+OT_MESSAGE_LENGTH = 16
+
+# Returns the difference between the public keys b_0 and b_1 of the Elgamal OT in the group (p, g), a hash of p and g mod p.
+def arithmetic_progression_diff(p: int, g: int) -> int:
+	h = SHA256.new(ARITHMETIC_PROGRESSION_LABEL + int_to_bytes(p) + int_to_bytes(g))
+	return int.from_bytes(h.digest(), byteorder='big') % p
+
+# Creates a valid (pk, sk) pair in the fixed group. Also creates a fake public key pk2.
 # Returns ((b_0, b_1), sk), where (b_bit, sk) are the valid pair and (b_0, b_1) follow an arithmetic progression
 def bob_ot1(bit: bool) -> ((PublicKey, PublicKey), PrivateKey):
-	pk, sk = Elgamal.newkeys(128)
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="elgamal_keygen")
+	(p, g) = (OT_GROUP_P, OT_GROUP_G)
+	x = random.SystemRandom().randint(1, (p - 1) // 2 - 1)
+	pk = PublicKey(p, g, pow(g, x, p))
+	sk = PrivateKey(p, x)
 	pk2 = deepcopy(pk)
+	diff = arithmetic_progression_diff(p, g)
 	if bit:
-		pk2.y -= ARITHMETIC_PROGRESSION_DIFF
+		pk2.y = (pk.y - diff) % p
 		return ((pk2, pk), sk)
 	else:
-		pk2.y += ARITHMETIC_PROGRESSION_DIFF
+		pk2.y = (pk.y + diff) % p
 		return ((pk, pk2), sk)
 
 # Alice encrypts msg0 under public key b_0 and msg1 under b_1.
 def alice_ot1(b_0: PublicKey, b_1: PublicKey, msg0: bytes, msg1: bytes) -> (CipherText, CipherText):
-	if b_1.y != b_0.y + ARITHMETIC_PROGRESSION_DIFF:
-		raise ValueError('alice_ot1: bob_keys must be an arithmetic progression with diff = {}'.format(ARITHMETIC_PROGRESSION_DIFF))
+	for b in (b_0, b_1):
+		if b.p != OT_GROUP_P or b.g != OT_GROUP_G:
+			raise ValueError('alice_ot1: bob_keys must be in the group of OT_GROUP_P and OT_GROUP_G')
+		if not 0 < b.y < b.p:
+			raise ValueError('alice_ot1: bob_keys must be between 1 and p - 1, found {}'.format(b.y))
+	diff = arithmetic_progression_diff(b_0.p, b_0.g)
+	if (b_1.y - b_0.y) % b_0.p != diff:
+		raise ValueError('alice_ot1: bob_keys must be an arithmetic progression mod p with diff = {}'.format(diff))
 
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", 2, op="elgamal_encrypt")
 	ct_0 = Elgamal.encrypt(msg0, b_0)
 	ct_1 = Elgamal.encrypt(msg1, b_1)
 	return (ct_0, ct_1)
 
 # Bob uses the secret key it knows to decrypt the corresponding ciphertext.
-def bob_ot2(bit: bool, bob_sk: PrivateKey, alice_ct0: CipherText, alice_ct1: CipherText) -> bytes:
+# Elgamal decryption drops the leading zero bytes of the message, so it is padded back to length bytes.
+def bob_ot2(bit: bool, bob_sk: PrivateKey, alice_ct0: CipherText, alice_ct1: CipherText, length: int = OT_MESSAGE_LENGTH) -> bytes:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="elgamal_decrypt")
 	if bit:
-		return bytes(Elgamal.decrypt(alice_ct1, bob_sk))
+		return bytes(Elgamal.decrypt(alice_ct1, bob_sk)).rjust(length, b'\x00')
 	else:
-		return bytes(Elgamal.decrypt(alice_ct0, bob_sk))
+		return bytes(Elgamal.decrypt(alice_ct0, bob_sk)).rjust(length, b'\x00')
+
+# Returns the minimal big-endian bytes encoding of a non-negative integer.
+def int_to_bytes(val: int) -> bytes:
+	return val.to_bytes(max(1, (val.bit_length() + 7) // 8), byteorder='big')
+
+# Converts Bob's OT message (b_0, b_1) to a tuple of bytes objects. b_0 and b_1 share p and g.
+def public_keys_to_bytes(b_0: PublicKey, b_1: PublicKey) -> tuple:
+	return (int_to_bytes(b_0.p), int_to_bytes(b_0.g), int_to_bytes(b_0.y), int_to_bytes(b_1.y))
+
+# Inverse of public_keys_to_bytes.
+def public_keys_from_bytes(values: tuple) -> (PublicKey, PublicKey):
+	(p, g, y_0, y_1) = [int.from_bytes(value, byteorder='big') for value in values]
+	return (PublicKey(p, g, y_0), PublicKey(p, g, y_1))
+
+# Converts Alice's OT message (ct_0, ct_1) to a tuple of bytes objects, e.g. for write_keys_file in circuit_file.py.
+def ciphertexts_to_bytes(ct_0: CipherText, ct_1: CipherText) -> tuple:
+	return (int_to_bytes(ct_0.a), int_to_bytes(ct_0.b), int_to_bytes(ct_1.a), int_to_bytes(ct_1.b))
+
+# Inverse of ciphertexts_to_bytes.
+def ciphertexts_from_bytes(values: tuple) -> (CipherText, CipherText):
+	(a_0, b_0, a_1, b_1) = [int.from_bytes(value, byteorder='big') for value in values]
+	return (CipherText(a_0, b_0), CipherText(a_1, b_1))
+
+############################################################
+# Elliptic curve OT (Chou and Orlandi, "The Simplest Protocol for Oblivious Transfer"), over Ed25519.
+# A batch of OTs shares one sender key, so the sender pays one key generation for the whole batch instead of an
+# Elgamal key per OT:
+# - Alice samples a and sends A = aG.
+# - For OT j with choice bit c_j, Bob samples b_j and sends B_j = b_jG + c_jA. His key is H(j, A, B_j, b_jA).
+# - Alice sends y0_j = msg0_j XOR H(j, A, B_j, aB_j) and y1_j = msg1_j XOR H(j, A, B_j, aB_j - aA).
+#   Only the key of c_j equals Bob's key, and he cannot compute the other one without a.
+# G and A are multiplied by many scalars, so they use a fixed_base_table. Alice's aB_j has a new base for every OT.
+# H is SHAKE256, and the index j keeps counting across the batches of one sender key.
+# This is secure against semi-honest parties, like the Elgamal OT.
+############################################################
+
+# Order of the prime subgroup of Ed25519 and its generator G.
+ED25519_ORDER = 2**252 + 27742317777372353535851937790883648493
+ED25519_G = EccPoint(15112221349535400772501151409588531511454012693041857206046113283949847762202,
+	46316835694926478169428394003475163141307993866256225615783033603165251855960, curve='Ed25519')
+EC_POINT_BYTES = 32
+EC_OT_LABEL = b"garbled-circuits/ec-ot"
+
+# Precomputed multiples of a point P, which make P * k about 4 times faster for a 6 bit window.
+# rows[i][d] = d * 2^(window * i) * P, so P * k adds one point per window of k.
+class fixed_base_table:
+	def __init__(self, P: EccPoint, window: int = 6):
+		self.window = window
+		self.mask = (1 << window) - 1
+		self.identity = P.point_at_infinity()
+		self.rows = []
+		base = P.copy()
+		for _ in range((ED25519_ORDER.bit_length() + window - 1) // window):
+			row = [self.identity, base.copy()]
+			for _ in range(2, 1 << window):
+				row.append(row[-1] + base)
+			self.rows.append(row)
+			base = row[-1] + base
+
+	def multiply(self, k: int) -> EccPoint:
+		k %= ED25519_ORDER
+		acc = self.identity.copy()
+		i = 0
+		while k:
+			d = k & self.mask
+			if d:
+				acc += self.rows[i][d]
+			k >>= self.window
+			i += 1
+		return acc
+
+# The table of G is built on first use.
+ed25519_g_table = None
+
+def ed25519_multiply_g(k: int) -> EccPoint:
+	global ed25519_g_table
+	if ed25519_g_table is None:
+		ed25519_g_table = fixed_base_table(ED25519_G)
+	return ed25519_g_table.multiply(k)
+
+def ec_random_scalar() -> int:
+	return random.SystemRandom().randrange(1, ED25519_ORDER)
+
+# Encodes a point as x || y, 32 bytes each.
+def ec_point_to_bytes(P: EccPoint) -> bytes:
+	(x, y) = P.xy
+	return x.to_bytes(EC_POINT_BYTES, byteorder='big') + y.to_bytes(EC_POINT_BYTES, byteorder='big')
+
+# Inverse of ec_point_to_bytes. Raises ValueError if the point is not on the curve or is the identity.
+def ec_point_from_bytes(value: bytes) -> EccPoint:
+	if len(value) != 2 * EC_POINT_BYTES:
+		raise ValueError('ec_point_from_bytes: expected {} bytes, found {}'.format(2 * EC_POINT_BYTES, len(value)))
+	P = EccPoint(int.from_bytes(value[:EC_POINT_BYTES], byteorder='big'), int.from_bytes(value[EC_POINT_BYTES:], byteorder='big'), curve='Ed25519')
+	if P.is_point_at_infinity():
+		raise ValueError('ec_point_from_bytes: the identity is not a valid OT message')
+	return P
+
+# Computes H(j, A, B, P) truncated to length bytes, the hash used to mask the messages of EC OT j.
+def ec_ot_hash(j: int, A: bytes, B: bytes, P: EccPoint, length: int) -> bytes:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="shake256")
+	h = SHAKE256.new(EC_OT_LABEL + j.to_bytes(length=8, byteorder='big') + A + B + ec_point_to_bytes(P))
+	return h.read(length)
+
+# Alice's state: the secret key a, A = aG, -aA, and the number of OTs run with this key.
+class ec_ot_sender:
+	def __init__(self):
+		self.a = ec_random_scalar()
+		self.A = ed25519_multiply_g(self.a)
+		self.public_key = ec_point_to_bytes(self.A)
+		self.minus_aA = -(self.A * self.a)
+		self.num_ots = 0
+
+# Bob's state for Alice's public key A, with the table of A shared by all the batches.
+class ec_ot_receiver:
+	def __init__(self, public_key: bytes):
+		self.A = ec_point_from_bytes(public_key)
+		self.public_key = public_key
+		self.table = fixed_base_table(self.A)
+		self.num_ots = 0
+
+# Step 1 (Alice): samples the sender key. alice.public_key is sent to Bob, once for any number of batches.
+def alice_ec_ot_setup() -> ec_ot_sender:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="ec_keygen")
+	return ec_ot_sender()
+
+# Step 2 (Bob): computes B_j for the choice bits bits, one bit per OT of this batch.
+# Returns (bob_all_B, batch_state), where bob_all_B is sent to Alice and batch_state is kept by Bob for bob_ec_ot2.
+def bob_ec_ot1(receiver: ec_ot_receiver, bits: list):
+	bob_all_B = []
+	keys = []
+	for j, bit in enumerate(bits):
+		b = ec_random_scalar()
+		B = ed25519_multiply_g(b)
+		if bit:
+			B += receiver.A
+		B = ec_point_to_bytes(B)
+		bob_all_B.append(B)
+		keys.append((B, receiver.table.multiply(b)))
+	batch_state = (list(bits), keys, receiver.num_ots, receiver.public_key)
+	receiver.num_ots += len(bits)
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", 2 * len(bits), op="ec_multiply")
+		metrics.count("ots_total", len(bits), method="ec")
+	return (bob_all_B, batch_state)
+
+# Step 3 (Alice): masks the message pairs msgs[j] = (msg0_j, msg1_j) for Bob's points bob_all_B.
+# Returns the list of masked pairs, which is sent to Bob.
+def alice_ec_ot1(sender: ec_ot_sender, bob_all_B: list, msgs: list) -> list:
+	if len(bob_all_B) != len(msgs):
+		raise ValueError('alice_ec_ot1: expected {} points, found {}'.format(len(msgs), len(bob_all_B)))
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", len(msgs), op="ec_multiply")
+	alice_all_ct = []
+	for j, (B, (msg0, msg1)) in enumerate(zip(bob_all_B, msgs)):
+		index = sender.num_ots + j
+		aB = ec_point_from_bytes(B) * sender.a
+		y_0 = bytes(x ^ k for (x, k) in zip(msg0, ec_ot_hash(index, sender.public_key, B, aB, len(msg0))))
+		y_1 = bytes(x ^ k for (x, k) in zip(msg1, ec_ot_hash(index, sender.public_key, B, aB + sender.minus_aA, len(msg1))))
+		alice_all_ct.append((y_0, y_1))
+	sender.num_ots += len(msgs)
+	return alice_all_ct
+
+# Step 4 (Bob): unmasks the message selected by each choice bit.
+# Returns the list of messages msg{c_j}_j.
+def bob_ec_ot2(batch_state, alice_all_ct: list) -> list:
+	(bits, keys, first_ot, public_key) = batch_state
+	msgs = []
+	for j, (bit, (B, bA), (y_0, y_1)) in enumerate(zip(bits, keys, alice_all_ct)):
+		y = y_1 if bit else y_0
+		msgs.append(bytes(x ^ k for (x, k) in zip(y, ec_ot_hash(first_ot + j, public_key, B, bA, len(y)))))
+	return msgs
+
+############################################################
+# OT extension (Ishai, Kilian, Nissim and Petrank, "Extending Oblivious Transfers Efficiently").
+# Alice and Bob run OT_EXTENSION_KAPPA base OTs once, with their roles reversed:
+# Bob sends a pair of random seeds (k0_i, k1_i) and Alice picks k{s_i}_i for a random string s of OT_EXTENSION_KAPPA bits.
+# The base OTs are one batch of EC OTs, so Bob, their sender, starts the setup with his public key.
+# After that, any number of OTs from Alice to Bob costs only PRG and hash evaluations:
+# - Bob, with choice bits r, expands t_i = G(k0_i) and sends u_i = t_i XOR G(k1_i) XOR r for every i.
+# - Alice computes q_i = G(k{s_i}_i) XOR s_i * u_i = t_i XOR s_i * r. Row j of the matrix (q_i)_i is q_j = t_j XOR r_j * s,
+#   so she sends y0_j = msg0_j XOR H(j, q_j) and y1_j = msg1_j XOR H(j, q_j XOR s).
+# - Bob recovers msg{r_j}_j = y{r_j}_j XOR H(j, t_j), and learns nothing about the other message since he does not know s.
+# G is AES-CTR keyed with a seed, and a counter of extension batches keeps G and H fresh across batches.
+# This is secure against semi-honest parties, like the base OT.
+############################################################
+
+# Number of base OTs, which is the computational security parameter of OT extension.
+OT_EXTENSION_KAPPA = 128
 
+# Alice's state after the base OTs. s is an int of kappa bits and seeds[i] = k{s_i}_i.
+class ot_extension_sender:
+	def __init__(self, s: int, seeds: list):
+		self.kappa = len(seeds)
+		self.s = s
+		self.seeds = seeds
+		self.counter = 0
+		self.num_ots = 0
+
+# Bob's state after the base OTs. seeds[b][i] = kb_i.
+class ot_extension_receiver:
+	def __init__(self, seeds: dict):
+		self.kappa = len(seeds[0])
+		self.seeds = seeds
+		self.counter = 0
+		self.num_ots = 0
+
+# Expands seed to an int of num_bits bits with AES-CTR, using counter as the nonce.
+def prg(seed: bytes, counter: int, num_bits: int) -> int:
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="aes_ctr")
+	cipher = AES.new(seed, AES.MODE_CTR, nonce=counter.to_bytes(length=8, byteorder='big'))
+	stream = cipher.encrypt(bytes((num_bits + 7) // 8))
+	return int.from_bytes(stream, byteorder='big') & ((1 << num_bits) - 1)
+
+# Computes H(j, q) = SHA256(j || q) truncated to length bytes, the hash used to mask the messages of OT j.
+def ot_ext_hash(j: int, q: int, kappa: int, length: int) -> bytes:
+	if length > 32:
+		raise ValueError('ot_ext_hash: messages must be at most 32 bytes, found {}'.format(length))
+	if metrics.enabled:
+		metrics.count("crypto_ops_total", op="sha256")
+	h = SHA256.new(j.to_bytes(length=8, byteorder='big') + q.to_bytes(length=(kappa + 7) // 8, byteorder='big'))
+	return h.digest()[:length]
+
+# Returns the rows of the bit matrix whose columns are the ints columns[i] of num_rows bits,
+# i.e. bit i of row j is bit j of columns[i].
+def transpose_bits(columns: list, num_rows: int) -> list:
+	rows = [0] * num_rows
+	for i, column in enumerate(columns):
+		bit = 1 << i
+		j = 0
+		while column:
+			if column & 1:
+				rows[j] |= bit
+			column >>= 1
+			j += 1
+	return rows
+
+# Setup, step 1 (Bob): samples the key of the base OTs. In the base OTs Bob is the sender, so he runs alice_ec_ot_setup.
+# Returns (bob_public_key, setup_state), where bob_public_key is sent to Alice and setup_state is kept by Bob.
+def bob_ot_ext_setup1():
+	sender = alice_ec_ot_setup()
+	return (sender.public_key, sender)
+
+# Setup, step 2 (Alice): samples s and sends Bob the message of a base OT for each bit of s.
+# In the base OTs Alice is the receiver, so she runs bob_ec_ot1.
+# Returns (alice_all_B, setup_state), where alice_all_B is sent to Bob and setup_state is kept by Alice.
+def alice_ot_ext_setup1(bob_public_key: bytes, kappa: int = OT_EXTENSION_KAPPA):
+	s_bits = [random.SystemRandom().getrandbits(1) == 1 for _ in range(kappa)]
+	(alice_all_B, batch_state) = bob_ec_ot1(ec_ot_receiver(bob_public_key), s_bits)
+	return (alice_all_B, (s_bits, batch_state))
+
+# Setup, step 3 (Bob): samples the seed pairs and masks them for Alice's base OT messages.
+# Returns (bob_all_ct, receiver), where bob_all_ct is sent to Alice and receiver is kept by Bob.
+def bob_ot_ext_setup(setup_state: ec_ot_sender, alice_all_B: list):
+	seeds = {0: [], 1: []}
+	for _ in alice_all_B:
+		seeds[0].append(os.urandom(16))
+		seeds[1].append(os.urandom(16))
+	bob_all_ct = alice_ec_ot1(setup_state, alice_all_B, list(zip(seeds[0], seeds[1])))
+	return (bob_all_ct, ot_extension_receiver(seeds))
+
+# Setup, step 4 (Alice): unmasks the seeds k{s_i}_i.
+# Returns Alice's ot_extension_sender.
+def alice_ot_ext_setup2(setup_state, bob_all_ct: list) -> ot_extension_sender:
+	(s_bits, batch_state) = setup_state
+	if len(bob_all_ct) != len(s_bits):
+		raise ValueError('alice_ot_ext_setup2: expected {} seed pairs, found {}'.format(len(s_bits), len(bob_all_ct)))
+	s = 0
+	for i, bit in enumerate(s_bits):
+		if bit:
+			s |= 1 << i
+	return ot_extension_sender(s, bob_ec_ot2(batch_state, bob_all_ct))
+
+# Extension, step 1 (Bob): computes the columns u_i for the choice bits bits, one bit per OT of this batch.
+# Returns (u, batch_state), where u is sent to Alice and batch_state is kept by Bob for bob_ot_ext2.
+def bob_ot_ext1(receiver: ot_extension_receiver, bits: list):
+	m = len(bits)
+	r = 0
+	for j, bit in enumerate(bits):
+		if bit:
+			r |= 1 << j
+	t = []
+	u = []
+	for i in range(receiver.kappa):
+		t_i = prg(receiver.seeds[0][i], receiver.counter, m)
+		t.append(t_i)
+		u.append(t_i ^ prg(receiver.seeds[1][i], receiver.counter, m) ^ r)
+	batch_state = (list(bits), transpose_bits(t, m), receiver.num_ots, receiver.kappa)
+	receiver.counter += 1
+	receiver.num_ots += m
+	if metrics.enabled:
+		metrics.count("ots_total", m, method="extension")
+	return (u, batch_state)
+
+# Extension, step 2 (Alice): masks the message pairs msgs[j] = (msg0_j, msg1_j) for Bob's columns u.
+# Returns the list of masked pairs, which is sent to Bob.
+def alice_ot_ext1(sender: ot_extension_sender, u: list, msgs: list) -> list:
+	m = len(msgs)
+	if len(u) != sender.kappa:
+		raise ValueError('alice_ot_ext1: expected {} columns, found {}'.format(sender.kappa, len(u)))
+	q = []
+	for i in range(sender.kappa):
+		q_i = prg(sender.seeds[i], sender.counter, m)
+		if (sender.s >> i) & 1:
+			q_i ^= u[i]
+		q.append(q_i)
+	rows = transpose_bits(q, m)
+	alice_all_ct = []
+	for j, ((msg0, msg1), q_j) in enumerate(zip(msgs, rows)):
+		index = sender.num_ots + j
+		y_0 = bytes(a ^ b for (a, b) in zip(msg0, ot_ext_hash(index, q_j, sender.kappa, len(msg0))))
+		y_1 = bytes(a ^ b for (a, b) in zip(msg1, ot_ext_hash(index, q_j ^ sender.s, sender.kappa, len(msg1))))
+		alice_all_ct.append((y_0, y_1))
+	sender.counter += 1
+	sender.num_ots += m
+	return alice_all_ct
+
+# Extension, step 3 (Bob): unmasks the message selected by each choice bit.
+# Returns the list of messages msg{r_j}_j.
+def bob_ot_ext2(batch_state, alice_all_ct: list) -> list:
+	(bits, t_rows, first_ot, kappa) = batch_state
+	msgs = []
+	for j, (bit, t_j, (y_0, y_1)) in enumerate(zip(bits, t_rows, alice_all_ct)):
+		y = y_1 if bit else y_0
+		msgs.append(bytes(a ^ b for (a, b) in zip(y, ot_ext_hash(first_ot + j, t_j, kappa, len(y)))))
+	return msgs
 
 def test_elgamal():
 	pk, sk = Elgamal.newkeys(128)
@@ -64,7 +437,7 @@ def test_ot():
 	for bob_bit in bob_bits:
 		((b_0, b_1), bob_sk) = bob_ot1(bob_bit)
 		(ct_0, ct_1) = alice_ot1(b_0, b_1, msg0, msg1)
-		msg = bob_ot2(bob_bit, bob_sk, ct_0, ct_1)
+		msg = bob_ot2(bob_bit, bob_sk, ct_0, ct_1, len(msg0))
 		if bob_bit:
 			if msg != msg1:
 				print("Oblivious Transfer: Correctness with bob_bit = {}: FAILED, expected message: {}, found: {}".format(bob_bit, msg1, msg))
@@ -73,6 +446,137 @@ def test_ot():
 				print("Oblivious Transfer: Correctness with bob_bit = {}: FAILED, expected message: {}, found: {}".format(bob_bit, msg0, msg))
 		print("Oblivious Transfer: Correctness with bob_bit = {}: PASSED".format(bob_bit))
 
+# Keys of a wire may start with zero bytes, which Elgamal decryption drops. Bob must still get all 16 bytes.
+def test_ot_leading_zero():
+	msg0 = b'\x00' + os.urandom(OT_MESSAGE_LENGTH - 1)
+	msg1 = b'\x00\x00' + os.urandom(OT_MESSAGE_LENGTH - 2)
+	for bob_bit in (True, False):
+		((b_0, b_1), bob_sk) = bob_ot1(bob_bit)
+		(ct_0, ct_1) = alice_ot1(b_0, b_1, msg0, msg1)
+		msg = bob_ot2(bob_bit, bob_sk, ct_0, ct_1)
+		if msg == (msg1 if bob_bit else msg0):
+			print("Oblivious Transfer: Leading zero bytes with bob_bit = {}: PASSED".format(bob_bit))
+		else:
+			print("Oblivious Transfer: Leading zero bytes with bob_bit = {}: FAILED, found: {}".format(bob_bit, msg))
+
+# Bob must not be able to pick the fake public key: alice_ot1 only accepts keys with the diff derived from p.
+def test_ot_progression():
+	((b_0, b_1), _) = bob_ot1(False)
+	diff = arithmetic_progression_diff(b_0.p, b_0.g)
+	weak = PublicKey(b_0.p, b_0.g, (b_0.y + 1) % b_0.p)
+	try:
+		alice_ot1(b_0, weak, b"message_0", b"message_1")
+		rejected = False
+	except ValueError:
+		rejected = True
+	if rejected and diff > 1 and (b_1.y - b_0.y) % b_0.p == diff:
+		print("Oblivious Transfer: Arithmetic progression: PASSED")
+	else:
+		print("Oblivious Transfer: Arithmetic progression: FAILED")
+
+	# Bob must not be able to pick the group either: with g = 1 + diff, he knows the logs 0 of b_0 = 1 and 1 of b_1 = g.
+	p = b_0.p - 2
+	g = 1 + arithmetic_progression_diff(p, b_0.g)
+	try:
+		alice_ot1(PublicKey(p, g, 1), PublicKey(p, g, g), b"message_0", b"message_1")
+		rejected = False
+	except ValueError:
+		rejected = True
+	if rejected:
+		print("Oblivious Transfer: Fixed group: PASSED")
+	else:
+		print("Oblivious Transfer: Fixed group: FAILED")
+
+def test_ec_ot():
+	table = fixed_base_table(ED25519_G)
+	k = ec_random_scalar()
+	if table.multiply(k) == ED25519_G * k and table.multiply(0).is_point_at_infinity():
+		print("EC OT: Fixed-base table: PASSED")
+	else:
+		print("EC OT: Fixed-base table: FAILED")
+
+	sender = alice_ec_ot_setup()
+	receiver = ec_ot_receiver(sender.public_key)
+	passed = True
+	# Several batches share one sender key.
+	for m in (1, 10, 100):
+		msgs = [(os.urandom(16), os.urandom(16)) for _ in range(m)]
+		bits = [random.getrandbits(1) == 1 for _ in range(m)]
+		(bob_all_B, batch_state) = bob_ec_ot1(receiver, bits)
+		alice_all_ct = alice_ec_ot1(sender, bob_all_B, msgs)
+		received = bob_ec_ot2(batch_state, alice_all_ct)
+		for (bit, (msg0, msg1), msg) in zip(bits, msgs, received):
+			if msg != (msg1 if bit else msg0):
+				passed = False
+	if passed and sender.num_ots == receiver.num_ots == 111:
+		print("EC OT: Correctness: PASSED")
+	else:
+		print("EC OT: Correctness: FAILED")
+
+	invalid = bytearray(bob_all_B[0])
+	invalid[-1] ^= 1
+	try:
+		alice_ec_ot1(sender, [bytes(invalid)], [(b"message_0", b"message_1")])
+		print("EC OT: Invalid point: FAILED")
+	except ValueError:
+		print("EC OT: Invalid point: PASSED")
+
+# Correctness of OT extension does not depend on kappa, its security does.
+def test_ot_extension(kappa=OT_EXTENSION_KAPPA):
+	(bob_public_key, bob_setup_state) = bob_ot_ext_setup1()
+	(alice_all_B, setup_state) = alice_ot_ext_setup1(bob_public_key, kappa)
+	(bob_all_ct, receiver) = bob_ot_ext_setup(bob_setup_state, alice_all_B)
+	sender = alice_ot_ext_setup2(setup_state, bob_all_ct)
+
+	passed = True
+	for m in (1, 10, 300):
+		msgs = [(os.urandom(16), os.urandom(16)) for _ in range(m)]
+		bits = [random.getrandbits(1) == 1 for _ in range(m)]
+		(u, batch_state) = bob_ot_ext1(receiver, bits)
+		alice_all_ct = alice_ot_ext1(sender, u, msgs)
+		received = bob_ot_ext2(batch_state, alice_all_ct)
+		for (bit, (msg0, msg1), msg) in zip(bits, msgs, received):
+			if msg != (msg1 if bit else msg0):
+				passed = False
+	if passed:
+		print("OT Extension: Correctness with kappa = {}: PASSED".format(kappa))
+	else:
+		print("OT Extension: Correctness with kappa = {}: FAILED".format(kappa))
+
+# Reports OTs per second of the Elgamal OT and of batches of num_ots EC OTs with one sender key.
+# An Elgamal OT takes hundreds of milliseconds, so only elgamal_ots of them are timed.
+def benchmark_ot(num_ots=1000, elgamal_ots=10):
+	st = time.perf_counter()
+	for _ in range(elgamal_ots):
+		bit = random.getrandbits(1) == 1
+		((b_0, b_1), bob_sk) = bob_ot1(bit)
+		(ct_0, ct_1) = alice_ot1(b_0, b_1, os.urandom(16), os.urandom(16))
+		bob_ot2(bit, bob_sk, ct_0, ct_1)
+	elgamal_time = time.perf_counter() - st
+	print("Elgamal OT: {:.2f} OTs/s".format(elgamal_ots / elgamal_time))
+
+	ed25519_multiply_g(1)
+	msgs = [(os.urandom(16), os.urandom(16)) for _ in range(num_ots)]
+	bits = [random.getrandbits(1) == 1 for _ in range(num_ots)]
+	st = time.perf_counter()
+	sender = alice_ec_ot_setup()
+	receiver = ec_ot_receiver(sender.public_key)
+	setup_et = time.perf_counter()
+	(bob_all_B, batch_state) = bob_ec_ot1(receiver, bits)
+	bob_et = time.perf_counter()
+	alice_all_ct = alice_ec_ot1(sender, bob_all_B, msgs)
+	alice_et = time.perf_counter()
+	bob_ec_ot2(batch_state, alice_all_ct)
+	et = time.perf_counter()
+	print("EC OT, {} OTs: setup {:.1f} ms, bob_ec_ot1 {:.0f} us/OT, alice_ec_ot1 {:.0f} us/OT, bob_ec_ot2 {:.0f} us/OT, {:.0f} OTs/s".format(
+		num_ots, (setup_et - st) * 1e3, (bob_et - setup_et) / num_ots * 1e6, (alice_et - bob_et) / num_ots * 1e6,
+		(et - alice_et) / num_ots * 1e6, num_ots / (et - st)))
+
 if __name__ == '__main__':
 	# test_elgamal()
-	test_ot()
\ No newline at end of file
+	test_ot()
+	test_ot_leading_zero()
+	test_ot_progression()
+	test_ec_ot()
+	test_ot_extension()
+	# benchmark_ot()
\ No newline at end of file
@@ -0,0 +1,362 @@
+############################################################
+#### Description:
+# Optimization pass over circuit descriptions (see circuit.py), minimizing the number of gates that need a garbled
+# table. With Free-XOR, XOR and EQ (XNOR) gates are free and every other gate costs a table.
+# The circuit is rewritten into XOR / AND form: every gate becomes an XOR or an AND of literals, where a literal is a
+# node or its negation, so NOT is free and folds into the gates reading it. On the way:
+# - Constant folding: the garbler's input bits given in x_constants are constants, and so is x XOR x, x AND NOT x, ...
+# - Common subexpressions are merged: nodes are hash-consed on (kind, literals), with the literals of XOR and AND sorted,
+#   and the fan-out wires of an input bit are merged into a single wire.
+# - MAJ rewriting: P OR (E AND c), where P = A AND B and E = A XOR B, is MAJ(A, B, c) = c XOR ((A XOR c) AND (B XOR c)),
+#   1 AND gate instead of 3 when P and E AND c are not read elsewhere. This is the carry of an adder, and it turns
+#   the n bit comparator of comparator_circuit from 3n - 2 tables into n, the known optimum.
+# - Dead gates, which no output depends on, are removed.
+# The result is emitted with the gate names of GATE_TRUTH_TABLES: AND-type gates with negated inputs map to GT, GEQ,
+# OR, ... with swapped inputs if needed, and gates reading a negated XOR use EQ instead.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from circuit import circuit, comparator_circuit
+from garbled_gate import GATE_TRUTH_TABLES, FREE_XOR_GATES, get_and_type_masks, one_bytes
+
+import copy
+
+# Node kinds. Node 0 is the constant 0, so literal 0 is false and literal 1 is true.
+NODE_CONSTANT = 0
+NODE_INPUT = 1
+NODE_XOR = 2
+NODE_AND = 3
+
+FALSE = 0
+TRUE = 1
+
+# Maps (alpha_left, alpha_right) to (gate_name, swap, alpha_out) for an AND-type gate computing
+# ((a XOR alpha_left) AND (b XOR alpha_right)) XOR alpha_out, where swap tells to pass b as the left input.
+# See get_and_type_masks in garbled_gate.py. Gates with alpha_out = 0 are preferred.
+def get_and_type_gates() -> dict:
+	gates = {}
+	for gate_name in sorted(GATE_TRUTH_TABLES):
+		if gate_name in FREE_XOR_GATES:
+			continue
+		(alpha_left, alpha_right, alpha_out) = get_and_type_masks(GATE_TRUTH_TABLES[gate_name](True))
+		for (masks, swap) in (((alpha_left, alpha_right), False), ((alpha_right, alpha_left), True)):
+			if masks not in gates or gates[masks][2] > alpha_out:
+				gates[masks] = (gate_name, swap, alpha_out)
+	return gates
+
+AND_TYPE_GATES = get_and_type_gates()
+
+# Circuit in XOR / AND form. A literal is 2 * node + negated.
+# nodes[k] is (kind, left literal, right literal), and (NODE_INPUT, side, bit) for the input bit of side 'x' or 'y'.
+class xor_and_graph:
+	def __init__(self):
+		self.nodes = [(NODE_CONSTANT, 0, 0)]
+		self.table = {}
+
+	def add_node(self, key) -> int:
+		if key not in self.table:
+			self.table[key] = len(self.nodes)
+			self.nodes.append(key)
+		return 2 * self.table[key]
+
+	def input(self, side: str, bit: int) -> int:
+		return self.add_node((NODE_INPUT, side, bit))
+
+	# Returns the literal of a XOR b without adding a node, or None if it is not in the graph.
+	def find_xor(self, a: int, b: int):
+		(key, negated) = self.xor_key(a, b)
+		if isinstance(key, int):
+			return key ^ negated
+		node = self.table.get(key)
+		return None if node is None else 2 * node ^ negated
+
+	# Returns (key, negated), where key is the node key of a XOR b, or a literal if it folds to one.
+	def xor_key(self, a: int, b: int):
+		negated = (a ^ b) & 1
+		(a, b) = sorted((a & ~1, b & ~1))
+		if a == b:
+			return (FALSE, negated)
+		if a == FALSE:
+			return (b, negated)
+		return ((NODE_XOR, a, b), negated)
+
+	def xor(self, a: int, b: int) -> int:
+		(key, negated) = self.xor_key(a, b)
+		if isinstance(key, int):
+			return key ^ negated
+		return self.add_node(key) ^ negated
+
+	def and_(self, a: int, b: int) -> int:
+		(a, b) = sorted((a, b))
+		if a == FALSE:
+			return FALSE
+		if a == TRUE:
+			return b
+		if a == b:
+			return a
+		if a ^ 1 == b:
+			return FALSE
+		return self.add_node((NODE_AND, a, b))
+
+	# Returns the literal of gate_name(a, b), for a gate of GATE_TRUTH_TABLES.
+	def gate(self, gate_name: str, a: int, b: int) -> int:
+		if gate_name in FREE_XOR_GATES:
+			return self.xor(a, b) ^ FREE_XOR_GATES[gate_name]
+		(alpha_left, alpha_right, alpha_out) = get_and_type_masks(GATE_TRUTH_TABLES[gate_name](True))
+		return self.and_(a ^ alpha_left, b ^ alpha_right) ^ alpha_out
+
+	# Returns the number of literals reading each node, counting the literals in outputs.
+	# If live is given, only the nodes with live[node] = True are counted as readers.
+	def get_uses(self, outputs: list, live: list = None) -> list:
+		uses = [0] * len(self.nodes)
+		for node, (kind, a, b) in enumerate(self.nodes):
+			if (kind == NODE_XOR or kind == NODE_AND) and (live is None or live[node]):
+				uses[a >> 1] += 1
+				uses[b >> 1] += 1
+		for literal in outputs:
+			uses[literal >> 1] += 1
+		return uses
+
+# Returns (graph, outputs), the XOR / AND form of circ, with the input bits x_constants[i] of x set to constants.
+def to_graph(circ: circuit, x_constants: dict = {}):
+	graph = xor_and_graph()
+	literals = {}
+	for (side, input_wires) in (("x", circ.x_wires), ("y", circ.y_wires)):
+		for i, wires in input_wires.items():
+			if side == "x" and i in x_constants:
+				literal = TRUE if x_constants[i] else FALSE
+			else:
+				literal = graph.input(side, i)
+			for wire in wires:
+				literals[wire] = literal
+	for (gate_name, left_wire, right_wire, out_wire) in circ.gates:
+		literals[out_wire] = graph.gate(gate_name, literals[left_wire], literals[right_wire])
+	return (graph, [literals[wire] for wire in circ.output_wires])
+
+# If the node of literal (a negated AND) is NOT P AND NOT Q with P = A AND B, Q = E AND c and E = A XOR B,
+# where P and Q have no other use, returns (A, B, c), so that the node is NOT MAJ(A, B, c). Otherwise returns None.
+def match_majority(graph: xor_and_graph, uses: list, node: int):
+	(kind, left, right) = graph.nodes[node]
+	if kind != NODE_AND or not (left & 1 and right & 1):
+		return None
+	for (p, q) in ((left >> 1, right >> 1), (right >> 1, left >> 1)):
+		if graph.nodes[p][0] != NODE_AND or graph.nodes[q][0] != NODE_AND or uses[p] != 1 or uses[q] != 1:
+			continue
+		(_, A, B) = graph.nodes[p]
+		E = graph.find_xor(A, B)
+		(_, q_left, q_right) = graph.nodes[q]
+		if q_left == E:
+			return (A, B, q_right)
+		if q_right == E:
+			return (A, B, q_left)
+	return None
+
+# Rebuilds graph into a new graph with the MAJ rewriting. Returns (new graph, new outputs).
+def rewrite_majority(graph: xor_and_graph, outputs: list):
+	uses = graph.get_uses(outputs)
+	new_graph = xor_and_graph()
+	mapped = [FALSE] * len(graph.nodes)
+	def literal(old: int) -> int:
+		return mapped[old >> 1] ^ (old & 1)
+	for node, (kind, a, b) in enumerate(graph.nodes):
+		if kind == NODE_INPUT:
+			mapped[node] = new_graph.input(a, b)
+		elif kind == NODE_XOR:
+			mapped[node] = new_graph.xor(literal(a), literal(b))
+		elif kind == NODE_AND:
+			match = match_majority(graph, uses, node)
+			if match is None:
+				mapped[node] = new_graph.and_(literal(a), literal(b))
+			else:
+				(A, B, c) = (literal(v) for v in match)
+				conj = new_graph.and_(new_graph.xor(A, c), new_graph.xor(B, c))
+				mapped[node] = new_graph.xor(conj, c) ^ 1
+	return (new_graph, [literal(v) for v in outputs])
+
+# Returns the circuit of graph and outputs, with the input bits and the attributes of circ.
+# Each input bit has a single wire, and gates no output depends on are dropped.
+def from_graph(circ: circuit, graph: xor_and_graph, outputs: list) -> circuit:
+	live = [False] * len(graph.nodes)
+	for literal in outputs:
+		live[literal >> 1] = True
+	for node in reversed(range(len(graph.nodes))):
+		(kind, a, b) = graph.nodes[node]
+		if live[node] and (kind == NODE_XOR or kind == NODE_AND):
+			live[a >> 1] = True
+			live[b >> 1] = True
+	uses = graph.get_uses(outputs, live)
+
+	result = copy.copy(circ)
+	result.num_wires = 0
+	result.gates = []
+	result.x_wires = {}
+	result.y_wires = {}
+	# wires[node] = (wire, inverted), where wire carries the value of node XOR inverted.
+	wires = {}
+	for (side, input_wires, new_input_wires) in (("x", circ.x_wires, result.x_wires), ("y", circ.y_wires, result.y_wires)):
+		for i in input_wires:
+			new_input_wires[i] = [result.new_wire()]
+			node = graph.table.get((NODE_INPUT, side, i))
+			if node is not None:
+				wires[node] = (new_input_wires[i][0], 0)
+	any_wire = next((wires[0] for wires in list(result.x_wires.values()) + list(result.y_wires.values())), None)
+
+	# Nodes read only by a single output are emitted directly with the polarity of the output if possible.
+	output_literals = {literal >> 1: literal & 1 for literal in outputs if uses[literal >> 1] == 1}
+	output_wires = {}
+	for node, (kind, a, b) in enumerate(graph.nodes):
+		if not live[node] or kind == NODE_CONSTANT or kind == NODE_INPUT:
+			continue
+		(left_wire, left_inverted) = wires[a >> 1]
+		(right_wire, right_inverted) = wires[b >> 1]
+		alpha_left = (a & 1) ^ left_inverted
+		alpha_right = (b & 1) ^ right_inverted
+		wanted = output_literals.get(node, 0)
+		if kind == NODE_XOR:
+			# XOR(left, right) = node XOR alpha_left XOR alpha_right, and EQ is its negation.
+			inverted = alpha_left ^ alpha_right
+			gate_name = "EQ" if inverted ^ wanted else "XOR"
+			out_wire = result.add_gate(gate_name, left_wire, right_wire)
+			wires[node] = (out_wire, wanted)
+		else:
+			(gate_name, swap, alpha_out) = AND_TYPE_GATES[(alpha_left, alpha_right)]
+			if swap:
+				(left_wire, right_wire) = (right_wire, left_wire)
+			out_wire = result.add_gate(gate_name, left_wire, right_wire)
+			wires[node] = (out_wire, alpha_out)
+		if node in output_literals and wires[node][1] == wanted:
+			output_wires[node] = out_wire
+
+	# Outputs that are inputs, constants, read by other gates or of the wrong polarity get a copy gate.
+	zero_wire = None
+	result.output_wires = []
+	for literal in outputs:
+		node = literal >> 1
+		if node in output_wires:
+			result.output_wires.append(output_wires.pop(node))
+		elif node == 0:
+			result.output_wires.append(result.add_gate("EQ" if literal & 1 else "XOR", any_wire, any_wire))
+		else:
+			if zero_wire is None:
+				zero_wire = result.add_gate("XOR", any_wire, any_wire)
+			(wire, inverted) = wires[node]
+			result.output_wires.append(result.add_gate("EQ" if (literal & 1) ^ inverted else "XOR", wire, zero_wire))
+	return result
+
+# Returns the optimized version of circ, see the description at the top of this file.
+# x_constants maps input bits of the garbler that are constants, such as the zero wire of a Bristol circuit,
+# to their value. The input bits of the result are the same as the ones of circ, with one wire each.
+def optimize_circuit(circ: circuit, x_constants: dict = {}) -> circuit:
+	(graph, outputs) = to_graph(circ, x_constants)
+	(graph, outputs) = rewrite_majority(graph, outputs)
+	return from_graph(circ, graph, outputs)
+
+# Returns the number of gates of circ that need a garbled table with Free-XOR.
+def count_non_free_gates(circ: circuit) -> int:
+	return sum(num_gates for (gate_name, num_gates) in circ.gate_counts().items() if gate_name not in FREE_XOR_GATES)
+
+# Returns a report of the gate counts of circ before and after optimization, one line per gate name.
+def optimization_report(before: circuit, after: circuit) -> str:
+	counts_before = before.gate_counts()
+	counts_after = after.gate_counts()
+	lines = ["{:<10} {:>10} {:>10}".format("gate", "before", "after")]
+	for gate_name in sorted(set(counts_before) | set(counts_after)):
+		lines.append("{:<10} {:>10} {:>10}".format(gate_name, counts_before.get(gate_name, 0), counts_after.get(gate_name, 0)))
+	lines.append("{:<10} {:>10} {:>10}".format("total", len(before.gates), len(after.gates)))
+	lines.append("{:<10} {:>10} {:>10}".format("non-free", count_non_free_gates(before), count_non_free_gates(after)))
+	return "\n".join(lines)
+
+# Comparator for x >= y with num_bits AND-type gates, see comparator_circuit.
+def optimized_comparator_circuit(num_bits: int) -> circuit:
+	return optimize_circuit(comparator_circuit(num_bits))
+
+# Evaluates circ on plain bits, where x_bits[i] (resp. y_bits[i]) is input bit i of x (resp. y).
+# Returns the list of output bits.
+def evaluate_plain(circ: circuit, x_bits: list, y_bits: list) -> list:
+	values = {}
+	for (input_wires, bits) in ((circ.x_wires, x_bits), (circ.y_wires, y_bits)):
+		for i, wires in input_wires.items():
+			for wire in wires:
+				values[wire] = bits[i]
+	for (gate_name, left_wire, right_wire, out_wire) in circ.gates:
+		values[out_wire] = int(GATE_TRUTH_TABLES[gate_name](True)[values[left_wire]][values[right_wire]] == one_bytes)
+	return [values[wire] for wire in circ.output_wires]
+
+def test_optimizer():
+	from alice_and_bob import garble_circuit, get_alice_keys, bit_decomposition, evaluate_circuit
+	from bristol import parse_bristol, compile_bristol, adder_bristol_fashion, garbler_bits, evaluator_bits, bits_to_value
+	import random
+
+	for num_bits in (1, 2, 3, 8, 32):
+		circ = comparator_circuit(num_bits)
+		optimized = optimize_circuit(circ)
+		passed = count_non_free_gates(optimized) == num_bits
+		for _ in range(50):
+			(x, y) = (random.getrandbits(num_bits), random.getrandbits(num_bits))
+			if evaluate_plain(optimized, bit_decomposition(x, num_bits), bit_decomposition(y, num_bits)) != [int(x >= y)]:
+				passed = False
+		if passed:
+			print("Optimizer: Comparator with {} bits has {} non-free gates: PASSED".format(num_bits, count_non_free_gates(optimized)))
+		else:
+			print("Optimizer: Comparator with {} bits has {} non-free gates: FAILED".format(num_bits, count_non_free_gates(optimized)))
+
+	# The optimized comparator garbles and evaluates like the original one.
+	num_bits = 16
+	optimized = optimized_comparator_circuit(num_bits)
+	passed = True
+	for options in ({}, {"free_xor": True, "point_and_permute": True}, {"half_gates": True, "fixed_key": True}):
+		(garbled_circuit, x_keys, y_keys) = garble_circuit(optimized, **options)
+		for _ in range(5):
+			(x, y) = (random.getrandbits(num_bits), random.getrandbits(num_bits))
+			alice_keys = get_alice_keys(x_keys, *bit_decomposition(x, num_bits))
+			bob_keys = get_alice_keys(y_keys, *bit_decomposition(y, num_bits))
+			(val_out,) = evaluate_circuit(optimized, garbled_circuit, alice_keys, bob_keys)
+			if (int.from_bytes(val_out, byteorder='big') != 0) != (x >= y):
+				passed = False
+	if passed:
+		print("Optimizer: Garbled optimized comparator: PASSED")
+	else:
+		print("Optimizer: Garbled optimized comparator: FAILED")
+
+	# Dead gates, duplicates, constants and fan-out.
+	circ = circuit()
+	(x0, x1) = (circ.new_wire(), circ.new_wire())
+	(y0, y1) = (circ.new_wire(), circ.new_wire())
+	circ.x_wires = {0: [x0, x1]}
+	circ.y_wires = {0: [y0], 1: [y1]}
+	a = circ.add_gate("AND", x0, y0)
+	b = circ.add_gate("AND", y0, x1)
+	circ.add_gate("OR", a, y1)
+	c = circ.add_gate("XOR", a, b)
+	d = circ.add_gate("OR", c, y1)
+	circ.output_wires = [b, d]
+	optimized = optimize_circuit(circ)
+	# b and a are the same AND, c = a XOR b = 0, the first OR is dead and d = y1 is copied with XOR(y1, zero).
+	passed = optimized.gate_counts() == {"AND": 1, "XOR": 2}
+	for (x, y_0, y_1) in ((x, y_0, y_1) for x in range(2) for y_0 in range(2) for y_1 in range(2)):
+		if evaluate_plain(optimized, [x], [y_0, y_1]) != evaluate_plain(circ, [x], [y_0, y_1]):
+			passed = False
+	if passed:
+		print("Optimizer: Dead gates, duplicates and constants: PASSED")
+	else:
+		print("Optimizer: Dead gates, duplicates and constants: FAILED")
+
+	# Bristol adder, whose zero wire is a constant.
+	num_bits = 8
+	circ = compile_bristol(*parse_bristol(adder_bristol_fashion(num_bits)))
+	optimized = optimize_circuit(circ, {circ.zero_bit: 0} if circ.zero_bit is not None else {})
+	passed = count_non_free_gates(optimized) <= count_non_free_gates(circ)
+	for _ in range(20):
+		(a, b) = (random.getrandbits(num_bits), random.getrandbits(num_bits))
+		outputs = evaluate_plain(optimized, garbler_bits(circ, a), evaluator_bits(circ, b))
+		if bits_to_value(outputs) != a + b:
+			passed = False
+	if passed:
+		print("Optimizer: Bristol adder, {} -> {} non-free gates: PASSED".format(count_non_free_gates(circ), count_non_free_gates(optimized)))
+	else:
+		print("Optimizer: Bristol adder, {} -> {} non-free gates: FAILED".format(count_non_free_gates(circ), count_non_free_gates(optimized)))
+
+if __name__ == '__main__':
+	test_optimizer()
+	print(optimization_report(comparator_circuit(32), optimized_comparator_circuit(32)))
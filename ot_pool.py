@@ -0,0 +1,310 @@
+############################################################
+#### Description:
+# Offline pool of precomputed random OTs, consumed online with Beaver's derandomization
+# (Beaver, "Precomputing Oblivious Transfer").
+# A random OT gives Alice two random messages (m0, m1) and Bob a random choice bit c together with m{c}.
+# Random OTs do not depend on the inputs of the parties, so all of their public key and symmetric crypto
+# can be done offline, before the inputs are known. Online, an OT of (x0, x1) with choice bit b costs one XOR per bit:
+# - Bob sends e = b XOR c.
+# - Alice sends y0 = x0 XOR m{e} and y1 = x1 XOR m{1 XOR e}.
+# - Bob recovers x{b} = y{b} XOR m{c}, and learns nothing about x{1 XOR b} since m{1 XOR c} is hidden from him.
+# Both parties consume their pools in the same order. Every entry has an index, and the online messages carry the
+# index of the first entry used, so that a pool out of sync is detected instead of silently producing wrong keys.
+# Pools are persisted in a small binary file (save / load), and a random_ot_refiller keeps them above a low water mark,
+# either synchronously or from a background thread.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from oblivious_transfer import bob_ot1, alice_ot1, bob_ot2, bob_ot_ext1, alice_ot_ext1, bob_ot_ext2
+
+import collections
+import os
+import random
+import struct
+import threading
+import time
+
+POOL_MAGIC = b'ROT1'
+# magic, side, message length, index of the first entry, number of entries
+POOL_HEADER_FORMAT = '<4sBHQQ'
+SENDER_SIDE = 0
+RECEIVER_SIDE = 1
+
+# Default length of the messages of random OTs, which is the length of wire keys.
+ROT_MESSAGE_LENGTH = 16
+
+# Base class of the two sides of the pool. entries is a deque, so that taking entries from the front is O(1),
+# and first_index is the index of entries[0] in the sequence of all random OTs generated for this pool.
+class random_ot_pool:
+	side = None
+
+	def __init__(self, length: int = ROT_MESSAGE_LENGTH, first_index: int = 0, entries=()):
+		self.length = length
+		self.first_index = first_index
+		self.entries = collections.deque(entries)
+		self.lock = threading.Lock()
+
+	def __len__(self) -> int:
+		with self.lock:
+			return len(self.entries)
+
+	# Index of the next random OT to be generated for this pool.
+	def next_index(self) -> int:
+		with self.lock:
+			return self.first_index + len(self.entries)
+
+	# Appends entries, which must be the random OTs with indices next_index(), next_index() + 1, ...
+	def extend(self, entries: list):
+		with self.lock:
+			self.entries.extend(entries)
+
+	# Removes the first count entries and returns (index of the first entry, list of entries).
+	def take(self, count: int):
+		with self.lock:
+			if count > len(self.entries):
+				raise ValueError('random_ot_pool: {} random OTs requested, only {} left'.format(count, len(self.entries)))
+			first_index = self.first_index
+			entries = [self.entries.popleft() for _ in range(count)]
+			self.first_index += count
+			return (first_index, entries)
+
+	# Writes the pool to path. The file is replaced atomically, so a crash never leaves a truncated pool behind.
+	def save(self, path: str):
+		with self.lock:
+			tmp_path = path + '.tmp'
+			with open(tmp_path, 'wb') as file:
+				file.write(struct.pack(POOL_HEADER_FORMAT, POOL_MAGIC, self.side, self.length, self.first_index, len(self.entries)))
+				for entry in self.entries:
+					file.write(self.entry_to_bytes(entry))
+			os.replace(tmp_path, path)
+
+	# Reads a pool written by save.
+	@classmethod
+	def load(cls, path: str):
+		with open(path, 'rb') as file:
+			data = file.read()
+		header_size = struct.calcsize(POOL_HEADER_FORMAT)
+		(magic, side, length, first_index, count) = struct.unpack_from(POOL_HEADER_FORMAT, data, 0)
+		if magic != POOL_MAGIC:
+			raise ValueError('random_ot_pool: bad magic {!r}'.format(magic))
+		if side != cls.side:
+			raise ValueError('random_ot_pool: {} holds side {}, expected side {}'.format(path, side, cls.side))
+		pool = cls(length, first_index)
+		entry_size = pool.entry_size()
+		if len(data) != header_size + count * entry_size:
+			raise ValueError('random_ot_pool: {} is truncated'.format(path))
+		pool.entries.extend(pool.entry_from_bytes(data[offset:offset + entry_size])
+			for offset in range(header_size, len(data), entry_size))
+		return pool
+
+# Alice's side of the pool. Each entry is a pair of random messages (m0, m1).
+class random_ot_sender_pool(random_ot_pool):
+	side = SENDER_SIDE
+
+	def entry_size(self) -> int:
+		return 2 * self.length
+
+	def entry_to_bytes(self, entry) -> bytes:
+		return entry[0] + entry[1]
+
+	def entry_from_bytes(self, data: bytes):
+		return (data[:self.length], data[self.length:])
+
+# Bob's side of the pool. Each entry is a pair (c, m{c}) of a random choice bit and the message it selects.
+class random_ot_receiver_pool(random_ot_pool):
+	side = RECEIVER_SIDE
+
+	def entry_size(self) -> int:
+		return 1 + self.length
+
+	def entry_to_bytes(self, entry) -> bytes:
+		return bytes([entry[0]]) + entry[1]
+
+	def entry_from_bytes(self, data: bytes):
+		return (data[0] != 0, data[1:])
+
+# Generates count random OTs with OT extension, see oblivious_transfer.py.
+# sender and receiver are the states returned by the setup of OT extension.
+# Returns (sender_entries, receiver_entries).
+def generate_random_ots(sender, receiver, count: int, length: int = ROT_MESSAGE_LENGTH):
+	msgs = [(os.urandom(length), os.urandom(length)) for _ in range(count)]
+	choices = [random.SystemRandom().getrandbits(1) == 1 for _ in range(count)]
+	(u, batch_state) = bob_ot_ext1(receiver, choices)
+	alice_all_ct = alice_ot_ext1(sender, u, msgs)
+	received = bob_ot_ext2(batch_state, alice_all_ct)
+	return (msgs, list(zip(choices, received)))
+
+# Generates count random OTs with the Elgamal based OT, without the setup of OT extension.
+# Returns (sender_entries, receiver_entries).
+def generate_random_ots_elgamal(count: int, length: int = ROT_MESSAGE_LENGTH):
+	sender_entries = []
+	receiver_entries = []
+	for _ in range(count):
+		choice = random.SystemRandom().getrandbits(1) == 1
+		(m_0, m_1) = (os.urandom(length), os.urandom(length))
+		((b_0, b_1), bob_sk) = bob_ot1(choice)
+		(ct_0, ct_1) = alice_ot1(b_0, b_1, m_0, m_1)
+		msg = bob_ot2(choice, bob_sk, ct_0, ct_1, length)
+		sender_entries.append((m_0, m_1))
+		receiver_entries.append((choice, msg))
+	return (sender_entries, receiver_entries)
+
+# Keeps a sender pool and a receiver pool filled.
+# When a pool falls below low_water entries, it is refilled up to capacity in batches of at most batch_size random OTs.
+# generate(count) returns (sender_entries, receiver_entries), e.g. lambda count: generate_random_ots(sender, receiver, count).
+# Both sides are refilled together since generating random OTs is interactive.
+class random_ot_refiller:
+	def __init__(self, sender_pool, receiver_pool, generate, capacity=4096, low_water=1024, batch_size=1024):
+		if not 0 <= low_water <= capacity:
+			raise ValueError('random_ot_refiller: low_water must be between 0 and capacity, found {}'.format(low_water))
+		self.sender_pool = sender_pool
+		self.receiver_pool = receiver_pool
+		self.generate = generate
+		self.capacity = capacity
+		self.low_water = low_water
+		self.batch_size = batch_size
+		self.condition = threading.Condition()
+		self.thread = None
+		self.stopped = False
+		self.refill_lock = threading.Lock()
+
+	def needs_refill(self) -> bool:
+		return len(self.receiver_pool) < self.low_water
+
+	# Refills the pools up to capacity if they are below the low water mark, or unconditionally if force is set.
+	# Returns the number of random OTs generated.
+	def refill(self, force=False) -> int:
+		with self.refill_lock:
+			if not force and not self.needs_refill():
+				return 0
+			if self.sender_pool.next_index() != self.receiver_pool.next_index():
+				raise ValueError('random_ot_refiller: sender pool ends at {}, receiver pool ends at {}'.format(
+					self.sender_pool.next_index(), self.receiver_pool.next_index()))
+			generated = 0
+			while len(self.receiver_pool) < self.capacity:
+				count = min(self.batch_size, self.capacity - len(self.receiver_pool))
+				(sender_entries, receiver_entries) = self.generate(count)
+				self.sender_pool.extend(sender_entries)
+				self.receiver_pool.extend(receiver_entries)
+				generated += count
+			return generated
+
+	# Wakes up the background worker, to be called after taking entries from the pools.
+	def notify(self):
+		with self.condition:
+			self.condition.notify()
+
+	def run(self):
+		while True:
+			with self.condition:
+				while not self.stopped and not self.needs_refill():
+					self.condition.wait()
+				if self.stopped:
+					return
+			self.refill()
+
+	# Starts the background worker, which refills the pools whenever notify is called and they are below the low water mark.
+	def start(self):
+		self.stopped = False
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		self.notify()
+
+	def stop(self):
+		with self.condition:
+			self.stopped = True
+			self.condition.notify()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+# Online step 1 (Bob): takes len(bits) random OTs from the pool and computes e = b XOR c for each choice bit b.
+# Returns ((first_index, e), state), where (first_index, e) is sent to Alice and state is kept by Bob for bob_rot2.
+def bob_rot1(receiver_pool, bits: list):
+	(first_index, entries) = receiver_pool.take(len(bits))
+	e = [(bit != 0) != choice for (bit, (choice, _)) in zip(bits, entries)]
+	return ((first_index, e), (first_index, entries))
+
+# Online step 2 (Alice): takes len(msgs) random OTs from the pool and masks msgs[j] = (x0_j, x1_j).
+# Returns the list of masked pairs, which is sent to Bob.
+def alice_rot1(sender_pool, first_index: int, e: list, msgs: list) -> list:
+	if len(e) != len(msgs):
+		raise ValueError('alice_rot1: {} choice bits for {} message pairs'.format(len(e), len(msgs)))
+	(index, entries) = sender_pool.take(len(msgs))
+	if index != first_index:
+		raise ValueError('alice_rot1: Bob used random OTs from index {}, Alice is at index {}'.format(first_index, index))
+	alice_all_ct = []
+	for (e_j, (m_0, m_1), (x_0, x_1)) in zip(e, entries, msgs):
+		if e_j:
+			(m_0, m_1) = (m_1, m_0)
+		alice_all_ct.append((bytes(a ^ b for (a, b) in zip(x_0, m_0)), bytes(a ^ b for (a, b) in zip(x_1, m_1))))
+	return alice_all_ct
+
+# Online step 3 (Bob): unmasks the message selected by each choice bit.
+def bob_rot2(state, bits: list, alice_all_ct: list) -> list:
+	(_, entries) = state
+	msgs = []
+	for (bit, (_, m_c), (y_0, y_1)) in zip(bits, entries, alice_all_ct):
+		y = y_1 if bit else y_0
+		msgs.append(bytes(a ^ b for (a, b) in zip(y, m_c)))
+	return msgs
+
+def test_ot_pool():
+	import tempfile
+
+	(sender_entries, receiver_entries) = generate_random_ots_elgamal(2)
+	sender_pool = random_ot_sender_pool()
+	receiver_pool = random_ot_receiver_pool()
+	# Stands in for OT extension, the pools only rely on the entries being valid random OTs.
+	def generate(count):
+		msgs = [(os.urandom(ROT_MESSAGE_LENGTH), os.urandom(ROT_MESSAGE_LENGTH)) for _ in range(count)]
+		choices = [random.getrandbits(1) == 1 for _ in range(count)]
+		return (msgs, [(c, m[c]) for (c, m) in zip(choices, msgs)])
+	sender_pool.extend(sender_entries)
+	receiver_pool.extend(receiver_entries)
+	refiller = random_ot_refiller(sender_pool, receiver_pool, generate, capacity=64, low_water=16, batch_size=10)
+	refiller.refill()
+
+	passed = True
+	for count in (1, 2, 30):
+		msgs = [(os.urandom(ROT_MESSAGE_LENGTH), os.urandom(ROT_MESSAGE_LENGTH)) for _ in range(count)]
+		bits = [random.getrandbits(1) for _ in range(count)]
+		((first_index, e), state) = bob_rot1(receiver_pool, bits)
+		alice_all_ct = alice_rot1(sender_pool, first_index, e, msgs)
+		received = bob_rot2(state, bits, alice_all_ct)
+		if received != [msg[bit] for (bit, msg) in zip(bits, msgs)]:
+			passed = False
+	if passed:
+		print("Random OT pool: Derandomization: PASSED")
+	else:
+		print("Random OT pool: Derandomization: FAILED")
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		sender_path = os.path.join(tmp_dir, "sender.bin")
+		receiver_path = os.path.join(tmp_dir, "receiver.bin")
+		sender_pool.save(sender_path)
+		receiver_pool.save(receiver_path)
+		loaded_sender = random_ot_sender_pool.load(sender_path)
+		loaded_receiver = random_ot_receiver_pool.load(receiver_path)
+	if (list(loaded_sender.entries) == list(sender_pool.entries) and list(loaded_receiver.entries) == list(receiver_pool.entries)
+			and loaded_receiver.first_index == receiver_pool.first_index):
+		print("Random OT pool: Save and load: PASSED")
+	else:
+		print("Random OT pool: Save and load: FAILED")
+
+	refiller.start()
+	receiver_pool.take(len(receiver_pool) - refiller.low_water + 1)
+	sender_pool.take(len(sender_pool) - refiller.low_water + 1)
+	refiller.notify()
+	deadline = time.time() + 5
+	while len(receiver_pool) < refiller.capacity and time.time() < deadline:
+		time.sleep(0.01)
+	refiller.stop()
+	if len(receiver_pool) == refiller.capacity and len(sender_pool) == refiller.capacity:
+		print("Random OT pool: Background refill: PASSED")
+	else:
+		print("Random OT pool: Background refill: FAILED")
+
+if __name__ == '__main__':
+	test_ot_pool()
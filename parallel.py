@@ -0,0 +1,242 @@
+############################################################
+#### Description:
+# Multi-process garbling and evaluation by circuit layer.
+# levelize splits the gates of a circuit into topological layers: the gates of a layer only read wires of earlier
+# layers, so they are independent of each other. Each layer is cut into chunks that run on a ProcessPoolExecutor,
+# and the next layer starts once all chunks of the layer are done.
+# Wire keys are not pickled per task. They live in a multiprocessing.shared_memory block indexed by wire id, which
+# every worker attaches to once: a task only carries its gates (and their garblings when evaluating), reads the keys of
+# their input wires from the block and writes the keys of their output wires to it.
+# Within a chunk, the gates are garbled and evaluated with the batch API of garbled_gate.py, so that the fixed-key AES
+# hashes of a chunk take one AES call.
+# Layers with fewer than min_parallel gates, such as the sequential AND / OR chain of the comparator, are run in the
+# calling process, where handing them to workers would cost more than the gates themselves.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from alice_and_bob import garble_circuit_gates, get_input_keys, count_gates, get_garbling_parameters, get_input_wire_keys
+from garbled_gate import evaluate_batch
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import metrics
+import os
+
+KEY_LENGTH = 16
+# Gates per task, so that the cost of a task is not dominated by scheduling it.
+CHUNK_SIZE = 512
+# Layers with fewer gates are run in the calling process.
+MIN_PARALLEL = 1024
+
+# Returns the list of layers of circ, where each layer is the list of the ids of its gates in circuit order.
+# The layer of a gate is one more than the latest layer among the gates writing its input wires,
+# and the gates reading only input wires are in layer 0.
+def levelize(circ) -> list:
+	wire_layers = {}
+	layers = []
+	for gate_id, (_, left_wire, right_wire, out_wire) in enumerate(circ.gates):
+		layer = max(wire_layers.get(left_wire, -1), wire_layers.get(right_wire, -1)) + 1
+		wire_layers[out_wire] = layer
+		if layer == len(layers):
+			layers.append([])
+		layers[layer].append(gate_id)
+	return layers
+
+# Returns the layers of levelize(circ) cut into chunks of at most chunk_size gates.
+def get_chunks(layer: list, chunk_size: int) -> list:
+	return [layer[k:k + chunk_size] for k in range(0, len(layer), chunk_size)]
+
+# Shared memory blocks attached by this process, by name.
+attached_blocks = {}
+
+# Returns the buffer of the shared memory block name, attaching it on first use.
+def attach(name: str):
+	if name not in attached_blocks:
+		attached_blocks[name] = shared_memory.SharedMemory(name=name)
+	return attached_blocks[name].buf
+
+# Detaches the shared memory block name from this process, if it is attached.
+def detach(name: str):
+	block = attached_blocks.pop(name, None)
+	if block is not None:
+		block.close()
+
+# Garbles the gates of one chunk. Both keys of a wire are at offset 2 * KEY_LENGTH * wire of the block name.
+# gates holds (gate_id, gate_name, left_wire, right_wire, out_wire, plain) tuples, see garble_circuit_gate for the
+# other arguments. Returns the list of garblings of the gates.
+def garble_chunk(name: str, gates: list, R, point_and_permute: bool, half_gates: bool, H, prf) -> list:
+	buf = attach(name)
+	P_lefts = []
+	P_rights = []
+	for (_, _, left_wire, right_wire, _, _) in gates:
+		l = 2 * KEY_LENGTH * left_wire
+		r = 2 * KEY_LENGTH * right_wire
+		P_lefts.append({0: bytes(buf[l:l + KEY_LENGTH]), 1: bytes(buf[l + KEY_LENGTH:l + 2 * KEY_LENGTH])})
+		P_rights.append({0: bytes(buf[r:r + KEY_LENGTH]), 1: bytes(buf[r + KEY_LENGTH:r + 2 * KEY_LENGTH])})
+	results = garble_circuit_gates([(gate_id, gate_name, plain, out_wire) for (gate_id, gate_name, _, _, out_wire, plain) in gates],
+		P_lefts, P_rights, R, point_and_permute, half_gates, H, prf)
+	for ((_, _, _, _, out_wire, plain), (_, P_out)) in zip(gates, results):
+		if not plain:
+			o = 2 * KEY_LENGTH * out_wire
+			buf[o:o + 2 * KEY_LENGTH] = P_out[0] + P_out[1]
+	return [garbling for (garbling, _) in results]
+
+# Evaluates the gates of one chunk. The key of a wire is at offset KEY_LENGTH * wire of the block name.
+# gates holds (garbling, left_wire, right_wire, out_wire, plain) tuples.
+# Returns the dict of plain outputs by wire, for the gates with plain = True.
+def evaluate_chunk(name: str, gates: list) -> dict:
+	buf = attach(name)
+	outputs = {}
+	P_outs = evaluate_batch([garbling for (garbling, _, _, _, _) in gates],
+		[bytes(buf[KEY_LENGTH * left_wire:KEY_LENGTH * (left_wire + 1)]) for (_, left_wire, _, _, _) in gates],
+		[bytes(buf[KEY_LENGTH * right_wire:KEY_LENGTH * (right_wire + 1)]) for (_, _, right_wire, _, _) in gates])
+	for ((_, _, _, out_wire, plain), P_out) in zip(gates, P_outs):
+		if plain:
+			outputs[out_wire] = P_out
+		else:
+			o = KEY_LENGTH * out_wire
+			buf[o:o + KEY_LENGTH] = P_out
+	return outputs
+
+# Runs function(name, chunk, *args) on every chunk of tasks, on executor if there are at least min_parallel tasks
+# and in this process otherwise. Returns the list of results in the order of the chunks.
+def run_layer(executor, function, name: str, tasks: list, args: tuple, chunk_size: int, min_parallel: int) -> list:
+	if executor is None or len(tasks) < min_parallel:
+		return [function(name, tasks, *args)]
+	futures = [executor.submit(function, name, chunk, *args) for chunk in get_chunks(tasks, chunk_size)]
+	return [future.result() for future in futures]
+
+# Runs run(executor) with executor, or with a new ProcessPoolExecutor of max_workers processes if executor is None.
+def with_executor(executor, max_workers, run):
+	if executor is not None:
+		return run(executor)
+	with ProcessPoolExecutor(max_workers=max_workers) as new_executor:
+		return run(new_executor)
+
+# Same as garble_circuit in alice_and_bob.py, with the gates of each layer garbled in parallel.
+# executor is a ProcessPoolExecutor, which is created with max_workers processes (default: os.cpu_count()) if None.
+# Reusing an executor across circuits saves starting the processes.
+def garble_circuit_parallel(circ, free_xor=False, point_and_permute=False, half_gates=False, fixed_key=False, seed=None,
+		executor=None, max_workers=None, chunk_size=CHUNK_SIZE, min_parallel=MIN_PARALLEL):
+	(point_and_permute, R, H, prf) = get_garbling_parameters(free_xor, point_and_permute, half_gates, fixed_key, seed)
+	count_gates(circ, "garble")
+
+	block = shared_memory.SharedMemory(create=True, size=max(1, 2 * KEY_LENGTH * circ.num_wires))
+	try:
+		with metrics.phase("garble"):
+			wire_keys = get_input_wire_keys(circ, R, point_and_permute, prf)
+			for (wire, P) in wire_keys.items():
+				block.buf[2 * KEY_LENGTH * wire:2 * KEY_LENGTH * (wire + 1)] = P[0] + P[1]
+			x_keys = get_input_keys(circ.x_wires, wire_keys)
+			y_keys = get_input_keys(circ.y_wires, wire_keys)
+
+			output_wires = set(circ.output_wires)
+			garbled_circuit = [None] * len(circ.gates)
+			def run(executor):
+				for layer in levelize(circ):
+					tasks = [(gate_id,) + circ.gates[gate_id] + (circ.gates[gate_id][3] in output_wires,) for gate_id in layer]
+					results = run_layer(executor, garble_chunk, block.name, tasks, (R, point_and_permute, half_gates, H, prf), chunk_size, min_parallel)
+					for (gate_id, garbling) in zip(layer, (garbling for garblings in results for garbling in garblings)):
+						garbled_circuit[gate_id] = garbling
+			with_executor(executor, max_workers, run)
+			return (tuple(garbled_circuit), x_keys, y_keys)
+	finally:
+		detach(block.name)
+		block.close()
+		block.unlink()
+
+# Same as evaluate_circuit in alice_and_bob.py, with the gates of each layer evaluated in parallel.
+# See garble_circuit_parallel for executor, max_workers, chunk_size and min_parallel.
+def evaluate_circuit_parallel(circ, garbled_circuit, alice_keys, bob_keys, executor=None, max_workers=None,
+		chunk_size=CHUNK_SIZE, min_parallel=MIN_PARALLEL) -> list:
+	count_gates(circ, "evaluate")
+	block = shared_memory.SharedMemory(create=True, size=max(1, KEY_LENGTH * circ.num_wires))
+	try:
+		with metrics.phase("evaluate"):
+			for (input_wires, input_keys) in ((circ.x_wires, alice_keys), (circ.y_wires, bob_keys)):
+				for i, wires in input_wires.items():
+					for j, wire in enumerate(wires):
+						block.buf[KEY_LENGTH * wire:KEY_LENGTH * (wire + 1)] = input_keys[i][j]
+
+			output_wires = set(circ.output_wires)
+			outputs = {}
+			def run(executor):
+				for layer in levelize(circ):
+					tasks = [(garbled_circuit[gate_id],) + circ.gates[gate_id][1:] + (circ.gates[gate_id][3] in output_wires,) for gate_id in layer]
+					for chunk_outputs in run_layer(executor, evaluate_chunk, block.name, tasks, (), chunk_size, min_parallel):
+						outputs.update(chunk_outputs)
+			with_executor(executor, max_workers, run)
+			return [outputs[wire] if wire in outputs else bytes(block.buf[KEY_LENGTH * wire:KEY_LENGTH * (wire + 1)]) for wire in circ.output_wires]
+	finally:
+		detach(block.name)
+		block.close()
+		block.unlink()
+
+def test_parallel():
+	from alice_and_bob import garble_circuit, evaluate_circuit, get_alice_keys, batch_bit_decomposition
+	from circuit import batch_comparator_circuit
+	from circuit_file import serialize_gate
+	import random
+
+	(num_bits, num_pairs) = (8, 64)
+	circ = batch_comparator_circuit(num_bits, num_pairs)
+	all_options = ({}, {"free_xor": True, "point_and_permute": True}, {"half_gates": True}, {"half_gates": True, "fixed_key": True})
+	with ProcessPoolExecutor(max_workers=2) as executor:
+		for options in all_options:
+			alice_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+			bob_values = [random.getrandbits(num_bits) for _ in range(num_pairs)]
+			expected = [x >= y for (x, y) in zip(alice_values, bob_values)]
+			# Small chunks and no serial layers, so that every layer is spread across the workers.
+			(garbled_circuit, x_keys, y_keys) = garble_circuit_parallel(circ, **options, executor=executor, chunk_size=16, min_parallel=0)
+			alice_keys = get_alice_keys(x_keys, *batch_bit_decomposition(alice_values, num_bits))
+			bob_keys = get_alice_keys(y_keys, *batch_bit_decomposition(bob_values, num_bits))
+			outputs = evaluate_circuit_parallel(circ, garbled_circuit, alice_keys, bob_keys, executor=executor, chunk_size=16, min_parallel=0)
+			passed = [int.from_bytes(val_out, byteorder='big') != 0 for val_out in outputs] == expected
+			passed = passed and evaluate_circuit(circ, garbled_circuit, alice_keys, bob_keys) == outputs
+
+			# Parallel evaluation of a serially garbled circuit.
+			(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+			alice_keys = get_alice_keys(x_keys, *batch_bit_decomposition(alice_values, num_bits))
+			bob_keys = get_alice_keys(y_keys, *batch_bit_decomposition(bob_values, num_bits))
+			outputs = evaluate_circuit_parallel(circ, garbled_circuit, alice_keys, bob_keys, executor=executor, chunk_size=16, min_parallel=0)
+			passed = passed and [int.from_bytes(val_out, byteorder='big') != 0 for val_out in outputs] == expected
+			# With a seed, the parallel garbler gives the same garbled circuit as the serial one.
+			if options.get("half_gates"):
+				seed = os.urandom(16)
+				(garbled_circuit, _, _) = garble_circuit(circ, **options, seed=seed)
+				(garbled_circuit_parallel, _, _) = garble_circuit_parallel(circ, **options, seed=seed, executor=executor, chunk_size=16, min_parallel=0)
+				passed = passed and all(serialize_gate(a, gate_id)[:3] == serialize_gate(b, gate_id)[:3]
+					for (gate_id, (a, b)) in enumerate(zip(garbled_circuit, garbled_circuit_parallel)))
+			if passed:
+				print("Parallel: Correctness for options = {}: PASSED".format(options))
+			else:
+				print("Parallel: Correctness for options = {}: FAILED".format(options))
+
+# Reports garbling and evaluation throughput of a batch comparator with about num_gates gates for several worker counts.
+def benchmark_parallel(num_gates=1000000, options={"half_gates": True, "fixed_key": True}):
+	from alice_and_bob import get_alice_keys
+	from circuit import batch_comparator_circuit
+	import time
+
+	num_bits = 32
+	circ = batch_comparator_circuit(num_bits, num_gates // (4 * (num_bits - 1) + 1))
+	num_x = len(circ.x_wires)
+	for max_workers in (1, 2, 4, 8, 16):
+		if max_workers > 1 and max_workers > os.cpu_count():
+			break
+		with ProcessPoolExecutor(max_workers=max_workers) as executor:
+			garble_st = time.perf_counter()
+			(garbled_circuit, x_keys, y_keys) = garble_circuit_parallel(circ, **options, executor=executor)
+			garble_et = time.perf_counter()
+			alice_keys = get_alice_keys(x_keys, *[0] * num_x)
+			bob_keys = get_alice_keys(y_keys, *[1] * num_x)
+			evaluate_st = time.perf_counter()
+			evaluate_circuit_parallel(circ, garbled_circuit, alice_keys, bob_keys, executor=executor)
+			evaluate_et = time.perf_counter()
+		print("{} gates, {} workers: garbling: {:.0f} gates/s, evaluation: {:.0f} gates/s".format(
+			len(circ.gates), max_workers, len(circ.gates) / (garble_et - garble_st), len(circ.gates) / (evaluate_et - evaluate_st)))
+
+if __name__ == '__main__':
+	test_parallel()
+	# benchmark_parallel()
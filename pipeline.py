@@ -0,0 +1,330 @@
+############################################################
+#### Description:
+# Pipelined protocol runner, where the phases of the protocol form a dependency graph instead of a fixed sequence.
+# test_garbled_circuits_once and alice.py / bob.py run garble, Alice's keys, bob_ot1, alice_ot1, bob_ot2 and evaluate
+# one after another, although Bob's OT messages do not depend on the garbled circuit at all.
+# phase_graph runs every phase on a thread pool as soon as the phases it depends on are done, and records when each
+# phase started and ended and the CPU time of its thread, which leaves out the time spent waiting for the GIL.
+# Its report compares:
+# - sequential: the sum of the phase CPU times, i.e. the latency of running the phases one after another,
+# - critical_path: the longest chain of dependent phases, i.e. the latency with one worker per ready phase,
+# - wall: the measured latency. The Elgamal OTs and the garbled gates are pure Python and hold the GIL, so on
+#   one process wall stays close to sequential. critical_path is the latency when Alice and Bob run on separate
+#   machines or cores.
+# protocol_graph builds the graph of one comparison, with one phase per gate and per input bit of Bob:
+# - keys: Alice samples the input wire keys, and alice_keys selects her keys.
+# - With the Elgamal OT, bob_ot1/i, alice_ot1/i and bob_ot2/i run the OTs of input bit i. bob_ot1/i depends on nothing,
+#   so Bob generates his public keys while Alice garbles. With the EC OT, ec_ot_setup, bob_ec_ot1, alice_ec_ot1 and
+#   bob_ec_ot2 run one batch for all of Bob's keys, see oblivious_transfer.py.
+# - garble/g garbles gate g once the keys of its input wires exist, and hands the garbled gate to Bob.
+# - evaluate/g evaluates gate g as soon as its garbled gate and the labels of both its input wires are available,
+#   so evaluation starts on Alice's side of the circuit before Bob's OT is done.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from alice_and_bob import get_garbling_parameters, get_input_wire_keys, get_input_keys, garble_circuit_gate, get_alice_keys, bit_decomposition, \
+	leading_zero_seed
+from circuit import COMPARATOR_CIRCUITS
+from garbled_gate import evaluate
+from oblivious_transfer import bob_ot1, alice_ot1, bob_ot2, alice_ec_ot_setup, ec_ot_receiver, bob_ec_ot1, alice_ec_ot1, bob_ec_ot2
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import random
+import time
+
+# Graph of named phases. add(name, run, deps) adds a phase that runs run(values) once the phases deps are done,
+# where values maps each name of deps to the value returned by its phase.
+class phase_graph:
+	def __init__(self):
+		self.deps = {}
+		self.runs = {}
+		self.dependents = {}
+		# times[name] = (start, end) in seconds since the start of run, and cpu_times[name] the CPU time of the phase.
+		self.times = {}
+		self.cpu_times = {}
+		self.wall = None
+
+	# Phases can only depend on phases added before them, so the graph has no cycle.
+	def add(self, name: str, run, deps=()):
+		if name in self.deps:
+			raise ValueError('phase_graph.add: phase {} already exists'.format(name))
+		for dep in deps:
+			if dep not in self.deps:
+				raise ValueError('phase_graph.add: phase {} depends on unknown phase {}'.format(name, dep))
+			self.dependents[dep].append(name)
+		self.deps[name] = tuple(deps)
+		self.runs[name] = run
+		self.dependents[name] = []
+
+	def run_phase(self, name: str, values: dict, start: float):
+		phase_start = time.perf_counter()
+		cpu_start = time.thread_time()
+		value = self.runs[name](values)
+		self.cpu_times[name] = time.thread_time() - cpu_start
+		self.times[name] = (phase_start - start, time.perf_counter() - start)
+		return value
+
+	# Runs every phase on max_workers threads as soon as its dependencies are done.
+	# Returns the dict mapping every phase to its value. An exception raised by a phase is raised here.
+	def run(self, max_workers: int = 16) -> dict:
+		results = {}
+		remaining = {name: len(deps) for (name, deps) in self.deps.items()}
+		self.times = {}
+		self.cpu_times = {}
+		with ThreadPoolExecutor(max_workers) as executor:
+			start = time.perf_counter()
+
+			def submit(name):
+				return executor.submit(self.run_phase, name, {dep: results[dep] for dep in self.deps[name]}, start)
+
+			pending = {submit(name): name for (name, count) in remaining.items() if count == 0}
+			while pending:
+				(done, _) = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					name = pending.pop(future)
+					results[name] = future.result()
+					for dependent in self.dependents[name]:
+						remaining[dependent] -= 1
+						if remaining[dependent] == 0:
+							pending[submit(dependent)] = dependent
+			self.wall = time.perf_counter() - start
+		return results
+
+	# Returns the CPU time of phase name.
+	def duration(self, name: str) -> float:
+		return self.cpu_times[name]
+
+	# Returns (latency, path) of the longest chain of dependent phases, weighted by the CPU times of the last run.
+	def critical_path(self) -> (float, list):
+		finish = {}
+		previous = {}
+		# self.deps is in insertion order, which is a topological order.
+		for (name, deps) in self.deps.items():
+			before = max(deps, key=lambda dep: finish[dep], default=None)
+			previous[name] = before
+			finish[name] = (finish[before] if before is not None else 0) + self.duration(name)
+		name = max(finish, key=finish.get)
+		latency = finish[name]
+		path = []
+		while name is not None:
+			path.append(name)
+			name = previous[name]
+		return (latency, path[::-1])
+
+	# Returns the time of running the phases one after another.
+	def sequential_total(self) -> float:
+		return sum(self.duration(name) for name in self.deps)
+
+	# Returns the latencies of the last run and the time spent per kind of phase, i.e. per name up to the first "/".
+	def report(self) -> dict:
+		(latency, path) = self.critical_path()
+		kinds = {}
+		for name in self.deps:
+			kind = name.split("/")[0]
+			kinds[kind] = kinds.get(kind, 0) + self.duration(name)
+		return {
+			"wall": self.wall,
+			"critical_path": latency,
+			"sequential": self.sequential_total(),
+			"path": path,
+			"phases": kinds,
+		}
+
+# Builds the phase_graph of the comparison of circ on Alice's bits alice_bits and Bob's bits bob_bits, see the
+# description at the top of this file. ot is "elgamal" or "ec", and keyword arguments select the garbling options of
+# garble_circuit. The value of the phase "outputs" is the list of bytes objects on the output wires of circ.
+def protocol_graph(circ, alice_bits, bob_bits, ot="elgamal", **options) -> phase_graph:
+	if ot not in ("elgamal", "ec"):
+		raise ValueError('protocol_graph: unknown OT method {}'.format(ot))
+	graph = phase_graph()
+
+	def keys(values):
+		(point_and_permute, R, H, prf) = get_garbling_parameters(**options)
+		wire_keys = get_input_wire_keys(circ, R, point_and_permute, prf)
+		return {
+			"parameters": (R, point_and_permute, options.get("half_gates", False), H, prf),
+			"wire_keys": wire_keys,
+			"x_keys": get_input_keys(circ.x_wires, wire_keys),
+			"y_keys": get_input_keys(circ.y_wires, wire_keys),
+		}
+	graph.add("keys", keys)
+	graph.add("alice_keys", lambda values: get_alice_keys(values["keys"]["x_keys"], *alice_bits), ("keys",))
+
+	# bob_label[i] is the phase whose value maps (i, j) to Bob's key on fan-out wire j of input bit i, like bob_keys.
+	bob_label = {}
+	if ot == "elgamal":
+		for i, wires in circ.y_wires.items():
+			bit = bob_bits[i] != 0
+
+			def request(values, count=len(wires), bit=bit):
+				return [bob_ot1(bit) for _ in range(count)]
+
+			def answer(values, i=i):
+				y_keys = values["keys"]["y_keys"]
+				return [alice_ot1(b_0, b_1, y_keys[i][0][j], y_keys[i][1][j])
+					for j, ((b_0, b_1), _) in enumerate(values["bob_ot1/{}".format(i)])]
+
+			def receive(values, i=i, bit=bit):
+				bob_sk = [sk for (_, sk) in values["bob_ot1/{}".format(i)]]
+				return {i: {j: bob_ot2(bit, sk, ct_0, ct_1) for j, (sk, (ct_0, ct_1)) in enumerate(zip(bob_sk, values["alice_ot1/{}".format(i)]))}}
+
+			graph.add("bob_ot1/{}".format(i), request)
+			graph.add("alice_ot1/{}".format(i), answer, ("keys", "bob_ot1/{}".format(i)))
+			graph.add("bob_ot2/{}".format(i), receive, ("bob_ot1/{}".format(i), "alice_ot1/{}".format(i)))
+			bob_label[i] = "bob_ot2/{}".format(i)
+	else:
+		pairs = [(i, j) for (i, wires) in circ.y_wires.items() for j in range(len(wires))]
+
+		def request(values):
+			receiver = ec_ot_receiver(values["ec_ot_setup"].public_key)
+			return bob_ec_ot1(receiver, [bob_bits[i] != 0 for (i, _) in pairs])
+
+		def answer(values):
+			y_keys = values["keys"]["y_keys"]
+			(bob_all_B, _) = values["bob_ec_ot1"]
+			return alice_ec_ot1(values["ec_ot_setup"], bob_all_B, [(y_keys[i][0][j], y_keys[i][1][j]) for (i, j) in pairs])
+
+		def receive(values):
+			(_, batch_state) = values["bob_ec_ot1"]
+			bob_keys = {i: {} for i in circ.y_wires}
+			for ((i, j), msg) in zip(pairs, bob_ec_ot2(batch_state, values["alice_ec_ot1"])):
+				bob_keys[i][j] = msg
+			return bob_keys
+
+		graph.add("ec_ot_setup", lambda values: alice_ec_ot_setup())
+		graph.add("bob_ec_ot1", request, ("ec_ot_setup",))
+		graph.add("alice_ec_ot1", answer, ("keys", "ec_ot_setup", "bob_ec_ot1"))
+		graph.add("bob_ec_ot2", receive, ("bob_ec_ot1", "alice_ec_ot1"))
+		bob_label = {i: "bob_ec_ot2" for i in circ.y_wires}
+
+	# For every wire, the phases whose values hold its keys and its label, and a function that reads the label.
+	garble_source = {}
+	evaluate_source = {}
+	for (input_wires, label_phase) in ((circ.x_wires, lambda i: "alice_keys"), (circ.y_wires, lambda i: bob_label[i])):
+		for i, wires in input_wires.items():
+			for j, wire in enumerate(wires):
+				garble_source[wire] = ("keys", lambda value, wire=wire: value["wire_keys"][wire])
+				evaluate_source[wire] = (label_phase(i), lambda value, i=i, j=j: value[i][j])
+	output_wires = set(circ.output_wires)
+
+	for gate_id, (gate_name, left_wire, right_wire, out_wire) in enumerate(circ.gates):
+		(left_garble, left_keys) = garble_source[left_wire]
+		(right_garble, right_keys) = garble_source[right_wire]
+
+		def garble_gate(values, gate_id=gate_id, gate_name=gate_name, left_garble=left_garble, left_keys=left_keys,
+				right_garble=right_garble, right_keys=right_keys, out_wire=out_wire):
+			(R, point_and_permute, half_gates, H, prf) = values["keys"]["parameters"]
+			return garble_circuit_gate(gate_id, gate_name, left_keys(values[left_garble]), right_keys(values[right_garble]),
+				out_wire in output_wires, R, point_and_permute, half_gates, H, prf, out_wire)
+
+		garble_name = "garble/{}".format(gate_id)
+		graph.add(garble_name, garble_gate, tuple({"keys", left_garble, right_garble}))
+		garble_source[out_wire] = (garble_name, lambda value: value[1])
+
+		(left_evaluate, left_label) = evaluate_source[left_wire]
+		(right_evaluate, right_label) = evaluate_source[right_wire]
+
+		def evaluate_gate(values, garble_name=garble_name, left_evaluate=left_evaluate, left_label=left_label,
+				right_evaluate=right_evaluate, right_label=right_label):
+			(garbling, _) = values[garble_name]
+			return evaluate(garbling, left_label(values[left_evaluate]), right_label(values[right_evaluate]))
+
+		evaluate_name = "evaluate/{}".format(gate_id)
+		graph.add(evaluate_name, evaluate_gate, tuple({garble_name, left_evaluate, right_evaluate}))
+		evaluate_source[out_wire] = (evaluate_name, lambda value: value)
+
+	graph.add("outputs", lambda values: [evaluate_source[wire][1](values[evaluate_source[wire][0]]) for wire in circ.output_wires],
+		tuple({evaluate_source[wire][0] for wire in circ.output_wires}))
+	return graph
+
+# Compares alice_value >= bob_value on the comparator of num_bits bits with the pipelined runner.
+# Returns (output, report), where output is the bool x >= y and report is phase_graph.report of the run.
+def compare_pipelined(alice_value: int, bob_value: int, num_bits: int, ot="elgamal", shape="ripple", max_workers=16, **options):
+	circ = COMPARATOR_CIRCUITS[shape](num_bits)
+	graph = protocol_graph(circ, bit_decomposition(alice_value, num_bits), bit_decomposition(bob_value, num_bits), ot, **options)
+	(output,) = graph.run(max_workers)["outputs"]
+	return (int.from_bytes(output, byteorder='big') != 0, graph.report())
+
+# Returns the phases of path, with runs of phases of the same kind shortened to "kind x count".
+def format_path(path: list) -> str:
+	runs = []
+	for name in path:
+		kind = name.split("/")[0]
+		if runs and runs[-1][0] == kind and kind != name:
+			runs[-1][1] += 1
+		else:
+			runs.append([kind if kind != name else name, 1])
+	return " -> ".join(name if count == 1 else "{} x{}".format(name, count) for (name, count) in runs)
+
+def format_report(report: dict) -> str:
+	return "wall {:.3f} s, critical path {:.3f} s, sequential {:.3f} s ({:.1f}x)".format(
+		report["wall"], report["critical_path"], report["sequential"], report["sequential"] / report["critical_path"])
+
+# Keeps the CPU busy for about seconds and returns value.
+def spin(seconds: float, value=None):
+	end = time.thread_time() + seconds
+	while time.thread_time() < end:
+		pass
+	return value
+
+def test_phase_graph():
+	graph = phase_graph()
+	graph.add("a", lambda values: spin(0.1, 1))
+	graph.add("b", lambda values: spin(0.1, 2))
+	graph.add("c", lambda values: spin(0.05, values["a"] + values["b"]), ("a", "b"))
+	results = graph.run()
+	report = graph.report()
+	# a and b are independent, so only one of them is on the critical path.
+	if results["c"] == 3 and len(report["path"]) == 2 and report["path"][-1] == "c" and report["critical_path"] < 0.2 < report["sequential"]:
+		print("Pipeline: Phase graph: PASSED")
+	else:
+		print("Pipeline: Phase graph: FAILED")
+
+	try:
+		graph.add("d", lambda values: None, ("e",))
+		print("Pipeline: Unknown dependency: FAILED")
+	except ValueError:
+		print("Pipeline: Unknown dependency: PASSED")
+
+def test_pipeline(ot="ec", **options):
+	passed = True
+	for num_bits in (1, 4, 16):
+		for shape in COMPARATOR_CIRCUITS:
+			alice_value = random.getrandbits(num_bits)
+			bob_value = random.getrandbits(num_bits)
+			(output, report) = compare_pipelined(alice_value, bob_value, num_bits, ot, shape, **options)
+			if output != (alice_value >= bob_value) or report["critical_path"] > report["sequential"]:
+				passed = False
+	if passed:
+		print("Pipeline: Correctness with OT = {}, options = {}: PASSED".format(ot, options))
+	else:
+		print("Pipeline: Correctness with OT = {}, options = {}: FAILED".format(ot, options))
+
+# Runs a 1 bit comparison with the Elgamal OT, where Bob's key starts with 0x00. Elgamal decryption drops the leading
+# zero bytes, so this fails unless bob_ot2 pads the key back to its length.
+def test_pipeline_elgamal():
+	(seed, _, bit) = leading_zero_seed(COMPARATOR_CIRCUITS["ripple"](1))
+	(output, _) = compare_pipelined(1, bit, 1, "elgamal", seed=seed)
+	if output == (1 >= bit):
+		print("Pipeline: Correctness with OT = elgamal and a leading zero byte: PASSED")
+	else:
+		print("Pipeline: Correctness with OT = elgamal and a leading zero byte: FAILED")
+
+# Runs the 2 bit comparison of test_garbled_circuits_once as a phase graph, with the Elgamal OT by default,
+# and prints the time per kind of phase and the latencies.
+def benchmark_pipeline(num_bits=2, ot="elgamal", **options):
+	(_, report) = compare_pipelined(1, 2, num_bits, ot, **options)
+	for (kind, seconds) in sorted(report["phases"].items(), key=lambda item: -item[1]):
+		print("{:<12} {:.4f} s".format(kind, seconds))
+	print("critical path: " + format_path(report["path"]))
+	print(format_report(report))
+
+if __name__ == '__main__':
+	test_phase_graph()
+	test_pipeline()
+	test_pipeline(half_gates=True, fixed_key=True)
+	test_pipeline(free_xor=True, point_and_permute=True)
+	test_pipeline_elgamal()
+	# benchmark_pipeline()
+	# benchmark_pipeline(32, "ec", half_gates=True, fixed_key=True)
@@ -42,5 +42,6 @@ def test_ske_twice():
 	else:
 		print("SKE Correctness: PASSED")
 
-# test_ske()
-test_ske_twice()
\ No newline at end of file
+if __name__ == '__main__':
+	# test_ske()
+	test_ske_twice()
@@ -0,0 +1,90 @@
+############################################################
+#### Description:
+# Streaming garbling and evaluation pipeline.
+# Alice garbles the circuit gate by gate (garble_circuit_stream in alice_and_bob.py) and writes each garbled gate
+# to a pipe as soon as it is produced (write_gate_stream in circuit_file.py).
+# Bob reads the gates one at a time (read_gate_stream) and evaluates each gate as soon as it arrives (evaluate_circuit).
+# Neither party holds the whole garbled circuit: apart from the input keys, memory is bounded by the live wires of the
+# circuit and the pipe buffer, and with Alice and Bob on different cores the end-to-end latency approaches
+# max(garbling time, evaluation time) instead of their sum.
+
+# Author: Nikhil Vanjani
+############################################################
+
+from alice_and_bob import garble_circuit, garble_circuit_stream, evaluate_circuit, get_alice_keys, bit_decomposition
+from circuit import comparator_circuit
+from circuit_file import write_keys, read_keys, write_gate_stream, read_gate_stream
+
+import multiprocessing
+import os
+import random
+import time
+
+# Alice's side of run_streaming. Writes alice's keys, bob's keys and the garbled gate stream to the pipe write_fd.
+# In the full protocol Bob obtains his keys via OT. Here Alice selects them directly, so that the pipeline
+# can be measured on its own.
+def alice_streaming(write_fd, circ, alice_bits, bob_bits, options):
+	with os.fdopen(write_fd, "wb") as file:
+		(gate_stream, x_keys, y_keys) = garble_circuit_stream(circ, **options)
+		write_keys(file, get_alice_keys(x_keys, *alice_bits))
+		write_keys(file, get_alice_keys(y_keys, *bob_bits))
+		write_gate_stream(file, gate_stream)
+
+# Runs Alice and Bob in two processes connected by a pipe, see the description at the top of this file.
+# Keyword arguments select the garbling options of garble_circuit_stream.
+# Returns the list of bytes objects on the output wires of circ.
+def run_streaming(circ, alice_bits, bob_bits, **options) -> list:
+	(read_fd, write_fd) = os.pipe()
+	context = multiprocessing.get_context("fork")
+	alice = context.Process(target=alice_streaming, args=(write_fd, circ, alice_bits, bob_bits, options))
+	alice.start()
+	os.close(write_fd)
+	try:
+		with os.fdopen(read_fd, "rb") as file:
+			alice_keys = read_keys(file)
+			bob_keys = read_keys(file)
+			return evaluate_circuit(circ, read_gate_stream(file), alice_keys, bob_keys)
+	finally:
+		alice.join()
+
+def test_streaming():
+	num_bits = 16
+	circ = comparator_circuit(num_bits)
+	for options in ({}, {"point_and_permute": True, "free_xor": True}, {"half_gates": True, "fixed_key": True}):
+		passed = True
+		for _ in range(5):
+			alice_input = random.getrandbits(num_bits)
+			bob_input = random.getrandbits(num_bits)
+			(val_out,) = run_streaming(circ, bit_decomposition(alice_input, num_bits), bit_decomposition(bob_input, num_bits), **options)
+			if (int.from_bytes(val_out, byteorder='big') != 0) != (alice_input >= bob_input):
+				passed = False
+		if passed:
+			print("Streaming: Correctness for options = {}: PASSED".format(options))
+		else:
+			print("Streaming: Correctness for options = {}: FAILED".format(options))
+
+# Compares garbling and evaluation time of the whole circuit with the end-to-end time of the streaming pipeline.
+def benchmark_streaming(num_bits=4096, **options):
+	circ = comparator_circuit(num_bits)
+	alice_bits = bit_decomposition(random.getrandbits(num_bits), num_bits)
+	bob_bits = bit_decomposition(random.getrandbits(num_bits), num_bits)
+
+	garble_st = time.time()
+	(garbled_circuit, x_keys, y_keys) = garble_circuit(circ, **options)
+	garble_et = time.time()
+	evaluate_st = time.time()
+	evaluate_circuit(circ, garbled_circuit, get_alice_keys(x_keys, *alice_bits), get_alice_keys(y_keys, *bob_bits))
+	evaluate_et = time.time()
+	garble_time = garble_et - garble_st
+	evaluate_time = evaluate_et - evaluate_st
+
+	streaming_st = time.time()
+	run_streaming(circ, alice_bits, bob_bits, **options)
+	streaming_et = time.time()
+	print("{} gates, options = {}: Garbling time: {}, Evaluate time: {}, sum: {}, max: {}, Streaming end-to-end time: {} ({} cores)".format(
+		len(circ.gates), options, garble_time, evaluate_time, garble_time + evaluate_time, max(garble_time, evaluate_time),
+		streaming_et - streaming_st, os.cpu_count()))
+
+if __name__ == '__main__':
+	test_streaming()
+	# benchmark_streaming(half_gates=True, fixed_key=True)